@@ -0,0 +1,53 @@
+"""A bounded cache of evaluations for the searches in ai.games.
+
+Leaves reached again by another move order (and the positions iterative
+deepening revisits on every iteration) get their score from the cache
+instead of being evaluated again. The least recently used entry makes
+way once the cache is full."""
+
+from collections import OrderedDict
+
+
+class EvalCache(object):
+    """Scores keyed by an int that identifies the position and whose
+    point of view the score is from; see Checkerboard.utility. Counts the
+    hits and misses of its lookups."""
+
+    def __init__(self, size=2 ** 16):
+        if size < 1:
+            raise ValueError("Cache size must be at least 1")
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the score stored for key, or None."""
+        score = self.entries.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return score
+
+    def put(self, key, score):
+        entries = self.entries
+        entries[key] = score
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return ('<EvalCache %d/%d entries hits=%d misses=%d>'
+                % (len(self.entries), self.size, self.hits, self.misses))
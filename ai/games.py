@@ -4,6 +4,10 @@
 
 from ai.utils import infinity, argmax, argmax_random_tie, num_or_str, Dict, update
 from ai.utils import if_, Struct, abstract
+from ai.ordering import MoveOrdering
+from ai.transposition import TranspositionTable
+from util.globalconst import MAX_DEPTH, hashfALPHA, hashfBETA, hashfEXACT
+from time import monotonic
 import random
 
 # Minimax Search
@@ -71,48 +75,262 @@ def alphabeta_full_search(state, game):
     return action
 
 
-def alphabeta_search(state, game, d=4, cutoff_test=None, eval_fn=None):
+class SearchTimeout(Exception):
+    """Raised inside a search once its deadline has passed."""
+
+
+class Quiescence:
+    """Settings and node counters for the capture search that
+    alphabeta_search runs past its depth limit. A position beyond the limit
+    is only evaluated once it is quiet, that is once the side to move has
+    no capture; until then the search goes on through the captures, which
+    are forced (so there is no standing pat). max_depth caps the number
+    of extra plies; None lets the captures run out by themselves."""
+
+    def __init__(self, max_depth=None):
+        self.max_depth = max_depth
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0
+        self.max_ply = 0
+
+    def extend(self, game, state, ply):
+        """Count a node ply plies past the depth limit, and return True if
+        the search should carry on from it."""
+        self.nodes += 1
+        if ply > self.max_ply:
+            self.max_ply = ply
+        if self.max_depth is not None and ply >= self.max_depth:
+            return False
+        return bool(game.captures_available(state))
+
+
+def alphabeta_search(state, game, d=4, cutoff_test=None, eval_fn=None,
+                     table=None, deadline=None, quiescence=None,
+                     ordering=None, stats=None):
     """Search game to determine best action; use alpha-beta pruning.
-    This version cuts off search and uses an evaluation function."""
+    This version cuts off search and uses an evaluation function.
+    If a TranspositionTable is given, every node probes it before searching,
+    tries its stored best move first, and stores its own result afterwards.
+    If a deadline (a time.monotonic() value) is given, SearchTimeout is
+    raised once it passes, after the st has been restored.
+    If a Quiescence is given, positions past depth d are searched on until
+    they are quiet, and its counters are added to.
+    If a MoveOrdering is given, it orders the moves at every node and
+    learns from the cutoffs found.
+    If a SearchStats is given, the search's counts are added to it.
+    Every node below the root is first looked up with game.probe, and a
+    position it knows gets its exact score without being searched."""
     player = game.to_move(state)
 
+    def count_probe(score):
+        stats.tt_probes += 1
+        stats.tt_hits += score is not None
+
+    def count_cutoff(index):
+        stats.cutoffs += 1
+        stats.first_move_cutoffs += index == 0
+
+    def successors(st, first, ply):
+        if ordering is None:
+            return game.successors(st, first)
+        return game.successors(st, first,
+                               ordering.order(game.legal_moves(st), ply,
+                                              first))
+
+    def quiet(st, depth):
+        return (quiescence is None or depth <= d
+                or not quiescence.extend(game, st, depth - d - 1))
+
     def max_value(st, alpha, beta, depth):
-        if cutoff_test(st, depth):
+        if stats is not None:
+            stats.nodes += 1
+        if deadline is not None and monotonic() > deadline:
+            raise SearchTimeout()
+        score = game.probe(st, depth + 1)
+        if score is not None:
+            if stats is not None:
+                stats.tb_hits += 1
+            return score
+        first = None
+        if table is not None:
+            key = game.hash_key(st)
+            score, first = table.probe(key, d + 1 - depth, alpha, beta)
+            if stats is not None:
+                count_probe(score)
+            if score is not None:
+                return score
+        if cutoff_test(st, depth) and quiet(st, depth):
             return eval_fn(st)
+        alpha_orig = alpha
+        best = None
         v = -infinity
-        successor = game.successors(st)
-        for (a, s) in successor:
-            v = max(v, min_value(s, alpha, beta, depth + 1))
-            if v >= beta:
-                successor.close()
-                return v
-            alpha = max(alpha, v)
+        successor = successors(st, first, depth + 1)
+        try:
+            for i, (a, s) in enumerate(successor):
+                score = min_value(s, alpha, beta, depth + 1)
+                if score > v:
+                    v, best = score, a
+                if v >= beta:
+                    successor.close()
+                    if ordering is not None:
+                        ordering.cutoff(a, depth + 1, d + 1 - depth)
+                    if stats is not None:
+                        count_cutoff(i)
+                    break
+                alpha = max(alpha, v)
+        except SearchTimeout:
+            successor.close()
+            raise
+        if table is not None:
+            store(key, d + 1 - depth, alpha_orig, beta, v, best)
         return v
 
     def min_value(st, alpha, beta, depth):
-        if cutoff_test(st, depth):
+        if stats is not None:
+            stats.nodes += 1
+        if deadline is not None and monotonic() > deadline:
+            raise SearchTimeout()
+        score = game.probe(st, depth + 1)
+        if score is not None:
+            if stats is not None:
+                stats.tb_hits += 1
+            return -score
+        first = None
+        if table is not None:
+            key = game.hash_key(st)
+            score, first = table.probe(key, d + 1 - depth, alpha, beta)
+            if stats is not None:
+                count_probe(score)
+            if score is not None:
+                return score
+        if cutoff_test(st, depth) and quiet(st, depth):
             return eval_fn(st)
+        beta_orig = beta
+        best = None
         v = infinity
-        successor = game.successors(st)
-        for (a, s) in successor:
-            v = min(v, max_value(s, alpha, beta, depth + 1))
-            if v <= alpha:
-                successor.close()
-                return v
-            beta = min(beta, v)
+        successor = successors(st, first, depth + 1)
+        try:
+            for i, (a, s) in enumerate(successor):
+                score = max_value(s, alpha, beta, depth + 1)
+                if score < v:
+                    v, best = score, a
+                if v <= alpha:
+                    successor.close()
+                    if ordering is not None:
+                        ordering.cutoff(a, depth + 1, d + 1 - depth)
+                    if stats is not None:
+                        count_cutoff(i)
+                    break
+                beta = min(beta, v)
+        except SearchTimeout:
+            successor.close()
+            raise
+        if table is not None:
+            store(key, d + 1 - depth, alpha, beta_orig, v, best)
         return v
 
+    def store(key, draft, alpha, beta, v, best):
+        if v <= alpha:
+            flag = hashfALPHA
+        elif v >= beta:
+            flag = hashfBETA
+        else:
+            flag = hashfEXACT
+        table.store(key, draft, flag, v, best)
+
     # Body of alphabeta_search starts here:
     # The default test cuts off at depth d or at a terminal st
     cutoff_test = (cutoff_test
                    or (lambda st, depth: depth > d or game.terminal_test(st)))
     eval_fn = eval_fn or (lambda st: game.utility(player, st))
-    action, state = argmax(
-        game.successors(state),
-        lambda a_s: min_value(a_s[1], -infinity, infinity, 0))
+    if stats is not None and quiescence is not None:
+        qnodes = quiescence.nodes
+    first = None
+    if table is not None:
+        table.new_search()
+        key = game.hash_key(state)
+        _, first = table.probe(key, d + 2, -infinity, infinity)
+    if ordering is not None:
+        ordering.new_search()
+    # Each root move only has to beat the best one so far, so it is searched
+    # with that score as alpha; ties still go to the earlier move.
+    action, best_score = None, -infinity
+    successor = successors(state, first, 0)
+    try:
+        for (a, s) in successor:
+            score = min_value(s, best_score, infinity, 0)
+            if action is None or score > best_score:
+                action, best_score = a, score
+    except SearchTimeout:
+        successor.close()
+        raise
+    finally:
+        if stats is not None and quiescence is not None:
+            stats.qnodes += quiescence.nodes - qnodes
+    if table is not None:
+        table.store(key, d + 2, hashfEXACT, best_score, action)
     return action
 
 
+def iterative_deepening_search(state, game, search_time, max_depth=MAX_DEPTH,
+                               table=None, quiescence=None, ordering=None,
+                               search=alphabeta_search, stats=None,
+                               report=None):
+    """Run alphabeta_search to depths 1, 2, ... max_depth until search_time
+    seconds have passed, and return the best action from the deepest search
+    that completed. The table carries each iteration's best moves
+    (its principal variation among them) into the next iteration's move
+    ordering; one is made if not given, as is the MoveOrdering whose killers
+    and history carry over the same way. quiescence is passed on to every
+    iteration. search is called like alphabeta_search and returns the
+    action it finds (or whatever else it returns, such as negamax_search's
+    score and line, which is returned in turn). stats, if given, collects
+    the counts of every iteration along with the depth, time and nodes of
+    each one that completed. report, if given, is called as
+    report(depth, result, seconds) after each iteration that completes,
+    with what search returned and the time since the start."""
+    start = monotonic()
+    deadline = start + search_time
+    if table is None:
+        table = TranspositionTable()
+    if ordering is None:
+        ordering = MoveOrdering(game.move_key)
+    action = None
+    for depth in range(1, max_depth + 1):
+        if stats is not None:
+            iteration_start, nodes = monotonic(), stats.nodes
+        try:
+            # the first iteration always finishes so there is a move to play
+            limit = deadline if action is not None else None
+            action = search(state, game, depth, table=table,
+                            deadline=limit, quiescence=quiescence,
+                            ordering=ordering, stats=stats)
+        except SearchTimeout:
+            break
+        finally:
+            if stats is not None:
+                stats.elapsed = monotonic() - start
+        if stats is not None:
+            stats.iteration(depth, monotonic() - iteration_start,
+                            stats.nodes - nodes)
+        if report is not None:
+            report(depth, action, monotonic() - start)
+        # the next iteration usually takes longer than all of the previous
+        # ones together, so don't start one that can't finish in time
+        if monotonic() - start > search_time / 2:
+            break
+    return action
+
+
+def order_first(moves, first):
+    """Return moves with first moved to the front, if it is among them."""
+    if first is None or first not in moves:
+        return moves
+    return [first] + [move for move in moves if move != first]
+
+
 # Players for Games
 def query_player(game, state):
     """Make a move by querying standard input."""
@@ -170,18 +388,42 @@ class Game:
         """Return True if this is a final st for the game."""
         return not self.legal_moves(state)
 
+    def captures_available(self, state):
+        """Return the captures that can be made in this st; a quiescence
+        search follows these past its depth limit."""
+        return []
+
+    def probe(self, state, ply):
+        """Return the exact score of this st for the player to move, ply
+        plies below the root of a search, if an endgame database knows
+        it; otherwise None."""
+        return None
+
     def to_move(self, state):
         """Return the player whose move it is in this st."""
         return state.to_move
 
+    def hash_key(self, state):
+        """Return a hash of this st for transposition tables."""
+        return hash(state)
+
     def display(self, state):
         """Print or otherwise display the st."""
         print(state)
 
-    def successors(self, state):
-        """Return a list of legal (move, st) pairs."""
+    def move_key(self, move):
+        """Return the hashable value move ordering keeps move's history
+        under."""
+        return move
+
+    def successors(self, state, first=None, moves=None):
+        """Return a list of legal (move, st) pairs. If first is one of the
+        legal moves, it comes first. moves, if given, are the legal moves
+        in the order to try them."""
+        if moves is None:
+            moves = self.legal_moves(state)
         return [(move, self.make_move(move, state))
-                for move in self.legal_moves(state)]
+                for move in order_first(moves, first)]
 
     def __repr__(self):
         return '<%s>' % self.__class__.__name__
@@ -210,8 +452,17 @@ class Fig62Game(Game):
     def __init__(self):
         Game.__init__(self)
 
-    def successors(self, state):
-        return self.succs.get(state, [])
+    def legal_moves(self, state):
+        return [move for move, _ in self.succs.get(state, [])]
+
+    def successors(self, state, first=None, moves=None):
+        succs = self.succs.get(state, [])
+        if moves is not None:
+            succs = sorted(succs, key=lambda s: moves.index(s[0]))
+        if first is not None:
+            succs = ([s for s in succs if s[0] == first] +
+                     [s for s in succs if s[0] != first])
+        return succs
 
     def utility(self, state, player):
         if player == 'MAX':
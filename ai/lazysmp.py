@@ -0,0 +1,164 @@
+"""Lazy SMP: several processes search the same root at once.
+
+Every worker runs its own iterative deepening of the whole position, and
+they all share one SharedTranspositionTable. Nothing is split by hand:
+the workers help one another through the table, with the odd-numbered
+ones a ply ahead so that they fill it with results the others reach next.
+The move played comes from the deepest search that completed, worker 0
+winning ties.
+
+The pool and the table are created on first use and kept for later
+searches; the table is cleared before each one, since its scores are
+from the point of view of the side that was to move at the root.
+stop_search() ends a search early, each worker returning its deepest
+completed iteration."""
+
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic
+
+import ai.games as games
+from ai.negamax import negamax_search
+from ai.ordering import MoveOrdering
+from ai.stats import SearchStats
+from ai.stopping import StopSignal
+from ai.transposition import SharedTranspositionTable
+from util.globalconst import MAX_DEPTH
+
+TABLE_SIZE = 2 ** 18
+
+_pool = None
+_pool_key = None
+_table = None
+_stop = None
+
+# per worker process: the game to search on, its view of the table and
+# the stop signal
+_worker = {'game': None, 'table': None, 'stop': None}
+
+
+def get_engine(game, workers=None, table_size=TABLE_SIZE):
+    """Return the shared (pool, table) for searching game with workers
+    processes (os.cpu_count() by default), starting them if need be."""
+    global _pool, _pool_key, _table, _stop
+    workers = workers or os.cpu_count()
+    key = (type(game), workers, table_size)
+    if _pool is None or _pool_key != key:
+        shutdown_engine()
+        _table = SharedTranspositionTable(table_size)
+        _stop = StopSignal(workers)
+        _pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                    initargs=(type(game), _table.name,
+                                              table_size, _stop))
+        _pool_key = key
+    return _pool, _table
+
+
+def shutdown_engine():
+    global _pool, _pool_key, _table, _stop
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+    if _table is not None:
+        _table.close()
+    _pool = _pool_key = _table = _stop = None
+
+
+def stop_search():
+    """Stop the search the engine is running, if any."""
+    if _stop is not None:
+        _stop.stop()
+
+
+def clear_stop():
+    """Let the next search run, whether or not a stop reached the last."""
+    if _stop is not None:
+        _stop.clear()
+
+
+atexit.register(shutdown_engine)
+
+
+def _init_worker(game_class, table_name, table_size, stop):
+    game = game_class()
+    table = SharedTranspositionTable(table_size, table_name)
+    table.bind(game.curr_state, game.move_key)
+    stop.install()
+    _worker.update(game=game, table=table, stop=stop)
+
+
+def _search(position, worker, search_time, max_depth, quiescence_depth,
+            with_stats):
+    """Deepen a search of position until search_time seconds have passed.
+    Return (result, stats): result is (depth, score, index) for the
+    deepest search that completed, index being that of the move in the
+    position's legal moves, or None if none did; stats is a SearchStats
+    if with_stats is set, else None. A stop ends it as the deadline
+    would."""
+    start = monotonic()
+    deadline = start + search_time
+    game = _worker['game']
+    table = _worker['table']
+    state = game.curr_state
+    state.set_position(position)
+    moves = state.legal_moves
+    ordering = MoveOrdering(game.move_key)
+    stats = SearchStats() if with_stats else None
+    result = None
+    try:
+        with _worker['stop'].searching():
+            for depth in range(1 + worker % 2, max_depth + 1):
+                # worker 0 always finishes its first iteration unless
+                # stopped, so there is a move to play
+                limit = deadline if worker or result is not None else None
+                iteration_start = monotonic()
+                score, move, _, nodes = negamax_search(
+                    state, game, depth, table, limit,
+                    games.Quiescence(quiescence_depth), ordering,
+                    stats=stats)
+                result = depth, score, moves.index(move)
+                if stats is not None:
+                    stats.iteration(depth, monotonic() - iteration_start,
+                                    nodes)
+                if monotonic() - start > search_time / 2:
+                    break
+    except games.SearchTimeout:
+        pass
+    return result, stats
+
+
+def lazy_smp_search(state, game, search_time, workers=None,
+                    max_depth=MAX_DEPTH, quiescence_depth=None, stats=None):
+    """Search state on every worker until search_time seconds have passed
+    and return the move to play, or None if there are no legal moves or
+    stop_search() stopped it before any worker completed an iteration.
+    stats, if given, gets the counts of all the workers, and the
+    iterations of the one whose move is played."""
+    moves = state.legal_moves
+    if not moves:
+        return None
+    workers = workers or os.cpu_count()
+    pool, table = get_engine(game, workers)
+    table.clear()
+    position = state.position()
+    start = monotonic()
+    stop = _stop
+    try:
+        futures = [pool.submit(_search, position, worker, search_time,
+                               max_depth, quiescence_depth,
+                               stats is not None)
+                   for worker in range(workers)]
+        best = best_stats = None
+        for future in futures:
+            result, worker_stats = future.result()
+            if stats is not None:
+                stats.add(worker_stats)
+            if result is not None and (best is None or result[0] > best[0]):
+                best, best_stats = result, worker_stats
+    finally:
+        stop.clear()
+    if stats is not None:
+        stats.elapsed = monotonic() - start
+        if best_stats is not None:
+            stats.iterations.extend(best_stats.iterations)
+    return moves[best[2]] if best is not None else None
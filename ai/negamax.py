@@ -0,0 +1,168 @@
+"""Negamax alpha-beta search for boards that make and unmake their own
+moves, such as the Checkerboard.
+
+negamax_search visits exactly the nodes ai.games.alphabeta_search visits
+for the same arguments, and picks the same move, but it works on the
+board directly: one recursive function, no per-node generators, and
+moves made and unmade in line. The board needs to_move, legal_moves,
+make_move, undo_move, utility and hash_key, and the game probe (see
+Game.probe), which settles the nodes below the root it knows.
+
+Scores are from the point of view of the side to move at each node, and
+are stored in the transposition table that way, so a table should not
+be shared with alphabeta_search."""
+
+from time import monotonic
+
+from ai.games import SearchTimeout, order_first
+from ai.utils import infinity
+from util.globalconst import hashfALPHA, hashfBETA, hashfEXACT
+
+
+def negamax_search(state, game, d=4, table=None, deadline=None,
+                   quiescence=None, ordering=None, alpha=-infinity,
+                   beta=infinity, player=None, stats=None):
+    """Search state to depth d, with the same depth, table, deadline,
+    quiescence and ordering conventions as alphabeta_search. Return
+    (score, move, pv, nodes): the score of the position for the side to
+    move, the move to play, the principal variation starting with it, and
+    the number of nodes searched below the root.
+    alpha and beta narrow the root window; the search stops at the first
+    move that reaches beta, and a score outside the window is only a
+    bound. player is the side whose utility is the evaluation (by default
+    the side to move), so that a subtree can be searched exactly as it
+    would be from further up the tree. With no legal moves, the score is
+    the evaluation and the move is None. A SearchStats given as stats has
+    this search's counts added to it, even if the search runs out of
+    time."""
+    if player is None:
+        player = state.to_move
+    make_move = state.make_move
+    undo_move = state.undo_move
+    probe = game.probe
+    # moves made on the way to the current node, to put the board back
+    # if the search is cut short
+    line = []
+    # pv[ply] is the best line found from the node being searched at ply
+    pv = [()]
+    nodes = 0
+
+    def negamax(alpha, beta, depth):
+        nonlocal nodes
+        nodes += 1
+        if deadline is not None and monotonic() > deadline:
+            raise SearchTimeout()
+        ply = depth + 1
+        if len(pv) == ply:
+            pv.append(())
+        else:
+            pv[ply] = ()
+        score = probe(state, ply)
+        if score is not None:
+            if stats is not None:
+                stats.tb_hits += 1
+            return score
+        first = None
+        if table is not None:
+            key = state.hash_key
+            score, first = table.probe(key, d + 1 - depth, alpha, beta)
+            if stats is not None:
+                stats.tt_probes += 1
+                stats.tt_hits += score is not None
+            if score is not None:
+                return score
+        moves = state.legal_moves
+        if ((depth > d or not moves) and
+                (quiescence is None or depth <= d or
+                 not quiescence.extend(game, state, depth - d - 1))):
+            if state.to_move == player:
+                return state.utility(player)
+            return -state.utility(player)
+        if ordering is not None:
+            moves = ordering.order(moves, ply, first)
+        elif first is not None:
+            moves = order_first(moves, first)
+        alpha_orig = alpha
+        best = None
+        v = -infinity
+        for move in moves:
+            make_move(move, False, False)
+            line.append(move)
+            score = -negamax(-beta, -alpha, depth + 1)
+            line.pop()
+            undo_move(move, False, False)
+            if score > v:
+                v, best = score, move
+                pv[ply] = (move,) + pv[ply + 1]
+            if v >= beta:
+                if ordering is not None:
+                    ordering.cutoff(move, ply, d + 1 - depth)
+                if stats is not None:
+                    stats.cutoffs += 1
+                    stats.first_move_cutoffs += move is moves[0]
+                break
+            if v > alpha:
+                alpha = v
+        if table is not None:
+            if v <= alpha_orig:
+                flag = hashfALPHA
+            elif v >= beta:
+                flag = hashfBETA
+            else:
+                flag = hashfEXACT
+            table.store(key, d + 1 - depth, flag, v, best)
+        return v
+
+    if stats is not None and quiescence is not None:
+        qnodes = quiescence.nodes
+    moves = state.legal_moves
+    if not moves:
+        score = state.utility(player)
+        return (score if state.to_move == player else -score), None, [], 0
+    first = None
+    if table is not None:
+        table.new_search()
+        key = state.hash_key
+        _, first = table.probe(key, d + 2, alpha, beta)
+    if ordering is not None:
+        ordering.new_search()
+        moves = ordering.order(moves, 0, first)
+    else:
+        moves = order_first(moves, first)
+    action, best_score, best_line = None, -infinity, ()
+    try:
+        for move in moves:
+            make_move(move, False, False)
+            line.append(move)
+            score = -negamax(-beta, -max(alpha, best_score), 0)
+            line.pop()
+            undo_move(move, False, False)
+            if action is None or score > best_score:
+                action, best_score = move, score
+                best_line = (move,) + pv[1]
+                if best_score >= beta:
+                    break
+    except SearchTimeout:
+        while line:
+            undo_move(line.pop(), False, False)
+        raise
+    finally:
+        if stats is not None:
+            stats.nodes += nodes
+            if quiescence is not None:
+                stats.qnodes += quiescence.nodes - qnodes
+    if table is not None:
+        if best_score <= alpha:
+            flag = hashfALPHA
+        elif best_score >= beta:
+            flag = hashfBETA
+        else:
+            flag = hashfEXACT
+        table.store(key, d + 2, flag, best_score, action)
+    return best_score, action, list(best_line), nodes
+
+
+def negamax_decision(state, game, d=4, **kwargs):
+    """negamax_search that returns just the move, for use wherever
+    alphabeta_search is."""
+    return negamax_search(state, game, d, **kwargs)[1]
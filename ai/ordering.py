@@ -0,0 +1,64 @@
+"""Move ordering for the alpha-beta searches in ai.games.
+
+Moves are tried in this order: the move the transposition table (or the
+previous iteration's principal variation) holds for the position, then
+the two killer moves remembered for the ply, then the rest by their
+history score. Killers are the last moves that caused a cutoff at a ply.
+History scores add up the cutoffs a move has caused anywhere in the tree,
+weighted by the square of the remaining depth."""
+
+KILLERS = 2
+
+
+class MoveOrdering(object):
+    """Killer and history tables shared by the nodes of one or more
+    searches. key maps a move to the hashable value its history is kept
+    under (such as its from and to squares); by default the move itself
+    is used."""
+
+    def __init__(self, key=None):
+        self.key = key or (lambda move: move)
+        self.clear()
+
+    def clear(self):
+        self.killers = []
+        self.history = {}
+
+    def new_search(self):
+        """Age the history so that the next search favours what it finds
+        itself over what earlier ones found."""
+        for key in self.history:
+            self.history[key] >>= 1
+
+    def order(self, moves, ply, first=None):
+        """Return moves in the order to search them at ply; first (the
+        table move) leads if it is among them."""
+        key = self.key
+        history = self.history
+        front = []
+        if first is not None and first in moves:
+            front.append(first)
+        if ply < len(self.killers):
+            for killer in self.killers[ply]:
+                if (killer is not None and killer not in front
+                        and killer in moves):
+                    front.append(killer)
+        rest = [move for move in moves if move not in front]
+        if history:
+            # the sort is stable, so ties keep the generation order
+            rest.sort(key=lambda move: -history.get(key(move), 0))
+        return front + rest
+
+    def cutoff(self, move, ply, draft):
+        """Record that move caused a cutoff at ply with draft plies left
+        to search below it."""
+        killers = self.killers
+        while len(killers) <= ply:
+            killers.append([None] * KILLERS)
+        slots = killers[ply]
+        if slots[0] is None or slots[0] != move:
+            slots[1:] = slots[:-1]
+            slots[0] = move
+        if draft > 0:
+            key = self.key(move)
+            self.history[key] = self.history.get(key, 0) + draft * draft
@@ -0,0 +1,211 @@
+"""Root-splitting parallel search over a pool of worker processes.
+
+The parent searches the first root move on one worker to get a score to
+beat, then hands the remaining root moves out as workers come free. Each
+is searched with the best score found so far as its alpha bound, so the
+later moves get the tighter bounds that arrive with the earlier results.
+Every worker keeps its own transposition table and move ordering for the
+length of one iterative deepening search.
+
+Positions travel between processes as the value of the board's position()
+method; a worker puts it back on its own board with set_position(). The
+pool is created on first use and kept for later searches. stop_search()
+ends a search early, as its deadline would."""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import count
+from time import monotonic
+
+import ai.games as games
+from ai.negamax import negamax_search
+from ai.ordering import MoveOrdering
+from ai.stats import SearchStats
+from ai.stopping import StopSignal
+from ai.transposition import TranspositionTable
+from ai.utils import infinity
+from util.globalconst import MAX_DEPTH
+
+_pool = None
+_pool_key = None
+_stop = None
+_search_ids = count()
+
+# per worker process: the game to search on, the table and ordering
+# kept for the search with the given id, and the stop signal
+_worker = {'game': None, 'search_id': None, 'table': None, 'ordering': None,
+           'stop': None}
+
+
+def get_pool(game, workers=None):
+    """Return the shared pool of workers (os.cpu_count() by default) that
+    search on copies of game, starting it if need be."""
+    global _pool, _pool_key, _stop
+    workers = workers or os.cpu_count()
+    key = (type(game), workers)
+    if _pool is None or _pool_key != key:
+        shutdown_pool()
+        _stop = StopSignal(workers)
+        _pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                    initargs=(type(game), _stop))
+        _pool_key = key
+    return _pool
+
+
+def shutdown_pool():
+    global _pool, _pool_key, _stop
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+    _pool = _pool_key = _stop = None
+
+
+def stop_search():
+    """Stop the search the pool is running, if any."""
+    if _stop is not None:
+        _stop.stop()
+
+
+def clear_stop():
+    """Let the next search run, whether or not a stop reached the last."""
+    if _stop is not None:
+        _stop.clear()
+
+
+def _init_worker(game_class, stop):
+    stop.install()
+    _worker.update(game=game_class(), stop=stop)
+
+
+def _search_root_move(search_id, position, index, d, alpha, time_left,
+                      quiescence_depth, with_stats):
+    """Search root move index of position as the root search would at
+    depth d, and return (score, nodes, stats), or None if time_left runs
+    out or the search is stopped. stats is a SearchStats if with_stats is
+    set, else None."""
+    game = _worker['game']
+    if _worker['search_id'] != search_id:
+        _worker.update(search_id=search_id, table=TranspositionTable(),
+                       ordering=MoveOrdering(game.move_key))
+    state = game.curr_state
+    state.set_position(position)
+    player = state.to_move
+    move = state.legal_moves[index]
+    deadline = monotonic() + time_left if time_left is not None else None
+    stats = SearchStats() if with_stats else None
+    state.make_move(move, False, False)
+    try:
+        with _worker['stop'].searching():
+            # the root's children are at depth 0, so below the move there
+            # is one ply less to go
+            score, _, _, nodes = negamax_search(
+                state, game, d - 1, _worker['table'], deadline,
+                games.Quiescence(quiescence_depth), _worker['ordering'],
+                -infinity, -alpha, player, stats)
+    except games.SearchTimeout:
+        return None
+    finally:
+        state.undo_move(move, False, False)
+    if stats is not None:
+        stats.nodes += 1
+    return -score, nodes + 1, stats
+
+
+def parallel_search(state, pool, workers, search_id, d=4, first=None,
+                    deadline=None, quiescence_depth=None, stats=None):
+    """Search the root moves of state to depth d on pool, trying first
+    (a move index) before the others. Return (score, index, nodes) for the
+    best move, or None if the deadline passed first. The workers' counts
+    are added to stats, if given, as their results come in."""
+    position = state.position()
+    indices = list(range(len(state.legal_moves)))
+    if first is not None:
+        indices.remove(first)
+        indices.insert(0, first)
+
+    def time_left():
+        if deadline is None:
+            return None
+        return max(deadline - monotonic(), 0)
+
+    def submit(index, alpha):
+        pending[pool.submit(_search_root_move, search_id, position, index, d,
+                            alpha, time_left(), quiescence_depth,
+                            stats is not None)] = (
+            index, alpha)
+
+    def cancel():
+        for future in pending:
+            future.cancel()
+
+    best_score, best_index, nodes = -infinity, None, 0
+    # the first move is searched alone for a score the others must beat
+    pending = {}
+    submit(indices[0], -infinity)
+    queue = indices[1:]
+    while pending:
+        done, _ = wait(pending, time_left(), FIRST_COMPLETED)
+        if not done:
+            cancel()
+            return None
+        for future in done:
+            index, alpha = pending.pop(future)
+            result = future.result()
+            if result is None:
+                cancel()
+                return None
+            score, searched, worker_stats = result
+            nodes += searched
+            if stats is not None:
+                stats.add(worker_stats)
+            # a score no better than its alpha is only an upper bound;
+            # equal exact scores go to the earlier move, as they would
+            # searching one move after another
+            if best_index is None or (score > alpha and (
+                    score > best_score or (score == best_score and
+                                           indices.index(index) <
+                                           indices.index(best_index)))):
+                best_score, best_index = score, index
+        while queue and len(pending) < workers:
+            submit(queue.pop(0), best_score)
+    return best_score, best_index, nodes
+
+
+def parallel_iterative_deepening_search(state, game, search_time,
+                                        workers=None, max_depth=MAX_DEPTH,
+                                        quiescence_depth=None, stats=None):
+    """Deepen a parallel_search of state on the shared pool until
+    search_time seconds have passed, as iterative_deepening_search does,
+    and return the best move from the deepest search that completed, or
+    None if there are no legal moves or stop_search() stopped it before
+    the first did. stats, if given, is filled in as
+    iterative_deepening_search does."""
+    workers = workers or os.cpu_count()
+    pool = get_pool(game, workers)
+    search_id = next(_search_ids)
+    moves = state.legal_moves
+    if not moves:
+        return None
+    start = monotonic()
+    deadline = start + search_time
+    best = None
+    stop = _stop
+    try:
+        for depth in range(1, max_depth + 1):
+            # the first iteration always finishes, unless stopped, so
+            # there is a move to play
+            limit = deadline if best is not None else None
+            iteration_start = monotonic()
+            result = parallel_search(state, pool, workers, search_id, depth,
+                                     best, limit, quiescence_depth, stats)
+            if stats is not None:
+                stats.elapsed = monotonic() - start
+            if result is None:
+                break
+            _, best, nodes = result
+            if stats is not None:
+                stats.iteration(depth, monotonic() - iteration_start, nodes)
+            if monotonic() - start > search_time / 2:
+                break
+    finally:
+        stop.clear()
+    return moves[best] if best is not None else None
@@ -0,0 +1,54 @@
+"""Counters a search fills in when it is handed a SearchStats.
+
+Searches take stats=None by default and then only pay for an `is None`
+test at the places they would count something."""
+
+
+class SearchStats(object):
+    """What a search did: nodes searched (quiescence nodes included, and
+    also counted on their own), cutoffs and how many of them the first
+    move tried produced, transposition table probes and the hits that
+    settled a node, and the depth, time and nodes of each completed
+    iterative deepening iteration."""
+
+    COUNTERS = ('nodes', 'qnodes', 'cutoffs', 'first_move_cutoffs',
+                'tt_probes', 'tt_hits', 'tb_hits')
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.iterations = []
+        self.elapsed = 0.0
+
+    def add(self, other):
+        """Add the counts of another SearchStats (say, from a worker)."""
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def iteration(self, depth, seconds, nodes):
+        self.iterations.append({'depth': depth, 'seconds': seconds,
+                                'nodes': nodes})
+
+    @property
+    def depth(self):
+        """Depth of the deepest completed iteration, or 0."""
+        return max((it['depth'] for it in self.iterations), default=0)
+
+    @property
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    @property
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        result = {name: getattr(self, name) for name in self.COUNTERS}
+        result.update(first_move_cutoff_rate=self.first_move_cutoff_rate,
+                      depth=self.depth, elapsed=self.elapsed, nps=self.nps,
+                      iterations=list(self.iterations))
+        return result
+
+    def __repr__(self):
+        return ('<SearchStats depth=%d nodes=%d qnodes=%d nps=%.0f>'
+                % (self.depth, self.nodes, self.qnodes, self.nps))
@@ -0,0 +1,70 @@
+"""Stopping the searches of a pool of worker processes early.
+
+A pool's workers are handed a StopSignal when they start, and each runs
+its searches inside searching(). stop() sets a flag the processes share
+and signals each of them; a worker inside searching() then raises
+SearchTimeout, as if its deadline had passed, and one entering it later
+raises it at once. A worker outside searching() ignores the signal."""
+
+import os
+import signal
+from contextlib import contextmanager
+from multiprocessing import Value
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from ai.games import SearchTimeout
+
+STOP_SIGNAL = getattr(signal, 'SIGUSR1', None)
+
+
+class StopSignal(object):
+    """The stop flag and the process ids of up to workers processes."""
+
+    def __init__(self, workers):
+        self.flag = RawValue('b', 0)
+        self.pids = RawArray('i', workers)
+        self.registered = Value('i', 0)
+        self.active = False
+
+    # in the workers
+
+    def install(self):
+        """Register this process for the signal; call once, from the
+        pool's initializer."""
+        with self.registered.get_lock():
+            index = self.registered.value
+            self.registered.value += 1
+        if index < len(self.pids):
+            self.pids[index] = os.getpid()
+        if STOP_SIGNAL is not None:
+            signal.signal(STOP_SIGNAL, self._handle)
+
+    def _handle(self, signum, frame):
+        if self.active and self.flag.value:
+            raise SearchTimeout()
+
+    @contextmanager
+    def searching(self):
+        self.active = True
+        try:
+            if self.flag.value:
+                raise SearchTimeout()
+            yield
+        finally:
+            self.active = False
+
+    # in the parent
+
+    def stop(self):
+        self.flag.value = 1
+        if STOP_SIGNAL is None:
+            return
+        for pid in self.pids:
+            if pid:
+                try:
+                    os.kill(pid, STOP_SIGNAL)
+                except ProcessLookupError:
+                    pass
+
+    def clear(self):
+        self.flag.value = 0
@@ -0,0 +1,209 @@
+"""Transposition tables for the alpha-beta searches in ai.games.
+
+A table has a fixed number of buckets, each with two slots: a
+depth-preferred slot that only gives way to an entry searched at least as
+deep (or left over from an earlier search), and an always-replace slot that
+takes everything else. Entries record the bound type using the hashfALPHA,
+hashfBETA and hashfEXACT flags from util.globalconst.
+
+TranspositionTable keeps its entries as tuples in lists.
+SharedTranspositionTable packs them into a block of shared memory that
+processes searching together can all read and write without locks."""
+
+import struct
+from multiprocessing.shared_memory import SharedMemory
+
+from util.globalconst import hashfALPHA, hashfBETA, hashfEXACT
+
+# entry layout: (key, depth, flag, score, move, generation)
+KEY, DEPTH, FLAG, SCORE, MOVE, GENERATION = range(6)
+
+
+class TranspositionTable(object):
+    """Fixed-size table of search results keyed by a 64-bit position hash.
+    Scores are stored exactly as the search saw them, so one table should
+    only serve searches made for the same root player."""
+
+    def __init__(self, size=2 ** 16):
+        if size & (size - 1):
+            raise ValueError("Table size must be a power of two")
+        self.size = size
+        self.mask = size - 1
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        self.deep = [None] * self.size
+        self.recent = [None] * self.size
+
+    def new_search(self):
+        """Age the current entries so the depth-preferred slots can be
+        reclaimed by the next search."""
+        self.generation += 1
+
+    def entry(self, key):
+        """Return the stored entry for key, or None."""
+        idx = key & self.mask
+        entry = self.deep[idx]
+        if entry is not None and entry[KEY] == key:
+            return entry
+        entry = self.recent[idx]
+        if entry is not None and entry[KEY] == key:
+            return entry
+        return None
+
+    def probe(self, key, depth, alpha, beta):
+        """Return (score, move) for key. score is None unless the entry was
+        searched at least depth plies deep and its bound settles the
+        (alpha, beta) window; move is the best move found, if any."""
+        entry = self.entry(key)
+        if entry is None:
+            return None, None
+        move = entry[MOVE]
+        if entry[DEPTH] >= depth:
+            flag = entry[FLAG]
+            score = entry[SCORE]
+            if flag == hashfEXACT:
+                return score, move
+            if flag == hashfALPHA and score <= alpha:
+                return score, move
+            if flag == hashfBETA and score >= beta:
+                return score, move
+        return None, move
+
+    def store(self, key, depth, flag, score, move):
+        idx = key & self.mask
+        new_entry = (key, depth, flag, score, move, self.generation)
+        deep = self.deep[idx]
+        if (deep is None or deep[KEY] == key or depth >= deep[DEPTH]
+                or deep[GENERATION] != self.generation):
+            self.deep[idx] = new_entry
+        else:
+            self.recent[idx] = new_entry
+
+
+# A shared entry is three 64-bit words: check, data and score, where
+# check = key ^ data ^ score (the score's bits). An entry torn by two
+# processes writing at once no longer checks out against its key, so it
+# reads as a miss. The data word packs:
+#   bits  0-7   depth + 128
+#   bits  8-9   flag
+#   bits 10-15  generation (modulo 64)
+#   bits 16-21  from square of the best move
+#   bits 22-27  to square of the best move
+#   bit  28     set if there is a best move
+ENTRY_WORDS = 3
+HAS_MOVE = 1 << 28
+# a score and its bits; the score word is only ever read or written as
+# bits, so the score checked is the score returned
+SCORE_FORMAT = struct.Struct('<d')
+BITS_FORMAT = struct.Struct('<Q')
+
+
+def score_bits(score):
+    return BITS_FORMAT.unpack(SCORE_FORMAT.pack(score))[0]
+
+
+def bits_score(bits):
+    return SCORE_FORMAT.unpack(BITS_FORMAT.pack(bits))[0]
+
+
+class SharedTranspositionTable(object):
+    """TranspositionTable held in shared memory. The process that makes
+    it (name=None) owns the block; others attach to it by name. Moves are
+    stored as their from and to squares, so a process has to bind() the
+    board it searches before probing: a probe hands back the legal move
+    of the bound board with those squares."""
+
+    def __init__(self, size=2 ** 16, name=None):
+        if size & (size - 1):
+            raise ValueError("Table size must be a power of two")
+        self.size = size
+        self.mask = size - 1
+        self.generation = 0
+        self.state = None
+        self.move_key = None
+        nbytes = size * 2 * ENTRY_WORDS * 8
+        self.owner = name is None
+        self.shm = SharedMemory(name, create=self.owner, size=nbytes)
+        self.name = self.shm.name
+        self.words = self.shm.buf.cast('Q')
+        if self.owner:
+            self.clear()
+
+    def close(self):
+        """Detach from the shared block, and free it if this table made
+        it."""
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def bind(self, state, move_key):
+        """Resolve stored moves against the legal moves of state; move_key
+        gives a move's (from, to) squares, each below 64."""
+        self.state = state
+        self.move_key = move_key
+
+    def clear(self):
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 63
+
+    def _read(self, offset, key):
+        words = self.words
+        data = words[offset + 1]
+        score_bits = words[offset + 2]
+        if words[offset] ^ data ^ score_bits != key or not data:
+            return None
+        return data, bits_score(score_bits)
+
+    def entry(self, key):
+        """Return (depth, flag, score, move) stored for key, or None."""
+        offset = (key & self.mask) * 2 * ENTRY_WORDS
+        found = (self._read(offset, key)
+                 or self._read(offset + ENTRY_WORDS, key))
+        if found is None:
+            return None
+        data, score = found
+        move = None
+        if data & HAS_MOVE:
+            squares = ((data >> 16) & 63, (data >> 22) & 63)
+            for legal_move in self.state.legal_moves:
+                if self.move_key(legal_move) == squares:
+                    move = legal_move
+                    break
+        return (data & 255) - 128, (data >> 8) & 3, score, move
+
+    def probe(self, key, depth, alpha, beta):
+        """As TranspositionTable.probe."""
+        entry = self.entry(key)
+        if entry is None:
+            return None, None
+        entry_depth, flag, score, move = entry
+        if entry_depth >= depth:
+            if flag == hashfEXACT:
+                return score, move
+            if flag == hashfALPHA and score <= alpha:
+                return score, move
+            if flag == hashfBETA and score >= beta:
+                return score, move
+        return None, move
+
+    def store(self, key, depth, flag, score, move):
+        data = ((depth + 128) & 255) | (flag << 8) | (self.generation << 10)
+        if move is not None:
+            from_sq, to_sq = self.move_key(move)
+            data |= HAS_MOVE | (from_sq << 16) | (to_sq << 22)
+        words = self.words
+        offset = (key & self.mask) * 2 * ENTRY_WORDS
+        deep = words[offset + 1]
+        if (deep and words[offset] ^ deep ^ words[offset + 2] != key
+                and depth < (deep & 255) - 128
+                and (deep >> 10) & 63 == self.generation):
+            offset += ENTRY_WORDS
+        bits = score_bits(score)
+        words[offset + 1] = data
+        words[offset + 2] = bits
+        words[offset] = key ^ data ^ bits
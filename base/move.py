@@ -1,10 +1,32 @@
 class Move(object):
-    def __init__(self, squares, annotation=""):
-        self.affected_squares = squares
+    """ A move, held as the (index, old value, new value) triples of the
+    squares it passes through. toggles and hash_delta cache what the board
+    XORs into its bitboards and Zobrist hash to make (or unmake) it, and
+    eval_delta what it adds to (or takes from) the board's evaluation terms;
+    they are filled in by the move generator, or by the board on first
+    use. """
+    __slots__ = ('squares', 'annotation', 'toggles', 'hash_delta',
+                 'eval_delta')
+
+    def __init__(self, squares, annotation="", toggles=None, hash_delta=0,
+                 eval_delta=None):
+        if not isinstance(squares, tuple):
+            squares = tuple(tuple(sq) for sq in squares)
+        self.squares = squares
         self.annotation = annotation
+        self.toggles = toggles
+        self.hash_delta = hash_delta
+        self.eval_delta = eval_delta
+
+    def _get_affected_squares(self):
+        return [list(sq) for sq in self.squares]
+
+    affected_squares = property(
+        _get_affected_squares,
+        doc="The squares of the move as a list of [index, old, new] lists")
 
     def __eq__(self, other):
-        return self.affected_squares == other.affected_squares
+        return self.squares == other.squares
 
     def __repr__(self):
         return str(self.affected_squares)
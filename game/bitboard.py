@@ -0,0 +1,79 @@
+""" 32-bit bitboard layout used by the Checkerboard.
+
+Bit n stands for the nth playable square in ascending order of the padded
+board indices, so each row of the board occupies one nibble:
+
+  (white)
+           28  29  30  31        45  46  47  48
+         24  25  26  27        39  40  41  42
+           20  21  22  23        34  35  36  37
+         16  17  18  19        28  29  30  31
+           12  13  14  15        23  24  25  26
+         8   9   10  11        17  18  19  20
+           4   5   6   7         12  13  14  15
+         0   1   2   3         6   7   8   9
+  (black)
+         bit numbers           padded board indices
+
+Moves are generated square by square from tables, not by shifting whole
+bitboards: STEP and JUMP below hold, for each piece and square, the
+squares a step or a jump lands on and passes over, and the generators in
+game/checkers.py walk the squares the side to move occupies and look
+them up. """
+from util.globalconst import (BLACK, BLACK_IDX, KING, KING_IDX, MAN, WHITE,
+                              WHITE_IDX, keymap)
+
+FULL = 0xFFFFFFFF
+EVEN_ROWS = 0x0F0F0F0F
+ODD_ROWS = 0xF0F0F0F0
+BLACK_KING_ROW = 0xF0000000
+WHITE_KING_ROW = 0x0000000F
+
+VALID_SQUARES = sorted(keymap)
+# padded board index -> bit mask (0 for the off-board padding squares)
+SQUARE_BIT = [0] * 56
+# bit mask -> padded board index
+BIT_SQUARE = {}
+for _n, _idx in enumerate(VALID_SQUARES):
+    SQUARE_BIT[_idx] = 1 << _n
+    BIT_SQUARE[1 << _n] = _idx
+del _n, _idx
+
+# piece -> the steps it moves along, in the order moves are generated
+DIRECTIONS = {BLACK | MAN: BLACK_IDX, WHITE | MAN: WHITE_IDX,
+              BLACK | KING: KING_IDX, WHITE | KING: KING_IDX}
+
+# piece -> squares where it is crowned on arrival
+PROMOTION = {BLACK | MAN: BLACK_KING_ROW, WHITE | MAN: WHITE_KING_ROW,
+             BLACK | KING: 0, WHITE | KING: 0}
+
+# STEP[piece][idx] -> ((dest, dest_bit), ...) for each on-board step, and
+# JUMP[piece][idx] -> ((mid, dest, mid_bit, dest_bit), ...) for each
+# on-board jump, both in DIRECTIONS order. Padding squares map to ().
+STEP = {}
+JUMP = {}
+for _piece, _directions in DIRECTIONS.items():
+    STEP[_piece] = _steps = [()] * 56
+    JUMP[_piece] = _jumps = [()] * 56
+    for _idx in VALID_SQUARES:
+        _steps[_idx] = tuple(
+            (_idx + _j, SQUARE_BIT[_idx + _j]) for _j in _directions
+            if 0 <= _idx + _j < 56 and SQUARE_BIT[_idx + _j])
+        _jumps[_idx] = tuple(
+            (_idx + _j, _idx + 2 * _j, SQUARE_BIT[_idx + _j],
+             SQUARE_BIT[_idx + 2 * _j]) for _j in _directions
+            if 0 <= _idx + 2 * _j < 56 and SQUARE_BIT[_idx + _j]
+            and SQUARE_BIT[_idx + 2 * _j])
+del _piece, _directions, _steps, _jumps, _idx
+
+
+def to_bitboard(squares):
+    """ Bitboard with a bit set for each padded board index in squares. """
+    bb = 0
+    for idx in squares:
+        bb |= SQUARE_BIT[idx]
+    return bb
+
+
+def popcount(bb):
+    return bin(bb).count('1')
@@ -0,0 +1,226 @@
+""" Opening book.
+
+Compiled from master games and opening studies: every game is replayed
+from its start, and each move made in its first plies is counted under
+the Zobrist hash_key of the position it was made from, with the result
+the game went on to have for the side that made it.
+
+    python -m game.book                       tinsley.pdn and the Openings
+    python -m game.book --plies 30 a.pdn b.rcf --out my.book
+
+The file holds a header, then the keys of all the (position, move)
+entries in ascending order as little-endian 64-bit integers, then the
+entries themselves in the same order. OpeningBook maps it and binary
+searches the keys in place, so a lookup costs a couple of dozen
+comparisons whatever the size of the book.
+
+Games the PDN reader can't replay (an illegal move in the score, say)
+are skipped and counted. """
+import argparse
+import glob
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import NamedTuple
+
+from game.checkers import Checkerboard
+from parsing.migrate import RCF2PDN
+from parsing.PDN import PDNReader
+from util.globalconst import (BLACK, BOOK_FILE, BOOK_PLIES, TRAINING_DIR,
+                              keymap)
+
+MAGIC = b'RVBK'
+VERSION = 1
+# magic, version, plies, entries, games
+HEADER = struct.Struct('<4sBB2xII')
+# start square, end square, games, wins, draws, losses; the results are
+# for the side that made the move, and games without a result count in
+# games only
+ENTRY = struct.Struct('<BBHHHH')
+KEY = struct.Struct('<Q')
+
+SOURCES = [os.path.join(TRAINING_DIR, 'tinsley.pdn'),
+           os.path.join(TRAINING_DIR, 'Openings', '**', '*.rcf')]
+
+BookMove = NamedTuple("BookMove", [("start", int), ("end", int),
+                                   ("games", int), ("wins", int),
+                                   ("draws", int), ("losses", int)])
+
+
+def move_squares(move):
+    """ The first and last squares of move, as PDN square numbers. """
+    return keymap[move.squares[0][0]], keymap[move.squares[-1][0]]
+
+
+def read_games(path):
+    """ Return (games, skipped): the game params of the games in path (a
+    PDN or RCF file) the PDN reader could replay, and how many it
+    couldn't. """
+    if path.lower().endswith('.rcf'):
+        with open(path) as rcf:
+            reader = PDNReader.from_string(RCF2PDN.with_string(rcf))
+    else:
+        reader = PDNReader.from_file(path)
+    games, skipped = [], 0
+    with reader:
+        for title in reader.get_game_list():
+            try:
+                games.append(reader.game_params_from_pdn(title.index))
+            except (RuntimeError, SyntaxError, ValueError):
+                skipped += 1
+    return games, skipped
+
+
+def _result_counts(result, to_move):
+    """ (wins, draws, losses) for to_move from a PDN result, where 1-0
+    is a win for black. """
+    if result == '1/2-1/2':
+        return 0, 1, 0
+    if result in ('1-0', '0-1'):
+        black_won = result == '1-0'
+        return (1, 0, 0) if black_won == (to_move == BLACK) else (0, 0, 1)
+    return 0, 0, 0
+
+
+def add_game(entries, game, plies=BOOK_PLIES):
+    """ Count the first plies moves of game (PDN game params) in entries,
+    a dict of [games, wins, draws, losses] by (key, start, end). """
+    board = Checkerboard()
+    board.setup_game(game)
+    # setup_game leaves the moves to redo, last move first
+    for move in list(reversed(board.redo_list))[:plies]:
+        counts = entries[(board.hash_key,) + move_squares(move)]
+        counts[0] += 1
+        for i, count in enumerate(_result_counts(game.result,
+                                                 board.to_move), 1):
+            counts[i] += count
+        board.make_move(move, False, False)
+
+
+def build_book(paths, plies=BOOK_PLIES, report=None):
+    """ Return (entries, games, skipped) for the games in paths (glob
+    patterns allowed); report, if given, is called with (path, games
+    read, games skipped) for each file. """
+    entries = defaultdict(lambda: [0, 0, 0, 0])
+    games = skipped = 0
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            read, missed = read_games(path)
+            for game in read:
+                add_game(entries, game, plies)
+            games += len(read)
+            skipped += missed
+            if report is not None:
+                report(path, len(read), missed)
+    return entries, games, skipped
+
+
+def write_book(path, entries, plies=BOOK_PLIES, games=0):
+    """ Write entries (as build_book returns them) to path, sorted. """
+    items = sorted(entries.items())
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, plies, len(items), games))
+        for (key, _, _), _ in items:
+            f.write(KEY.pack(key))
+        for (_, start, end), counts in items:
+            # a count past 65535 stops there
+            f.write(ENTRY.pack(start, end,
+                               *(min(count, 0xFFFF) for count in counts)))
+    os.replace(path + '.tmp', path)
+
+
+class OpeningBook(object):
+    """ A book file, mapped and looked up in place. """
+
+    def __init__(self, path=BOOK_FILE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.plies, self.size, self.games = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError('%s is not a version %d opening book'
+                             % (path, VERSION))
+        self.entries_offset = HEADER.size + self.size * KEY.size
+        keys = memoryview(self.data)[HEADER.size:self.entries_offset]
+        if sys.byteorder == 'little':
+            self.keys = keys.cast('Q')
+        else:
+            self.keys = array('Q', keys)
+            self.keys.byteswap()
+            keys.release()
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '<OpeningBook %s: %d moves from %d games>' % (
+            self.path, self.size, self.games)
+
+    def moves(self, board):
+        """ The BookMoves stored for the position on board (a
+        Checkerboard), most played first. """
+        key = board.hash_key
+        first = bisect_left(self.keys, key)
+        last = bisect_right(self.keys, key, first)
+        moves = [BookMove(*ENTRY.unpack_from(
+            self.data, self.entries_offset + i * ENTRY.size))
+            for i in range(first, last)]
+        moves.sort(key=lambda m: (-m.games, m.losses - m.wins))
+        return moves
+
+    def choose(self, board):
+        """ The legal move on board the book plays most often (of those
+        played equally often, the one that scored best), or None if the
+        book has no move for the position. """
+        book_moves = self.moves(board)
+        if not book_moves:
+            return None
+        legal = {move_squares(move): move for move in board.legal_moves}
+        for book_move in book_moves:
+            # the key could, just, be another position's
+            move = legal.get((book_move.start, book_move.end))
+            if move is not None:
+                return move
+        return None
+
+    def close(self):
+        if isinstance(self.keys, memoryview):
+            self.keys.release()
+        self.data.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m game.book',
+        description='Build an opening book from PDN and RCF games.')
+    parser.add_argument('paths', nargs='*', default=SOURCES,
+                        help='PDN or RCF files, glob patterns allowed '
+                             '(default: %s)' % ' '.join(SOURCES))
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES,
+                        help='moves of each game to take (default '
+                             '%(default)s)')
+    parser.add_argument('--out', default=BOOK_FILE,
+                        help='book file to write (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    def report(path, read, skipped):
+        print('%-60s %5d games  %3d skipped' % (path, read, skipped),
+              flush=True)
+
+    start = time.perf_counter()
+    entries, games, skipped = build_book(args.paths, args.plies, report)
+    write_book(args.out, entries, args.plies, games)
+    print('%d moves from %d games (%d skipped) in %.1fs'
+          % (len(entries), games, skipped, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,14 +2,101 @@ import copy
 import time
 
 import ai.games as games
+from ai.evalcache import EvalCache
+from ai.lazysmp import lazy_smp_search
+from ai.negamax import negamax_search
+from ai.parallel import parallel_iterative_deepening_search
+from ai.stats import SearchStats
 from base.move import Move
-from util.globalconst import (BLACK, BLACK_CHAR, BLACK_IDX, BLACK_KING, BRV,
-                              COLORS, CRAMP, ENDGAME, FREE, FREE_CHAR,
-                              INTACT_DOUBLE_CORNER, KCV, KEV, KING, KING_IDX,
-                              MAN, MCV, MEV, MIDGAME, OCCUPIED, OCCUPIED_CHAR,
-                              OPENING, TURN, TYPES, WHITE, WHITE_CHAR,
-                              WHITE_IDX, WHITE_KING, create_grid_map, keymap,
-                              square_map)
+from game.bitboard import (BIT_SQUARE, EVEN_ROWS, FULL, JUMP, ODD_ROWS,
+                           PROMOTION, SQUARE_BIT, STEP, VALID_SQUARES,
+                           popcount, to_bitboard)
+from game.zobrist import WHITE_TO_MOVE, ZOBRIST, hash_bitboards
+from util.globalconst import (BLACK, BLACK_CHAR, BLACK_KING, BRV, COLORS,
+                              CRAMP, ENDGAME, EVAL_CACHE_SIZE, FREE, FREE_CHAR,
+                              INTACT_DOUBLE_CORNER, KCV, KEV, KING, MAN, MCV,
+                              MEV, MIDGAME, OCCUPIED, OCCUPIED_CHAR, OPENING,
+                              TURN, TYPES, WHITE, WHITE_CHAR, WHITE_KING,
+                              create_grid_map, keymap, square_map)
+
+BM = BLACK | MAN
+BK = BLACK | KING
+WM = WHITE | MAN
+WK = WHITE | KING
+PIECES = (BM, BK, WM, WK)
+
+_eval_cache = EvalCache(EVAL_CACHE_SIZE)
+
+
+def get_eval_cache():
+    """ This process's evaluation cache, or None if caching is off. """
+    return _eval_cache
+
+
+def set_eval_cache_size(size):
+    """ Give this process a new, empty evaluation cache of up to size
+    entries; a size of 0 turns caching off. """
+    global _eval_cache
+    _eval_cache = EvalCache(size) if size else None
+
+
+# the endgame tablebase (a game.tbprobe.Tablebase) searches probe, if any
+_tablebase = None
+
+
+def get_tablebase():
+    """ The tablebase this process's searches probe, or None. """
+    return _tablebase
+
+
+def set_tablebase(tablebase):
+    """ Have this process's searches (and the processes it starts after
+    this) probe tablebase below the root; None turns probing off. """
+    global _tablebase
+    _tablebase = tablebase
+
+
+# the opening book (a game.book.OpeningBook) calc_ai_move plays from, if any
+_book = None
+
+
+def get_book():
+    """ The opening book calc_ai_move plays from, or None. """
+    return _book
+
+
+def set_book(book):
+    """ Have calc_ai_move in this process play the moves book knows
+    without searching; None turns the book off. """
+    global _book
+    _book = book
+
+
+class SquareView(object):
+    """ Presents the bitboards of a Checkerboard as the padded 56-entry
+    square list (FREE, OCCUPIED or a piece value per index) used by the
+    parsers, the API and the GUI. Writes go straight through to the
+    bitboards. """
+    __slots__ = ('_board',)
+
+    def __init__(self, board):
+        self._board = board
+
+    def __len__(self):
+        return 56
+
+    def __getitem__(self, idx):
+        bit = SQUARE_BIT[idx]
+        if not bit:
+            return OCCUPIED
+        bitboards = self._board.bitboards
+        for piece in PIECES:
+            if bitboards[piece] & bit:
+                return piece
+        return FREE
+
+    def __setitem__(self, idx, value):
+        self._board.set_square(idx, value)
 
 
 class Checkerboard(object):
@@ -56,15 +143,26 @@ class Checkerboard(object):
         14: 9,
         15: 8
     }
+    safe_edge_mask = to_bitboard(safe_edge)
 
     def __init__(self):
-        self.squares = [OCCUPIED for _ in range(56)]
-        s = self.squares
-        for i in range(0, 4):
-            s[6 + i] = s[12 + i] = s[17 + i] = BLACK | MAN
-            s[34 + i] = s[39 + i] = s[45 + i] = WHITE | MAN
-            s[23 + i] = s[28 + i] = FREE
+        # Bitboards indexed by piece value (BLACK | MAN, WHITE | MAN,
+        # BLACK | KING, WHITE | KING). The FREE slot is scratch space so
+        # make_move can toggle both ends of an affected square blindly.
+        self.bitboards = [0] * (FREE + 1)
+        self.bitboards[BLACK | MAN] = 0x00000FFF
+        self.bitboards[WHITE | MAN] = 0xFFF00000
+        # Zobrist hash of the pieces only; the side to move is mixed in by
+        # hash_key so that assigning to_move directly keeps it valid.
+        self.piece_hash = hash_bitboards(self.bitboards)
+        # evaluation terms kept up to date by make_move and undo_move; see
+        # EVAL_WEIGHTS
+        self._count_eval_terms()
         self.to_move = BLACK
+        # bumped by every change to the pieces; legal_moves keeps its last
+        # result until the count (or the side to move) changes
+        self.mutation_count = 0
+        self._legal_moves_cache = (-1, None, None)
         self.char_lookup = {
             BLACK | MAN: BLACK_CHAR,
             WHITE | MAN: WHITE_CHAR,
@@ -105,6 +203,13 @@ class Checkerboard(object):
         s += "  a b c d e f g h"
         return s
 
+    def _get_squares(self):
+        return SquareView(self)
+
+    squares = property(
+        _get_squares,
+        doc="The board as a padded 56-entry list of square values")
+
     def _get_enemy(self):
         if self.to_move == BLACK:
             return WHITE
@@ -114,6 +219,30 @@ class Checkerboard(object):
         _get_enemy,
         doc="The color for the player that doesn't have the current turn")
 
+    def _get_hash_key(self):
+        if self.to_move == WHITE:
+            return self.piece_hash ^ WHITE_TO_MOVE
+        return self.piece_hash
+
+    hash_key = property(
+        _get_hash_key,
+        doc="64-bit Zobrist key for the position and the side to move")
+
+    black_men = property(lambda self: self.bitboards[BM],
+                         doc="Bitboard of black men")
+    black_kings = property(lambda self: self.bitboards[BK],
+                           doc="Bitboard of black kings")
+    white_men = property(lambda self: self.bitboards[WM],
+                         doc="Bitboard of white men")
+    white_kings = property(lambda self: self.bitboards[WK],
+                           doc="Bitboard of white kings")
+
+    def _get_empty(self):
+        bb = self.bitboards
+        return ~(bb[BM] | bb[BK] | bb[WM] | bb[WK]) & FULL
+
+    empty = property(_get_empty, doc="Bitboard of unoccupied squares")
+
     def attach(self, observer):
         if observer not in self.observers:
             self.observers.append(observer)
@@ -123,11 +252,43 @@ class Checkerboard(object):
             self.observers.remove(observer)
 
     def clear(self):
-        s = self.squares
-        for i in range(0, 4):
-            s[6 + i] = s[12 + i] = s[17 + i] = FREE
-            s[23 + i] = s[28 + i] = FREE
-            s[34 + i] = s[39 + i] = s[45 + i] = FREE
+        bb = self.bitboards
+        for piece in PIECES:
+            bb[piece] = 0
+        self.piece_hash = 0
+        self.material = self.tempo = self.center = self.edge = 0
+        self.mutation_count += 1
+
+    def set_square(self, idx, value):
+        """ Place value (FREE or a piece) on padded board index idx. """
+        bit = SQUARE_BIT[idx]
+        if not bit:
+            if value != OCCUPIED:
+                raise IndexError("Square %d is not on the board" % idx)
+            return
+        bb = self.bitboards
+        old_value = FREE
+        for piece in PIECES:
+            if bb[piece] & bit:
+                bb[piece] ^= bit
+                self.piece_hash ^= ZOBRIST[piece][idx]
+                old_value = piece
+        if value != FREE:
+            bb[value] |= bit
+            self.piece_hash ^= ZOBRIST[value][idx]
+        material, tempo, center, edge = eval_delta(
+            ((idx, old_value, value),))
+        self.material += material
+        self.tempo += tempo
+        self.center += center
+        self.edge += edge
+        self.mutation_count += 1
+
+    def count(self, color):
+        bb = self.bitboards
+        if color == BLACK:
+            return popcount(bb[BM] | bb[BK])
+        return popcount(bb[WM] | bb[WK])
 
     def lookup(self, square):
         return self.char_lookup[square & TYPES]
@@ -140,47 +301,68 @@ class Checkerboard(object):
             self.num_players -= 1
         if game.white_player.startswith("Computer"):
             self.num_players -= 1
-        squares = self.squares
-        for i in game.black_men:
-            squares[square_map[i]] = BLACK | MAN
-        for i in game.black_kings:
-            squares[square_map[i]] = BLACK | KING
-        for i in game.white_men:
-            squares[square_map[i]] = WHITE | MAN
-        for i in game.white_kings:
-            squares[square_map[i]] = WHITE | KING
+        bb = self.bitboards
+        bb[BM] = to_bitboard(square_map[i] for i in game.black_men)
+        bb[BK] = to_bitboard(square_map[i] for i in game.black_kings)
+        bb[WM] = to_bitboard(square_map[i] for i in game.white_men)
+        bb[WK] = to_bitboard(square_map[i] for i in game.white_kings)
+        self.piece_hash = hash_bitboards(bb)
+        self._count_eval_terms()
+        self.mutation_count += 1
         self.reset_undo()
         self.redo_list = game.moves
 
     def save_board_state(self):
         to_move = 'black' if self.to_move == BLACK else 'white'
-        black_men = []
-        black_kings = []
-        white_men = []
-        white_kings = []
-        for i, sq in enumerate(self.squares):
-            if sq == BLACK | MAN:
-                black_men.append(keymap[i])
-            elif sq == BLACK | KING:
-                black_kings.append(keymap[i])
-            elif sq == WHITE | MAN:
-                white_men.append(keymap[i])
-            elif sq == WHITE | KING:
-                white_kings.append(keymap[i])
-        black_men.sort()
-        black_kings.sort()
-        white_men.sort()
-        white_kings.sort()
+        bb = self.bitboards
+        black_men = self._labels(bb[BM])
+        black_kings = self._labels(bb[BK])
+        white_men = self._labels(bb[WM])
+        white_kings = self._labels(bb[WK])
         return to_move, black_men, black_kings, white_men, white_kings
 
+    def position(self):
+        """ The pieces and side to move as a small picklable value that
+        set_position restores; cheaper to pass between processes than the
+        board itself. """
+        bb = self.bitboards
+        return bb[BM], bb[BK], bb[WM], bb[WK], self.to_move
+
+    def set_position(self, position):
+        bb = self.bitboards
+        bb[BM], bb[BK], bb[WM], bb[WK], self.to_move = position
+        self.piece_hash = hash_bitboards(bb)
+        self._count_eval_terms()
+        self.mutation_count += 1
+
+    def _count_eval_terms(self):
+        """ Work out the EVAL_WEIGHTS terms from scratch. """
+        bb = self.bitboards
+        self.material = self.tempo = self.center = self.edge = 0
+        for piece in PIECES:
+            weights = EVAL_WEIGHTS[piece]
+            pieces = bb[piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                material, tempo, center, edge = weights[BIT_SQUARE[bit]]
+                self.material += material
+                self.tempo += tempo
+                self.center += center
+                self.edge += edge
+
+    def _labels(self, bb):
+        labels = []
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            labels.append(keymap[BIT_SQUARE[bit]])
+        labels.sort()
+        return labels
+
     def has_opposition(self, color):
-        sq = self.squares
-        cols = range(6, 10) if self.to_move == BLACK else range(12, 16)
-        pieces_in_system = 0
-        for i in cols:
-            for j in range(4):
-                if sq[i + 11 * j] != FREE:
-                    pieces_in_system += 1
+        system = EVEN_ROWS if self.to_move == BLACK else ODD_ROWS
+        pieces_in_system = popcount(~self.empty & system)
         return pieces_in_system % 2 == 1
 
     def row_col_for_index(self, idx):
@@ -190,10 +372,20 @@ class Checkerboard(object):
         del self.redo_list[:]
 
     def make_move(self, move, notify=True, undo=True, annotation=''):
-        sq = self.squares
-        for idx, _, new_value in move.affected_squares:
-            sq[idx] = new_value
+        toggles = move.toggles
+        if toggles is None:
+            toggles = compile_move(move)
+        bb = self.bitboards
+        for piece, mask in toggles:
+            bb[piece] ^= mask
+        self.piece_hash ^= move.hash_delta
+        material, tempo, center, edge = move.eval_delta
+        self.material += material
+        self.tempo += tempo
+        self.center += center
+        self.edge += edge
         self.to_move ^= COLORS
+        self.mutation_count += 1
 
         if notify:
             self.update_piece_count()
@@ -210,24 +402,46 @@ class Checkerboard(object):
                 return
             if redo:
                 move = self.undo_list.pop()
-        rev_move = Move([[idx, dest, src]
-                         for idx, src, dest in move.affected_squares])
-        rev_move.annotation = move.annotation
-        self.make_move(rev_move, notify, False)
+        # the toggles are their own inverse, so unmaking is making again
+        toggles = move.toggles
+        if toggles is None:
+            toggles = compile_move(move)
+        bb = self.bitboards
+        for piece, mask in toggles:
+            bb[piece] ^= mask
+        self.piece_hash ^= move.hash_delta
+        material, tempo, center, edge = move.eval_delta
+        self.material -= material
+        self.tempo -= tempo
+        self.center -= center
+        self.edge -= edge
+        self.to_move ^= COLORS
+        self.mutation_count += 1
+
+        if notify:
+            self._notify_undo(move)
         if redo:
             move.annotation = annotation
             self.redo_list.append(move)
 
+    def _notify_undo(self, move):
+        """ Observers redraw from the squares a move changes, so they get
+        the move played backwards. """
+        rev_move = Move(tuple((idx, dest, src)
+                              for idx, src, dest in move.squares),
+                        move.annotation)
+        self.update_piece_count()
+        for o in self.observers:
+            o.notify(rev_move)
+
     def undo_all_moves(self, annotation=''):
         while self.undo_list:
             move = self.undo_list.pop()
-            rev_move = Move([[idx, dest, src]
-                             for idx, src, dest in move.affected_squares])
-            rev_move.annotation = move.annotation
-            self.make_move(rev_move, True, False)
+            next_annotation = move.annotation
+            self.undo_move(move, True, False)
             move.annotation = annotation
             self.redo_list.append(move)
-            annotation = rev_move.annotation
+            annotation = next_annotation
 
     def redo_move(self, move=None, annotation=''):
         if move is None:
@@ -248,13 +462,29 @@ class Checkerboard(object):
         self.redo_list = []
 
     def utility(self, player):
-        """ Player evaluation function """
-        sq = self.squares
-        code = sum(self.value[s] for s in sq)
-        nwm = code % 16
-        nwk = (code >> 4) % 16
-        nbm = (code >> 8) % 16
-        nbk = (code >> 12) % 16
+        """ Player evaluation function, looked up in (and added to) this
+        process's evaluation cache if it has one """
+        cache = _eval_cache
+        if cache is None:
+            return self._evaluate(player)
+        # hash_key already tells the side to move; player is whose point
+        # of view the score is from
+        key = self.hash_key << 2 | player
+        score = cache.get(key)
+        if score is None:
+            score = self._evaluate(player)
+            cache.put(key, score)
+        return score
+
+    def _evaluate(self, player):
+        bb = self.bitboards
+        # the value table's low nibbles hold the black pieces, which this
+        # function has always called "nw*"
+        material = self.material
+        nwm = material & 0xF
+        nwk = material >> 4 & 0xF
+        nbm = material >> 8 & 0xF
+        nbk = material >> 12
 
         v1 = 100 * nbm + 130 * nbk
         v2 = 100 * nwm + 130 * nwk
@@ -275,219 +505,145 @@ class Checkerboard(object):
             multiplier = 1
 
         return multiplier * (
-            evaluation + self._eval_cramp(sq) +
-            self._eval_back_rank_guard(sq) + self._eval_double_corner(sq) +
-            self._eval_center(sq) + self._eval_edge(sq) +
-            self._eval_tempo(sq, nm, nbk, nbm, nwk, nwm) +
-            self._eval_player_opposition(sq, nwm, nwk, nbk, nbm, nm, nk))
+            evaluation + self._eval_cramp(bb) +
+            self._eval_back_rank_guard(bb) + self._eval_double_corner(bb) +
+            self.center + self.edge +
+            self._eval_tempo(bb, nm, nbk, nbm, nwk, nwm) +
+            self._eval_player_opposition(bb, nwm, nwk, nbk, nbm, nm, nk))
 
-    def _extend_capture(self, valid_moves, captures, add_sq_func, visited):
+    def _extend_capture(self, piece, captures, visited):
         player = self.to_move
+        bb = self.bitboards
+        if player == BLACK:
+            enemy_kings = bb[WK]
+            enemies = bb[WM] | enemy_kings
+        else:
+            enemy_kings = bb[BK]
+            enemies = bb[BM] | enemy_kings
+        empty = self.empty
         enemy = self.enemy
-        squares = self.squares
+        jump_table = JUMP[piece]
+        promotion = PROMOTION[piece]
         final_captures = []
-        capture = None
         while captures:
             c = captures.pop()
             new_captures = []
-            for j in valid_moves:
-                capture = c.affected_squares[:]
-                last_pos = capture[-1][0]
-                mid = last_pos + j
-                dest = last_pos + j * 2
-                if ((last_pos, mid, dest) not in visited
-                        and (dest, mid, last_pos) not in visited
-                        and squares[mid] & enemy and squares[dest] & FREE):
-                    sq2, sq3 = add_sq_func(player, squares, mid, dest,
-                                           last_pos)
-                    capture[-1][2] = FREE
-                    capture.extend([sq2, sq3])
+            capture = c.squares
+            last_pos, last_value, _ = capture[-1]
+            for mid, dest, mid_bit, dest_bit in jump_table[last_pos]:
+                if (mid_bit & enemies and dest_bit & empty
+                        and (last_pos, mid, dest) not in visited
+                        and (dest, mid, last_pos) not in visited):
+                    captured = (enemy | KING if mid_bit & enemy_kings
+                                else enemy | MAN)
+                    # the piece only passes through the square it jumped to
                     visited.add((last_pos, mid, dest))
-                    new_captures.append(Move(capture))
+                    new_captures.append(Move(
+                        capture[:-1] + ((last_pos, last_value, FREE),
+                                        (mid, captured, FREE),
+                                        (dest, FREE,
+                                         player | KING if dest_bit & promotion
+                                         else piece))))
             if new_captures:
                 captures.extend(new_captures)
             else:
-                final_captures.append(Move(capture))
+                compile_move(c)
+                final_captures.append(c)
         return final_captures
 
-    def _capture_man(self, player, squares, mid, dest, last_pos):
-        sq2 = [mid, squares[mid], FREE]
-        if ((player == BLACK and last_pos >= 34)
-                or (player == WHITE and last_pos <= 20)):
-            sq3 = [dest, FREE, player | KING]
-        else:
-            sq3 = [dest, FREE, player | MAN]
-        return sq2, sq3
-
-    def _capture_king(self, player, squares, mid, dest, last_pos):
-        sq2 = [mid, squares[mid], FREE]
-        sq3 = [dest, squares[dest], player | KING]
-        return sq2, sq3
-
     def _get_captures(self):
         player = self.to_move
         enemy = self.enemy
-        squares = self.squares
-        valid_indices = WHITE_IDX if player == WHITE else BLACK_IDX
+        bb = self.bitboards
+        empty = self.empty
+        if player == BLACK:
+            men, kings, enemy_kings = bb[BM], bb[BK], bb[WK]
+            enemies = bb[WM] | enemy_kings
+        else:
+            men, kings, enemy_kings = bb[WM], bb[WK], bb[BK]
+            enemies = bb[BM] | enemy_kings
+        man, king = player | MAN, player | KING
         all_captures = []
-        for i in self.valid_squares:
-            if squares[i] & player and squares[i] & MAN:
-                for j in valid_indices:
-                    mid = i + j
-                    dest = i + j * 2
-                    if squares[mid] & enemy and squares[dest] & FREE:
-                        sq1 = [i, player | MAN, FREE]
-                        sq2 = [mid, squares[mid], FREE]
-                        if ((player == BLACK and i >= 34)
-                                or (player == WHITE and i <= 20)):
-                            sq3 = [dest, FREE, player | KING]
-                        else:
-                            sq3 = [dest, FREE, player | MAN]
-                        capture = [Move([sq1, sq2, sq3])]
-                        visited = set()
-                        visited.add((i, mid, dest))
-                        temp = squares[i]
-                        squares[i] = FREE
-                        captures = self._extend_capture(
-                            valid_indices, capture, self._capture_man, visited)
-                        squares[i] = temp
-                        all_captures.extend(captures)
-            if squares[i] & player and squares[i] & KING:
-                for j in KING_IDX:
-                    mid = i + j
-                    dest = i + j * 2
-                    if squares[mid] & enemy and squares[dest] & FREE:
-                        sq1 = [i, player | KING, FREE]
-                        sq2 = [mid, squares[mid], FREE]
-                        sq3 = [dest, squares[dest], player | KING]
-                        capture = [Move([sq1, sq2, sq3])]
-                        visited = set()
-                        visited.add((i, mid, dest))
-                        temp = squares[i]
-                        squares[i] = FREE
-                        captures = self._extend_capture(
-                            KING_IDX, capture, self._capture_king, visited)
-                        squares[i] = temp
-                        all_captures.extend(captures)
+        # lowest square first, as the captures have always been listed
+        pieces = men | kings
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            i = BIT_SQUARE[bit]
+            piece = man if bit & men else king
+            promotion = PROMOTION[piece]
+            for mid, dest, mid_bit, dest_bit in JUMP[piece][i]:
+                if not (mid_bit & enemies and dest_bit & empty):
+                    continue
+                sq1 = (i, piece, FREE)
+                sq2 = (mid, (enemy | KING if mid_bit & enemy_kings
+                             else enemy | MAN), FREE)
+                sq3 = (dest, FREE, king if dest_bit & promotion else piece)
+                visited = set()
+                visited.add((i, mid, dest))
+                # lift the piece so the squares it left count as empty
+                bb[piece] ^= bit
+                all_captures.extend(self._extend_capture(
+                    piece, [Move((sq1, sq2, sq3))], visited))
+                bb[piece] ^= bit
         return all_captures
 
     captures = property(_get_captures,
                         doc="Forced captures for the current player")
 
+    def _get_legal_moves(self):
+        mutation_count, to_move, moves = self._legal_moves_cache
+        if mutation_count == self.mutation_count and to_move == self.to_move:
+            return moves
+        moves = self._get_captures() or self._get_moves()
+        self._legal_moves_cache = (self.mutation_count, self.to_move, moves)
+        return moves
+
+    legal_moves = property(
+        _get_legal_moves,
+        doc="Forced captures or, if there are none, available moves for the "
+            "current player. The list is shared until the board next "
+            "changes, so don't modify it.")
+
     def _get_moves(self):
-        player = self.to_move
-        squares = self.squares
-        valid_indices = WHITE_IDX if player == WHITE else BLACK_IDX
+        bb = self.bitboards
+        empty = self.empty
+        if self.to_move == BLACK:
+            men, kings = bb[BM], bb[BK]
+            step_moves = (STEP_MOVES[BM], STEP_MOVES[BK])
+        else:
+            men, kings = bb[WM], bb[WK]
+            step_moves = (STEP_MOVES[WM], STEP_MOVES[WK])
+        man_moves, king_moves = step_moves
         moves = []
-        for i in self.valid_squares:
-            for j in valid_indices:
-                dest = i + j
-                if (squares[i] & player and squares[i] & MAN
-                        and squares[dest] & FREE):
-                    sq1 = [i, player | MAN, FREE]
-                    if ((player == BLACK and i >= 39)
-                            or (player == WHITE and i <= 15)):
-                        sq2 = [dest, FREE, player | KING]
-                    else:
-                        sq2 = [dest, FREE, player | MAN]
-                    moves.append(Move([sq1, sq2]))
-            for j in KING_IDX:
-                dest = i + j
-                if (squares[i] & player and squares[i] & KING
-                        and squares[dest] & FREE):
-                    sq1 = [i, player | KING, FREE]
-                    sq2 = [dest, FREE, player | KING]
-                    moves.append(Move([sq1, sq2]))
+        # lowest square first, as the moves have always been listed
+        pieces = men | kings
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            table = man_moves if bit & men else king_moves
+            for dest_bit, squares, toggles, hash_delta, deltas in \
+                    table[BIT_SQUARE[bit]]:
+                if dest_bit & empty:
+                    moves.append(Move(squares, '', toggles, hash_delta,
+                                      deltas))
         return moves
 
     moves = property(_get_moves, doc="Available moves for the current player")
 
-    def _eval_cramp(self, sq):
-        evaluation = 0
-        if sq[28] == BLACK | MAN and sq[34] == WHITE | MAN:
-            evaluation += CRAMP
-        if sq[26] == WHITE | MAN and sq[20] == BLACK | MAN:
-            evaluation -= CRAMP
-        return evaluation
+    def _eval_cramp(self, bb):
+        return CRAMP_SCORES[bb[BM] & CRAMP_BLACK | bb[WM] & CRAMP_WHITE]
 
-    def _eval_back_rank_guard(self, sq):
-        evaluation = 0
-        code = 0
-        if sq[6] & MAN:
-            code += 1
-        if sq[7] & MAN:
-            code += 2
-        if sq[8] & MAN:
-            code += 4
-        if sq[9] & MAN:
-            code += 8
-        back_rank = self.rank[code]
-
-        code = 0
-        if sq[45] & MAN:
-            code += 8
-        if sq[46] & MAN:
-            code += 4
-        if sq[47] & MAN:
-            code += 2
-        if sq[48] & MAN:
-            code += 1
-        back_rank = back_rank - self.rank[code]
-        evaluation *= BRV * back_rank
-        return evaluation
+    def _eval_back_rank_guard(self, bb):
+        return BACK_RANK_SCORES[(bb[BM] | bb[WM]) & BACK_RANK]
 
-    def _eval_double_corner(self, sq):
-        evaluation = 0
-        if sq[9] == BLACK | MAN:
-            if sq[14] == BLACK | MAN or sq[15] == BLACK | MAN:
-                evaluation += INTACT_DOUBLE_CORNER
+    def _eval_double_corner(self, bb):
+        return DOUBLE_CORNER_SCORES[bb[BM] & DOUBLE_CORNER_BLACK |
+                                    bb[WM] & DOUBLE_CORNER_WHITE]
 
-        if sq[45] == WHITE | MAN:
-            if sq[39] == WHITE | MAN or sq[40] == WHITE | MAN:
-                evaluation -= INTACT_DOUBLE_CORNER
-        return evaluation
-
-    def _eval_center(self, sq):
-        evaluation = 0
-        nbmc = nbkc = nwmc = nwkc = 0
-        for c in self.center:
-            if sq[c] != FREE:
-                if sq[c] == BLACK | MAN:
-                    nbmc += 1
-                if sq[c] == BLACK | KING:
-                    nbkc += 1
-                if sq[c] == WHITE | MAN:
-                    nwmc += 1
-                if sq[c] == WHITE | KING:
-                    nwkc += 1
-        evaluation += (nbmc - nwmc) * MCV
-        evaluation += (nbkc - nwkc) * KCV
-        return evaluation
-
-    def _eval_edge(self, sq):
+    def _eval_tempo(self, bb, nm, nbk, nbm, nwk, nwm):
         evaluation = 0
-        nbme = nbke = nwme = nwke = 0
-        for e in self.edge:
-            if sq[e] != FREE:
-                if sq[e] == BLACK | MAN:
-                    nbme += 1
-                if sq[e] == BLACK | KING:
-                    nbke += 1
-                if sq[e] == WHITE | MAN:
-                    nwme += 1
-                if sq[e] == WHITE | KING:
-                    nwke += 1
-        evaluation -= (nbme - nwme) * MEV
-        evaluation -= (nbke - nwke) * KEV
-        return evaluation
-
-    def _eval_tempo(self, sq, nm, nbk, nbm, nwk, nwm):
-        evaluation = tempo = 0
-        for i in range(6, 49):
-            if sq[i] == BLACK | MAN:
-                tempo += self.row[i]
-            if sq[i] == WHITE | MAN:
-                tempo -= 7 - self.row[i]
+        tempo = self.tempo
 
         if nm >= 16:
             evaluation += OPENING * tempo
@@ -496,65 +652,198 @@ class Checkerboard(object):
         if nm < 9:
             evaluation += ENDGAME * tempo
 
-        for s in self.safe_edge:
-            if nbk + nbm > nwk + nwm and nwk < 3 and sq[s] == WHITE | KING:
-                evaluation -= 15
-            if nwk + nwm > nbk + nbm and nbk < 3 and sq[s] == BLACK | KING:
-                evaluation += 15
+        safe_edge = self.safe_edge_mask
+        if nbk + nbm > nwk + nwm and nwk < 3:
+            evaluation -= 15 * popcount(bb[WK] & safe_edge)
+        if nwk + nwm > nbk + nbm and nbk < 3:
+            evaluation += 15 * popcount(bb[BK] & safe_edge)
         return evaluation
 
-    def _eval_player_opposition(self, sq, nwm, nwk, nbk, nbm, nm, nk):
-        evaluation = 0
-        pieces_in_system = 0
-        tn = nm + nk
-        if nwm + nwk - nbk - nbm == 0:
-            if self.to_move == BLACK:
-                for i in range(6, 10):
-                    for j in range(4):
-                        if sq[i + 11 * j] != FREE:
-                            pieces_in_system += 1
-                if pieces_in_system % 2:
-                    if tn <= 12:
-                        evaluation += 1
-                    if tn <= 10:
-                        evaluation += 1
-                    if tn <= 8:
-                        evaluation += 2
-                    if tn <= 6:
-                        evaluation += 2
-                else:
-                    if tn <= 12:
-                        evaluation -= 1
-                    if tn <= 10:
-                        evaluation -= 1
-                    if tn <= 8:
-                        evaluation -= 2
-                    if tn <= 6:
-                        evaluation -= 2
+    def _eval_player_opposition(self, bb, nwm, nwk, nbk, nbm, nm, nk):
+        if nwm + nwk - nbk - nbm:
+            return 0
+        system, scores = OPPOSITION_SCORES[self.to_move]
+        occupied = bb[BM] | bb[BK] | bb[WM] | bb[WK]
+        return scores[popcount(occupied & system) % 2][nm + nk]
+
+
+# EVAL_WEIGHTS[piece][idx] -> (material, tempo, center, edge) that piece on
+# padded board index idx adds to the evaluation terms a Checkerboard keeps
+# up to date as moves are made and unmade: material holds the piece counts
+# a nibble each, as Checkerboard.value packs them; tempo is the row of each
+# black man less the rows each white man has still to go; center and edge
+# are those terms of utility. They are kept apart, though whole numbers,
+# so that utility adds them to its fractional material term one at a time,
+# as it always has, and scores come out the same to the last bit.
+EVAL_WEIGHTS = [[(0, 0, 0, 0)] * 56 for _ in range(FREE + 1)]
+for _piece, _center, _edge in ((BM, MCV, -MEV), (BK, KCV, -KEV),
+                               (WM, -MCV, MEV), (WK, -KCV, KEV)):
+    for _idx in VALID_SQUARES:
+        if _piece == BM:
+            _tempo = Checkerboard.row[_idx]
+        elif _piece == WM:
+            _tempo = Checkerboard.row[_idx] - 7
+        else:
+            _tempo = 0
+        EVAL_WEIGHTS[_piece][_idx] = (
+            Checkerboard.value[_piece], _tempo,
+            _center if _idx in Checkerboard.center else 0,
+            _edge if _idx in Checkerboard.edge else 0)
+del _piece, _center, _edge, _idx, _tempo
+
+
+def eval_delta(squares):
+    """ The change a move through squares makes to the evaluation terms
+    in EVAL_WEIGHTS; unmaking it subtracts the same amounts. """
+    material = tempo = center = edge = 0
+    for idx, old_value, new_value in squares:
+        old = EVAL_WEIGHTS[old_value][idx]
+        new = EVAL_WEIGHTS[new_value][idx]
+        material += new[0] - old[0]
+        tempo += new[1] - old[1]
+        center += new[2] - old[2]
+        edge += new[3] - old[3]
+    return material, tempo, center, edge
+
+
+# Score tables for the utility terms that look at a few squares each. A
+# term's table is keyed by the bitboards it reads masked down to those
+# squares, and is filled in here by running the rules for the term over
+# every arrangement of pieces on them.
+def _pattern_table(masks, score):
+    """ Return {key: score(*bitboards)} for every key made by OR-ing
+    together a subset of each of masks, bitboards being key & mask for
+    each mask in turn. """
+    squares = []
+    for mask in masks:
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            squares.append(bit)
+    table = {}
+    for subset in range(1 << len(squares)):
+        key = 0
+        for n, bit in enumerate(squares):
+            if subset >> n & 1:
+                key |= bit
+        table[key] = score(*(key & mask for mask in masks))
+    return table
+
+
+def _cramp(black_men, white_men):
+    evaluation = 0
+    if black_men & SQUARE_BIT[28] and white_men & SQUARE_BIT[34]:
+        evaluation += CRAMP
+    if white_men & SQUARE_BIT[26] and black_men & SQUARE_BIT[20]:
+        evaluation -= CRAMP
+    return evaluation
+
+
+def _back_rank_guard(men):
+    evaluation = 0
+    # squares 6, 7, 8, 9 already sit in bits 0-3 in code order
+    code = men & 0xF
+    back_rank = Checkerboard.rank[code]
+
+    code = 0
+    if men & SQUARE_BIT[45]:
+        code += 8
+    if men & SQUARE_BIT[46]:
+        code += 4
+    if men & SQUARE_BIT[47]:
+        code += 2
+    if men & SQUARE_BIT[48]:
+        code += 1
+    back_rank = back_rank - Checkerboard.rank[code]
+    # evaluation starts at 0, so the guard has always scored 0
+    evaluation *= BRV * back_rank
+    return evaluation
+
+
+def _double_corner(black_men, white_men):
+    evaluation = 0
+    if black_men & SQUARE_BIT[9]:
+        if black_men & (SQUARE_BIT[14] | SQUARE_BIT[15]):
+            evaluation += INTACT_DOUBLE_CORNER
+
+    if white_men & SQUARE_BIT[45]:
+        if white_men & (SQUARE_BIT[39] | SQUARE_BIT[40]):
+            evaluation -= INTACT_DOUBLE_CORNER
+    return evaluation
+
+
+def _opposition(to_move, pieces_in_system, pieces):
+    evaluation = 0
+    if to_move == BLACK:
+        has_opposition = pieces_in_system % 2 == 1
+    else:
+        has_opposition = pieces_in_system % 2 == 0
+    if has_opposition:
+        if pieces <= 12:
+            evaluation += 1
+        if pieces <= 10:
+            evaluation += 1
+        if pieces <= 8:
+            evaluation += 2
+        if pieces <= 6:
+            evaluation += 2
+    else:
+        if pieces <= 12:
+            evaluation -= 1
+        if pieces <= 10:
+            evaluation -= 1
+        if pieces <= 8:
+            evaluation -= 2
+        if pieces <= 6:
+            evaluation -= 2
+    return evaluation
+
+
+CRAMP_BLACK = to_bitboard((20, 28))
+CRAMP_WHITE = to_bitboard((26, 34))
+CRAMP_SCORES = _pattern_table((CRAMP_BLACK, CRAMP_WHITE), _cramp)
+
+BACK_RANK = to_bitboard((6, 7, 8, 9, 45, 46, 47, 48))
+BACK_RANK_SCORES = _pattern_table((BACK_RANK,), _back_rank_guard)
+
+DOUBLE_CORNER_BLACK = to_bitboard((9, 14, 15))
+DOUBLE_CORNER_WHITE = to_bitboard((39, 40, 45))
+DOUBLE_CORNER_SCORES = _pattern_table(
+    (DOUBLE_CORNER_BLACK, DOUBLE_CORNER_WHITE), _double_corner)
+
+# OPPOSITION_SCORES[to_move] -> (system, scores): the opposition term
+# when the sides are level in material is scores[parity][pieces], parity
+# being the number of pieces in system % 2 and pieces those on the board
+OPPOSITION_SCORES = {
+    color: (system, [[_opposition(color, parity, pieces)
+                      for pieces in range(25)] for parity in (0, 1)])
+    for color, system in ((BLACK, EVEN_ROWS), (WHITE, ODD_ROWS))}
+
+
+# STEP_MOVES[piece][idx] ->
+#     ((dest_bit, squares, toggles, hash_delta, eval_delta), ...)
+# ready to build a non-capturing Move of piece from idx, in STEP order.
+STEP_MOVES = {}
+for _piece in PIECES:
+    STEP_MOVES[_piece] = _table = [()] * 56
+    for _idx in VALID_SQUARES:
+        _bit = SQUARE_BIT[_idx]
+        _entries = []
+        for _dest, _dest_bit in STEP[_piece][_idx]:
+            if _dest_bit & PROMOTION[_piece]:
+                _new_value = _piece ^ MAN ^ KING
+                _toggles = ((_piece, _bit), (_new_value, _dest_bit))
             else:
-                for i in range(12, 16):
-                    for j in range(4):
-                        if sq[i + 11 * j] != FREE:
-                            pieces_in_system += 1
-                if pieces_in_system % 2 == 0:
-                    if tn <= 12:
-                        evaluation += 1
-                    if tn <= 10:
-                        evaluation += 1
-                    if tn <= 8:
-                        evaluation += 2
-                    if tn <= 6:
-                        evaluation += 2
-                else:
-                    if tn <= 12:
-                        evaluation -= 1
-                    if tn <= 10:
-                        evaluation -= 1
-                    if tn <= 8:
-                        evaluation -= 2
-                    if tn <= 6:
-                        evaluation -= 2
-        return evaluation
+                _new_value = _piece
+                _toggles = ((_piece, _bit | _dest_bit),)
+            _squares = ((_idx, _piece, FREE), (_dest, FREE, _new_value))
+            _entries.append(
+                (_dest_bit, _squares, _toggles,
+                 ZOBRIST[_piece][_idx] ^ ZOBRIST[_new_value][_dest],
+                 eval_delta(_squares)))
+        _table[_idx] = tuple(_entries)
+del _piece, _table, _idx, _bit, _entries, _dest, _dest_bit, _new_value, \
+    _toggles, _squares
 
 
 class Checkers(games.Game):
@@ -565,11 +854,22 @@ class Checkers(games.Game):
 
     def captures_available(self, curr_state=None):
         state = curr_state or self.curr_state
-        return state.captures
+        # captures are forced, so when there are any they are the legal
+        # moves; a capture passes through at least three squares
+        moves = state.legal_moves
+        if moves and len(moves[0].squares) > 2:
+            return moves
+        return []
+
+    def probe(self, curr_state=None, ply=0):
+        tablebase = _tablebase
+        if tablebase is None:
+            return None
+        return tablebase.score(curr_state or self.curr_state, ply)
 
     def legal_moves(self, curr_state=None):
         state = curr_state or self.curr_state
-        return state.captures or state.moves
+        return state.legal_moves
 
     def make_move(self,
                   move,
@@ -605,14 +905,24 @@ class Checkers(games.Game):
         state = curr_state or self.curr_state
         return state.utility(player)
 
+    def hash_key(self, curr_state=None):
+        state = curr_state or self.curr_state
+        return state.hash_key
+
     def terminal_test(self, curr_state=None):
         state = curr_state or self.curr_state
         return not self.legal_moves(state)
 
-    def successors(self, curr_state=None):
+    def move_key(self, move):
+        squares = move.squares
+        return squares[0][0], squares[-1][0]
+
+    def successors(self, curr_state=None, first=None, moves=None):
         move = None
         state = curr_state or self.curr_state
-        moves = self.legal_moves(state)
+        if moves is None:
+            moves = self.legal_moves(state)
+        moves = games.order_first(moves, first)
         if not moves:
             yield [], state
         else:
@@ -621,47 +931,105 @@ class Checkers(games.Game):
                 try:
                     for move in moves:
                         undone = False
-                        self.make_move(move, state, False)
+                        self.make_move(move, state, False, False)
                         yield move, state
-                        self.undo_move(move, state, False)
+                        self.undo_move(move, state, False, False)
                         undone = True
                 except GeneratorExit:
                     raise
             finally:
                 if moves and not undone:
-                    self.undo_move(move, state, False)
+                    self.undo_move(move, state, False, False)
 
     def perft(self, depth, curr_state=None):
         if depth == 0:
             return 1
 
         state = curr_state or self.curr_state
+        moves = self.legal_moves(state)
+        if depth == 1:
+            return len(moves)
         nodes = 0
-        for move in self.legal_moves(state):
+        for move in moves:
             state.make_move(move, False, False)
             nodes += self.perft(depth - 1, state)
             state.undo_move(move, False, False)
         return nodes
 
 
+def compile_move(move):
+    """ Work out the bitboard toggles, Zobrist delta and evaluation term
+    changes that make (and unmake) move, and cache them on it. """
+    masks = {}
+    hash_delta = 0
+    for idx, old_value, new_value in move.squares:
+        bit = SQUARE_BIT[idx]
+        masks[old_value] = masks.get(old_value, 0) ^ bit
+        masks[new_value] = masks.get(new_value, 0) ^ bit
+        hash_delta ^= ZOBRIST[old_value][idx] ^ ZOBRIST[new_value][idx]
+    move.toggles = tuple((piece, mask) for piece, mask in masks.items()
+                         if piece != FREE and mask)
+    move.hash_delta = hash_delta
+    move.eval_delta = eval_delta(move.squares)
+    return move.toggles
+
+
 def longest_of(moves):
     length = -1
     selected = None
     for move in moves:
-        current_length = len(move.affected_squares)
+        current_length = len(move.squares)
         if current_length > length:
             length = current_length
             selected = move
     return selected
 
 
-def calc_ai_move(model, search_time):
+def search_position(model, search_time, stats=None, report=None):
+    """ The search calc_ai_move runs in a single process: iterative
+    deepening of negamax_search with quiescence, on a copy of model, for
+    about search_time seconds. Return (score, move, pv, nodes) from the
+    deepest iteration that completed, the score for the side to move, or
+    None if a SearchTimeout from outside stopped the first one. stats and
+    report are as for games.iterative_deepening_search. """
+    model_copy = copy.deepcopy(model)
+    return games.iterative_deepening_search(
+        model_copy.curr_state, model_copy, search_time,
+        quiescence=games.Quiescence(), search=negamax_search, stats=stats,
+        report=report)
+
+
+def calc_ai_move(model, search_time, workers=1, engine='smp', stats=False,
+                 book=True):
+    """ Choose a move for the side to move in model within about
+    search_time seconds. With more than one worker, engine picks how the
+    search is spread across that many processes: 'smp' has them all
+    search the whole tree, sharing a transposition table (Lazy SMP), and
+    'split' hands each of them root moves to search.
+    With book set, a position the opening book (see set_book) knows gets
+    its book move without a search.
+    With stats set, return (move, SearchStats) instead of the move. """
+    search_stats = SearchStats() if stats else None
+    book_move = None
+    if book and _book is not None:
+        book_move = _book.choose(model.curr_state)
     captures = model.captures_available()
-    if captures:
+    if book_move is not None:
+        move = book_move
+    elif captures:
         move = longest_of(captures)
+    elif workers > 1 and engine == 'smp':
+        move = lazy_smp_search(model.curr_state, model, search_time,
+                               workers, stats=search_stats)
+    elif workers > 1:
+        move = parallel_iterative_deepening_search(
+            model.curr_state, model, search_time, workers,
+            stats=search_stats)
     else:
-        model_copy = copy.deepcopy(model)
-        move = games.alphabeta_search(model_copy.curr_state, model_copy, 6)
+        found = search_position(model, search_time, search_stats)
+        move = found[1] if found is not None else None
+    if stats:
+        return move, search_stats
     return move
 
 
@@ -0,0 +1,292 @@
+""" Perft benchmark and move generator regression suite.
+
+Perft counts the leaf nodes of the tree of legal moves to a fixed depth.
+A miscount at any depth means the move generator (or make/undo) is wrong,
+and the time taken tracks the speed of both. POSITIONS holds the start
+position, the king endings from training/ElementaryKingEndings and some
+multi-jump positions, with their known counts; the counts other than the
+start position's published ones were checked against an independent
+move generator.
+
+    python -m game.perft                   suite to depth 6
+    python -m game.perft --depth 8         suite to depth 8
+    python -m game.perft --json            same, as JSON
+    python -m game.perft --divide 5 FEN    counts under each root move
+    python -m game.perft --hashed          reuse counts of transpositions
+    python -m game.perft --workers 4       hashed, split over 4 processes
+
+hashed_perft keeps the count below each position it has finished in a
+PerftTable, so a position reached again by another move order is counted
+once. parallel_perft plays the first ply or two in the parent, merges the
+positions that repeat, and hands the rest to a pool of processes that each
+keep their own table.
+
+The exit status is 1 if any count is wrong. """
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from game.checkers import Checkers
+from parsing.PDN import PDNReader
+from util.globalconst import keymap
+
+START_FEN = ('B:W21,22,23,24,25,26,27,28,29,30,31,32:'
+             'B1,2,3,4,5,6,7,8,9,10,11,12')
+DEFAULT_DEPTH = 6
+TABLE_SIZE = 2 ** 20
+SPLIT_DEPTH = 2
+
+# (name, FEN, perft counts for depths 1, 2, ...)
+POSITIONS = [
+    ('start', START_FEN,
+     (7, 49, 302, 1469, 7361, 36768, 179740, 845931, 3963680, 18391564)),
+    # training/ElementaryKingEndings
+    ('2 kings v 1 king, draw', 'W:WK18:BK29,K30',
+     (4, 12, 38, 134, 462, 1882, 6249, 27925)),
+    ('2 kings v 1 king, win', 'W:WK6,K9:BK15',
+     (6, 21, 105, 372, 1640, 6006, 34311, 106810)),
+    ('3 kings v 2 kings, same double corner', 'W:WK18,K19,K20:BK27,K28',
+     (10, 44, 246, 706, 3892, 15443, 101139, 359816)),
+    ('3 kings v 2 kings, opposite double corners', 'W:WK10,K15,K19:BK9,K27',
+     (8, 36, 250, 1264, 8874, 41108, 316946, 1567686)),
+    ('3 kings v 2 kings, same single corner', 'W:WK13,K14,K15:BK21,K22',
+     (10, 44, 246, 1008, 6578, 29883, 210601, 939669)),
+    # multi-jumps, branching and crowning on the last jump
+    ('black triple jumps', 'B:W6,7,14,15,22,23,30:B1,2',
+     (6, 24, 57, 340, 1108, 6708, 23312, 144362)),
+    ('white triple jumps to crown', 'W:W26,27,31,32:B6,7,14,15,18,22,23',
+     (4, 22, 86, 327, 1606, 7523, 40897, 203332)),
+    ('black jumps to crown', 'B:W9,18,19,26,27:B5,6',
+     (3, 16, 48, 205, 666, 2542, 9132, 34090)),
+    ('white jumps from both sides', 'W:W30,31:B26,18,10,11,19,20',
+     (4, 20, 80, 316, 1088, 4323, 16091, 65906)),
+    ('king jumps back to its own square', 'B:W14,15,22,23,24,30:B2,K10',
+     (4, 20, 96, 432, 1748, 7355, 30961, 128284)),
+]
+
+
+def game_from_fen(fen):
+    game = Checkers()
+    game.curr_state.setup_game(PDNReader(None).game_params_from_fen(fen))
+    return game
+
+
+def move_text(move):
+    """ A move in PDN notation: 9-14 for a move, 2x11x18 for a jump. """
+    squares = move.affected_squares
+    if len(squares) == 2:
+        return '%d-%d' % (keymap[squares[0][0]], keymap[squares[1][0]])
+    return 'x'.join(str(keymap[sq[0]]) for sq in squares[::2])
+
+
+def divide(game, depth):
+    """ Return (move text, perft count below it) for each root move. """
+    state = game.curr_state
+    result = []
+    for move in list(state.legal_moves):
+        state.make_move(move, False, False)
+        result.append((move_text(move), game.perft(depth - 1)))
+        state.undo_move(move, False, False)
+    return result
+
+
+class PerftTable(object):
+    """ Fixed-size table of perft counts keyed by a position's hash_key.
+    Slot key & mask holds (key, depth, count); a bucket has a
+    depth-preferred slot and an always-replace one, as the search's
+    TranspositionTable does. """
+
+    def __init__(self, size=TABLE_SIZE):
+        if size & (size - 1):
+            raise ValueError("Table size must be a power of two")
+        self.mask = size - 1
+        self.deep = [None] * size
+        self.recent = [None] * size
+        self.hits = 0
+
+    def probe(self, key, depth):
+        """ Return the count below key at depth, or None. """
+        idx = key & self.mask
+        for entry in (self.deep[idx], self.recent[idx]):
+            if entry is not None and entry[0] == key and entry[1] == depth:
+                self.hits += 1
+                return entry[2]
+        return None
+
+    def store(self, key, depth, count):
+        idx = key & self.mask
+        deep = self.deep[idx]
+        if deep is None or deep[0] == key or depth >= deep[1]:
+            self.deep[idx] = (key, depth, count)
+        else:
+            self.recent[idx] = (key, depth, count)
+
+
+def hashed_perft(game, depth, table, state=None):
+    """ perft(depth) of state (the game's current state by default),
+    looking up and storing the count below every position two or more
+    plies from the leaves in table. """
+    state = state or game.curr_state
+    moves = state.legal_moves
+    if depth <= 1:
+        return len(moves) if depth else 1
+    key = state.hash_key
+    nodes = table.probe(key, depth)
+    if nodes is not None:
+        return nodes
+    nodes = 0
+    for move in moves:
+        state.make_move(move, False, False)
+        nodes += hashed_perft(game, depth - 1, table, state)
+        state.undo_move(move, False, False)
+    table.store(key, depth, nodes)
+    return nodes
+
+
+def split_positions(game, plies):
+    """ Return a Counter of the position() values plies moves from the
+    game's current state, counting each by the move orders reaching it. """
+    state = game.curr_state
+    positions = Counter()
+
+    def expand(plies):
+        if plies == 0:
+            positions[state.position()] += 1
+            return
+        for move in state.legal_moves:
+            state.make_move(move, False, False)
+            expand(plies - 1)
+            state.undo_move(move, False, False)
+    expand(plies)
+    return positions
+
+
+# per worker process: a board to set positions on, and its table
+_worker = {'game': None, 'table': None}
+
+
+def _init_worker(table_size):
+    _worker.update(game=Checkers(), table=PerftTable(table_size))
+
+
+def _perft_position(position, depth):
+    game = _worker['game']
+    game.curr_state.set_position(position)
+    return hashed_perft(game, depth, _worker['table'])
+
+
+def parallel_perft(game, depth, workers=None, split=SPLIT_DEPTH,
+                   table_size=TABLE_SIZE):
+    """ perft(depth) of the game's current state, the positions split
+    plies on being counted by a pool of workers processes
+    (os.cpu_count() by default) with hashed_perft. """
+    split = min(split, depth - 1)
+    if split < 1:
+        return hashed_perft(game, depth, PerftTable(table_size))
+    positions = split_positions(game, split)
+    # the biggest subtrees first, so no worker is left with a long one
+    # at the end
+    jobs = sorted(positions, key=lambda position: -positions[position])
+    with ProcessPoolExecutor(workers or os.cpu_count(),
+                             initializer=_init_worker,
+                             initargs=(table_size,)) as pool:
+        counts = pool.map(_perft_position, jobs,
+                          [depth - split] * len(jobs))
+        return sum(positions[position] * nodes
+                   for position, nodes in zip(jobs, counts))
+
+
+def count_nodes(game, depth, hashed=False, workers=1,
+                table_size=TABLE_SIZE):
+    """ perft(depth) with the plain recursion, hashed_perft, or (if
+    workers is more than one) parallel_perft. """
+    if workers > 1:
+        return parallel_perft(game, depth, workers, table_size=table_size)
+    if hashed:
+        return hashed_perft(game, depth, PerftTable(table_size))
+    return game.perft(depth)
+
+
+def run_position(name, fen, counts, depth, hashed=False, workers=1):
+    """ Time perft(depth) on fen and check it against the known counts
+    (when there is one for depth). """
+    game = game_from_fen(fen)
+    start = time.perf_counter()
+    nodes = count_nodes(game, depth, hashed, workers)
+    seconds = time.perf_counter() - start
+    expected = counts[depth - 1] if depth <= len(counts) else None
+    return {'name': name, 'fen': fen, 'depth': depth, 'nodes': nodes,
+            'expected': expected, 'ok': expected in (None, nodes),
+            'seconds': seconds,
+            'nps': nodes / seconds if seconds else 0.0}
+
+
+def run_suite(depth=DEFAULT_DEPTH, positions=POSITIONS, hashed=False,
+              workers=1):
+    """ Run every position to depth (or its deepest known count, if that
+    is shallower). """
+    return [run_position(name, fen, counts, min(depth, len(counts)),
+                         hashed, workers)
+            for name, fen, counts in positions]
+
+
+def summary(results):
+    nodes = sum(r['nodes'] for r in results)
+    seconds = sum(r['seconds'] for r in results)
+    return {'positions': results, 'nodes': nodes, 'seconds': seconds,
+            'nps': nodes / seconds if seconds else 0.0,
+            'ok': all(r['ok'] for r in results)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m game.perft',
+        description='Perft benchmark and move generator regression suite.')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help='perft depth (default %(default)s)')
+    parser.add_argument('--divide', type=int, metavar='DEPTH',
+                        help='print the count under each root move of FEN')
+    parser.add_argument('--hashed', action='store_true',
+                        help='count each transposition once')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='split the count over this many processes '
+                             '(implies --hashed)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    parser.add_argument('fen', nargs='?', default=START_FEN,
+                        help='position for --divide (default: the start)')
+    args = parser.parse_args(argv)
+
+    if args.divide:
+        counts = divide(game_from_fen(args.fen), args.divide)
+        if args.json:
+            print(json.dumps(dict(counts), indent=2))
+        else:
+            for text, nodes in counts:
+                print('%-16s %d' % (text, nodes))
+            print('%-16s %d' % ('total', sum(n for _, n in counts)))
+        return 0
+
+    report = summary(run_suite(args.depth, hashed=args.hashed,
+                               workers=args.workers))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for r in report['positions']:
+            status = ('ok' if r['expected'] is not None else
+                      'no count') if r['ok'] else (
+                'WRONG, expected %d' % r['expected'])
+            print('%-44s %2d %10d %8.3fs %9.0f nps  %s'
+                  % (r['name'], r['depth'], r['nodes'], r['seconds'],
+                     r['nps'], status))
+        print('%-44s    %10d %8.3fs %9.0f nps'
+              % ('total', report['nodes'], report['seconds'], report['nps']))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
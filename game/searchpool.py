@@ -0,0 +1,490 @@
+""" Move searches for the web API, run off the event loop.
+
+calc_ai_move is CPU-bound for the whole of its search time, so an async
+endpoint that called it inline would hold up every other request until
+it finished. search() hands it to a pool of worker processes instead and
+awaits the result, so the event loop goes on serving while the search
+runs.
+
+The pool is bounded twice over: it has a fixed number of processes, and
+only so many searches may be running or queued for one at a time; past
+that search() raises SearchPoolBusy rather than letting the queue grow.
+
+A search whose client goes away is stopped. Each search holds a slot
+with a cancel flag and the pid of the worker running it, both in shared
+memory; cancelling sets the flag and signals the worker, whose handler
+raises SearchTimeout if its current search is the one flagged. A search
+still queued sees the flag and returns at once.
+
+An analysis is a search run as a job: start_analysis() returns an
+Analysis at once, and the search reports each iteration it completes
+(depth, score, principal variation and nodes) on a queue the workers
+share, which a thread of this process hands on to the job. Clients
+follow the iterations as they come, may stop the search once they have
+seen enough, and read the result when it is done.
+
+The pool is created on first use, and its workers are set up with the
+evaluation cache size, tablebase and opening book of the process as it
+is then: they are handed over in the pool's initargs and opened again
+in each worker, so searches in the pool play as calc_ai_move does here
+whatever the start method. The pool starts again if they change.
+Searches spread over several processes of their own (workers > 1) keep
+using their engine's pool instead, one at a time, from a thread; they
+hold slots all the same, so count towards the same bound, and stopping
+one stops the engine's processes. """
+
+import asyncio
+import atexit
+import os
+import signal
+import threading
+import multiprocessing
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.sharedctypes import RawArray
+
+import ai.lazysmp as lazysmp
+import ai.parallel as parallel
+from ai.games import SearchTimeout
+from game.book import OpeningBook
+from game.checkers import (Checkers, calc_ai_move, get_book, get_eval_cache,
+                           get_tablebase, search_position, set_book,
+                           set_eval_cache_size, set_tablebase)
+from game.perft import move_text
+from game.tbprobe import Tablebase
+from util.globalconst import keymap
+
+# how often a running search checks whether its client is still there
+DISCONNECT_POLL = 0.25
+CANCEL_SIGNAL = getattr(signal, 'SIGUSR1', None)
+# how the pool's processes are started; None for the platform's default
+START_METHOD = None
+# analyses kept, finished ones making way for new ones oldest first
+MAX_ANALYSES = 256
+
+
+class SearchPoolBusy(Exception):
+    """ Raised when as many searches as the pool takes are already
+    running or queued. """
+
+
+_pool = None
+_pool_key = None
+_threads = None
+_free_slots = []
+_cancelled = None
+_pids = None
+_progress = None
+_reader = None
+_analyses = OrderedDict()
+# the slot of the search the engine thread is running, if any
+_engine_slot = None
+_engine_lock = threading.Lock()
+
+# per worker process: the shared slots, the slot being searched and the
+# queue analyses report on
+_worker = {'cancelled': None, 'pids': None, 'slot': None, 'progress': None}
+
+
+def get_pool(processes=None, queue=None):
+    """ Return the pool for up to queue searches (four for each
+    process by default) on processes processes (os.cpu_count() by
+    default), starting it if need be. """
+    global _pool, _pool_key, _cancelled, _pids, _progress, _reader
+    processes = processes or os.cpu_count()
+    queue = queue or 4 * processes
+    setup = _setup()
+    key = processes, queue, setup, START_METHOD
+    if _pool is None or _pool_key != key:
+        shutdown_pool()
+        context = multiprocessing.get_context(START_METHOD)
+        _cancelled = RawArray('b', queue)
+        _pids = RawArray('i', queue)
+        _free_slots[:] = range(queue)
+        _progress = context.SimpleQueue()
+        _reader = threading.Thread(target=_read_progress, args=(_progress,),
+                                   daemon=True)
+        _reader.start()
+        _pool = ProcessPoolExecutor(processes, mp_context=context,
+                                    initializer=_init_worker,
+                                    initargs=(_cancelled, _pids, _progress,
+                                              setup))
+        _pool_key = key
+    return _pool
+
+
+def _setup():
+    """ (eval cache size, (tablebase directory, cache pages) or None,
+    book path or None) for this process, as _init_worker restores them. """
+    cache = get_eval_cache()
+    tablebase = get_tablebase()
+    book = get_book()
+    return (cache.size if cache is not None else 0,
+            (tablebase.directory, tablebase.cache_pages)
+            if tablebase is not None else None,
+            book.path if book is not None else None)
+
+
+def shutdown_pool():
+    global _pool, _pool_key, _threads, _progress, _reader
+    if _pool is not None:
+        for slot, pid in enumerate(_pids):
+            if pid:
+                cancel(slot)
+        _pool.shutdown(cancel_futures=True)
+        _progress.put(None)
+        _reader.join()
+    if _threads is not None:
+        _threads.shutdown(cancel_futures=True)
+    _pool = _pool_key = _threads = _progress = _reader = None
+
+
+atexit.register(shutdown_pool)
+
+
+def _init_worker(cancelled, pids, progress, setup):
+    _worker.update(cancelled=cancelled, pids=pids, slot=None,
+                   progress=progress)
+    cache_size, tablebase, book = setup
+    set_eval_cache_size(cache_size)
+    set_tablebase(Tablebase(*tablebase) if tablebase is not None else None)
+    set_book(OpeningBook(book) if book is not None else None)
+    if CANCEL_SIGNAL is not None:
+        signal.signal(CANCEL_SIGNAL, _stop_search)
+
+
+def _stop_search(signum, frame):
+    slot = _worker['slot']
+    if slot is not None and _worker['cancelled'][slot]:
+        raise SearchTimeout()
+
+
+def _calc(position, search_time, stats, book, workers=1, engine='smp'):
+    """ Return (index, stats) for position (a Checkerboard.position()
+    value): index is that of the move calc_ai_move plays in the
+    position's legal moves, or None if there is none, and stats a
+    SearchStats if stats is set. """
+    game = Checkers()
+    state = game.curr_state
+    state.set_position(position)
+    move = calc_ai_move(game, search_time, workers, engine, stats=stats,
+                        book=book)
+    search_stats = None
+    if stats:
+        move, search_stats = move
+    if move is None:
+        return None, search_stats
+    return state.legal_moves.index(move), search_stats
+
+
+def _in_slot(slot, search, *args):
+    """ search(*args) as the search in slot, or None if the search is
+    cancelled. """
+    _worker['pids'][slot] = os.getpid()
+    try:
+        _worker['slot'] = slot
+        if _worker['cancelled'][slot]:
+            return None
+        return search(*args)
+    except SearchTimeout:
+        return None
+    finally:
+        _worker['slot'] = None
+        _worker['pids'][slot] = 0
+
+
+def _search(slot, position, search_time, stats, book):
+    return _in_slot(slot, _calc, position, search_time, stats, book)
+
+
+def _engine(engine):
+    return lazysmp if engine == 'smp' else parallel
+
+
+def _engine_search(slot, position, search_time, stats, book, workers,
+                   engine):
+    """ _calc in slot on the engine thread, or None if the search is
+    cancelled. """
+    global _engine_slot
+    with _engine_lock:
+        if _cancelled[slot]:
+            return None
+        _engine_slot = slot
+    try:
+        return _calc(position, search_time, stats, book, workers, engine)
+    finally:
+        with _engine_lock:
+            _engine_slot = None
+            if _cancelled[slot]:
+                # a stop that came after the search ended is not for the
+                # next one
+                _engine(engine).clear_stop()
+
+
+def _cancel_engine_search(slot, engine):
+    _cancelled[slot] = 1
+    with _engine_lock:
+        if _engine_slot == slot:
+            _engine(engine).stop_search()
+
+
+def _run_analysis(analysis_id, position, search_time):
+    """ Search position, putting ('start', None), then ('iteration',
+    iteration) for each iteration, on the progress queue; return the
+    last iteration with the move to play added, or None if there are no
+    legal moves. """
+    progress = _worker['progress']
+    last = {}
+
+    def report(depth, result, seconds):
+        score, _, pv, nodes = result
+        last.update(depth=depth, score=score,
+                    pv=[move_text(move) for move in pv], nodes=nodes,
+                    seconds=seconds)
+        progress.put((analysis_id, 'iteration', dict(last)))
+
+    progress.put((analysis_id, 'start', None))
+    game = Checkers()
+    game.curr_state.set_position(position)
+    found = search_position(game, search_time, report=report)
+    if found is None or found[1] is None:
+        return None
+    move = found[1]
+    squares = move.squares
+    last.update(move=move_text(move), start_sq=keymap[squares[0][0]],
+                end_sq=keymap[squares[-1][0]])
+    return last
+
+
+def _analyse(slot, analysis_id, position, search_time):
+    result = _in_slot(slot, _run_analysis, analysis_id, position,
+                      search_time)
+    _worker['progress'].put((analysis_id, 'done', result))
+
+
+def cancel(slot):
+    """ Stop the search in slot, whether it is running or queued. """
+    _cancelled[slot] = 1
+    pid = _pids[slot]
+    if pid and CANCEL_SIGNAL is not None:
+        try:
+            os.kill(pid, CANCEL_SIGNAL)
+        except ProcessLookupError:
+            pass
+
+
+def _take_slot():
+    if not _free_slots:
+        raise SearchPoolBusy()
+    slot = _free_slots.pop()
+    _cancelled[slot] = 0
+    return slot
+
+
+async def _await(future, on_cancel, disconnected, poll):
+    """ Wait for future (an asyncio future), calling on_cancel and
+    returning None once disconnected() says the client has gone. """
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=poll)
+        if done:
+            return future.result()
+        if disconnected is not None and await disconnected():
+            on_cancel()
+            return None
+
+
+async def search(position, search_time, stats=False, book=True,
+                 disconnected=None, workers=1, engine='smp',
+                 processes=None, queue=None, poll=DISCONNECT_POLL):
+    """ Search position in the pool and return (move index, stats) as
+    _search does, or None if disconnected (an async function, such as a
+    request's is_disconnected) said the client had gone before the
+    search was done. Raise SearchPoolBusy if the pool has as many
+    searches as it takes. """
+    global _threads
+    loop = asyncio.get_running_loop()
+    pool = get_pool(processes, queue)
+    slot = _take_slot()
+    if workers > 1:
+        # the engine's processes are the workers; its pool and table
+        # serve one search at a time
+        if _threads is None:
+            _threads = ThreadPoolExecutor(1)
+        try:
+            future = loop.run_in_executor(
+                _threads, _engine_search, slot, position, search_time,
+                stats, book, workers, engine)
+        except BaseException:
+            _free_slots.append(slot)
+            raise
+        future.add_done_callback(
+            lambda _: _pool is pool and _free_slots.append(slot))
+        return await _await(
+            future, lambda: _cancel_engine_search(slot, engine),
+            disconnected, poll)
+    try:
+        search_future = pool.submit(_search, slot, position, search_time,
+                                    stats, book)
+    except BaseException:
+        _free_slots.append(slot)
+        raise
+    # the slot is only free again once its worker is done with it
+    search_future.add_done_callback(
+        lambda _: _pool is pool and _free_slots.append(slot))
+    future = asyncio.wrap_future(search_future, loop=loop)
+
+    def on_cancel():
+        search_future.cancel()
+        cancel(slot)
+    return await _await(future, on_cancel, disconnected, poll)
+
+
+class Analysis(object):
+    """ A search run as a job. status goes from 'queued' to 'running' to
+    'done', or 'stopped' if stop() was called first, or 'failed'.
+    iterations holds a dict (depth, score for the side to move, pv as
+    move texts, nodes and seconds) for each iteration the search has
+    completed; result is the last of them, with the move to play, once
+    the analysis is over (None if the position has no legal moves, or
+    the search was stopped before it got anywhere). """
+
+    def __init__(self, loop, slot):
+        self.id = uuid.uuid4().hex
+        self.loop = loop
+        self.slot = slot
+        self.future = None
+        self.status = 'queued'
+        self.iterations = []
+        self.result = None
+        self.error = None
+        self.stopped = False
+        self._changed = asyncio.Event()
+
+    def __repr__(self):
+        return '<Analysis %s %s: %d iterations>' % (
+            self.id, self.status, len(self.iterations))
+
+    @property
+    def done(self):
+        return self.status in ('done', 'stopped', 'failed')
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def update(self, kind, data):
+        """ Take a message from the search (see _run_analysis). """
+        if self.done:
+            return
+        if kind == 'start':
+            self.status = 'running'
+        elif kind == 'iteration':
+            self.status = 'running'
+            self.iterations.append(data)
+        else:
+            self.result = data
+            self.status = 'stopped' if self.stopped else 'done'
+        self._notify()
+
+    def _ended(self, future):
+        # a search that ran sends its result on the progress queue; this
+        # only finishes the ones that never ran or that failed
+        if self.done:
+            return
+        if future.cancelled():
+            self.status = 'stopped'
+        elif future.exception() is not None:
+            self.error = repr(future.exception())
+            self.status = 'failed'
+        else:
+            return
+        self._notify()
+
+    def stop(self):
+        """ Stop the search, keeping what it has found so far. """
+        self.stopped = True
+        if not self.future.done():
+            self.future.cancel()
+            cancel(self.slot)
+
+    async def wait(self):
+        """ Wait for the next change. """
+        await self._changed.wait()
+
+    async def events(self):
+        """ Yield ('iteration', iteration) for each iteration, those
+        already done first, then ('result', as_dict()) once the analysis
+        is over. """
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.iterations):
+                yield 'iteration', self.iterations[sent]
+                sent += 1
+            if self.done:
+                yield 'result', self.as_dict()
+                return
+            await changed.wait()
+
+    def as_dict(self):
+        return {'id': self.id, 'status': self.status,
+                'iterations': list(self.iterations), 'result': self.result,
+                'error': self.error}
+
+
+def _read_progress(progress):
+    """ Hand the messages on the progress queue to their analyses, on
+    the analyses' event loops, until a None. """
+    while True:
+        message = progress.get()
+        if message is None:
+            return
+        analysis_id, kind, data = message
+        analysis = _analyses.get(analysis_id)
+        if analysis is None:
+            continue
+        try:
+            analysis.loop.call_soon_threadsafe(analysis.update, kind, data)
+        except RuntimeError:
+            # its loop has closed
+            pass
+
+
+def start_analysis(position, search_time, processes=None, queue=None):
+    """ Start an Analysis of position (a Checkerboard.position() value)
+    for about search_time seconds in the pool, and return it. Raise
+    SearchPoolBusy if the pool has as many searches as it takes. Call
+    from the event loop that is to follow it. """
+    loop = asyncio.get_running_loop()
+    pool = get_pool(processes, queue)
+    slot = _take_slot()
+    analysis = Analysis(loop, slot)
+    _analyses[analysis.id] = analysis
+    for old in list(_analyses.values()):
+        if len(_analyses) <= MAX_ANALYSES:
+            break
+        if old.done:
+            del _analyses[old.id]
+    try:
+        analysis.future = pool.submit(_analyse, slot, analysis.id, position,
+                                      search_time)
+    except BaseException:
+        _free_slots.append(slot)
+        del _analyses[analysis.id]
+        raise
+
+    def ended(future):
+        if _pool is pool:
+            _free_slots.append(slot)
+        try:
+            loop.call_soon_threadsafe(analysis._ended, future)
+        except RuntimeError:
+            pass
+    analysis.future.add_done_callback(ended)
+    return analysis
+
+
+def get_analysis(analysis_id):
+    """ The Analysis with analysis_id, or None. """
+    return _analyses.get(analysis_id)
@@ -0,0 +1,522 @@
+""" Endgame tablebase generator.
+
+Builds win/loss/draw databases for every position with up to a given
+number of pieces by retrograde analysis, and writes one file per slice:
+the positions with a given number of black men, black kings, white men
+and white kings.
+
+    python -m game.tablebase --pieces 4            build up to 4 pieces
+    python -m game.tablebase --pieces 5 --workers 4
+
+A slice is solved from the slices its captures and crownings lead to, so
+they are built in order of pieces on the board and then of men, and the
+slices at each step are built in parallel on a pool of processes. Within
+a slice, the positions decided by a move into an earlier slice (or by
+having no moves at all) are propagated back through the moves that stay
+in the slice, nearest the end first, so each position also gets its
+distance in plies to the end of the game with best play. Positions never
+decided are draws.
+
+Each position of a slice has a place in a perfect index (see Slice), and
+the slice file holds a 2-bit value per position after a short header.
+A distance file with a byte per position (capped at 255) goes with it,
+unless --no-dtw is given; searches need the distances to make progress
+in a won ending, since without them every winning move looks the
+same. """
+import argparse
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from game.bitboard import BIT_SQUARE, FULL, JUMP, STEP, popcount
+from game.checkers import BK, BM, WK, WM, Checkerboard
+from util.globalconst import BLACK, TABLEBASE_DIR, WHITE
+
+# values, from the point of view of the side to move
+UNKNOWN, WIN, LOSS, DRAW = range(4)
+
+MAGIC = b'RVTB'
+VERSION = 1
+# magic, version, black men, black kings, white men, white kings, positions
+HEADER = struct.Struct('<4sBBBBB3xQ')
+MAX_DISTANCE = 255
+
+# black men never stand on white's back rank (bits 28-31) nor white men
+# on black's (bits 0-3); both can stand on the 24 squares between
+BLACK_BACK_RANK = 0x0000000F
+WHITE_BACK_RANK = 0xF0000000
+MIDDLE_SHIFT = 4
+MIDDLE_SQUARES = 24
+
+BINOMIAL = [[0] * 33 for _ in range(33)]
+for _n in range(33):
+    BINOMIAL[_n][0] = 1
+    for _k in range(1, _n + 1):
+        BINOMIAL[_n][_k] = BINOMIAL[_n - 1][_k - 1] + BINOMIAL[_n - 1][_k]
+del _n, _k
+
+
+def _bits(bb):
+    """ The bit numbers set in bb, lowest first. """
+    bits = []
+    while bb:
+        bit = bb & -bb
+        bb ^= bit
+        bits.append(bit.bit_length() - 1)
+    return bits
+
+
+def _compress(bb, occupied):
+    """ bb with the squares in occupied taken out of the board, those
+    above each moving down one. """
+    for bit in reversed(_bits(occupied)):
+        low = (1 << bit) - 1
+        bb = bb & low | bb >> 1 & ~low
+    return bb
+
+
+def _expand(bb, occupied):
+    """ The inverse of _compress. """
+    for bit in _bits(occupied):
+        low = (1 << bit) - 1
+        bb = bb & low | (bb & ~low) << 1
+    return bb
+
+
+def _rank(bb):
+    """ Colex rank of the squares in bb among all subsets of their size. """
+    rank = 0
+    for i, bit in enumerate(_bits(bb)):
+        rank += BINOMIAL[bit][i + 1]
+    return rank
+
+
+def _unrank(rank, k):
+    """ The k squares with colex rank; the inverse of _rank. """
+    bb = 0
+    for i in range(k, 0, -1):
+        place = i - 1
+        while BINOMIAL[place + 1][i] <= rank:
+            place += 1
+        rank -= BINOMIAL[place][i]
+        bb |= 1 << place
+    return bb
+
+
+class Slice(object):
+    """ The positions with a given count of each piece, and their perfect
+    index: each of the size positions (both sides to move) gets a
+    different number in range(size).
+
+    The index is built from the colex ranks of the piece sets, each taken
+    among the squares left to it: first the black and white men on their
+    back ranks (grouped by how many there are), then the black men on the
+    24 middle squares, the white men on the middle squares the black men
+    left free, the black kings on the squares the men left free, the white
+    kings on the rest, and last the side to move. """
+
+    def __init__(self, counts):
+        self.counts = counts
+        black_men, black_kings, white_men, white_kings = counts
+        men = black_men + white_men
+        self.black_kings = BINOMIAL[32 - men][black_kings]
+        self.white_kings = BINOMIAL[32 - men - black_kings][white_kings]
+        # one block of men placements for each number of men on the
+        # back ranks, as (offset, black back, white back, black middle,
+        # white middle, black middle men, white middle men)
+        self.men_blocks = []
+        offset = 0
+        for back_black in range(min(4, black_men) + 1):
+            for back_white in range(min(4, white_men) + 1):
+                middle_black = black_men - back_black
+                middle_white = white_men - back_white
+                if middle_black + middle_white > MIDDLE_SQUARES:
+                    continue
+                block = (offset, BINOMIAL[4][back_black],
+                         BINOMIAL[4][back_white],
+                         BINOMIAL[MIDDLE_SQUARES][middle_black],
+                         BINOMIAL[MIDDLE_SQUARES - middle_black][
+                             middle_white],
+                         middle_black, middle_white)
+                self.men_blocks.append(block)
+                offset += block[1] * block[2] * block[3] * block[4]
+        self.block_index = {}
+        for block in self.men_blocks:
+            back_black = black_men - block[5]
+            back_white = white_men - block[6]
+            self.block_index[back_black, back_white] = block
+        self.block_offsets = [block[0] for block in self.men_blocks]
+        self.size = offset * self.black_kings * self.white_kings * 2
+
+    def __repr__(self):
+        return '<Slice %s: %d positions>' % (self.name, self.size)
+
+    @property
+    def name(self):
+        return '%d-%d-%d-%d' % self.counts
+
+    def index(self, position):
+        """ Index of position (a Checkerboard.position() value). """
+        black_men, black_kings, white_men, white_kings, to_move = position
+        black_back = black_men & BLACK_BACK_RANK
+        white_back = (white_men & WHITE_BACK_RANK) >> 28
+        block = self.block_index[popcount(black_back), popcount(white_back)]
+        offset, _, white_back_ways, black_middle_ways, white_middle_ways, \
+            _, _ = block
+        black_middle = black_men >> MIDDLE_SHIFT & 0xFFFFFF
+        white_middle = white_men >> MIDDLE_SHIFT & 0xFFFFFF
+        men_index = offset + (
+            ((_rank(black_back) * white_back_ways + _rank(white_back)) *
+             black_middle_ways + _rank(black_middle)) * white_middle_ways +
+            _rank(_compress(white_middle, black_middle)))
+        men = black_men | white_men
+        index = (men_index * self.black_kings +
+                 _rank(_compress(black_kings, men))) * self.white_kings + \
+            _rank(_compress(white_kings, men | black_kings))
+        return index * 2 + (to_move == WHITE)
+
+    def position(self, index):
+        """ The position with index; the inverse of index(). """
+        black_men_count, black_kings_count, white_men_count, \
+            white_kings_count = self.counts
+        to_move = WHITE if index & 1 else BLACK
+        index >>= 1
+        index, white_kings_rank = divmod(index, self.white_kings)
+        men_index, black_kings_rank = divmod(index, self.black_kings)
+        block = self.men_blocks[
+            bisect_right(self.block_offsets, men_index) - 1]
+        offset, _, white_back_ways, black_middle_ways, white_middle_ways, \
+            middle_black, middle_white = block
+        rest = men_index - offset
+        rest, white_middle_rank = divmod(rest, white_middle_ways)
+        rest, black_middle_rank = divmod(rest, black_middle_ways)
+        black_back_rank, white_back_rank = divmod(rest, white_back_ways)
+        black_middle = _unrank(black_middle_rank, middle_black)
+        white_middle = _expand(_unrank(white_middle_rank, middle_white),
+                               black_middle)
+        black_men = (_unrank(black_back_rank, black_men_count - middle_black)
+                     | black_middle << MIDDLE_SHIFT)
+        white_men = (_unrank(white_back_rank, white_men_count - middle_white)
+                     << 28 | white_middle << MIDDLE_SHIFT)
+        men = black_men | white_men
+        black_kings = _expand(_unrank(black_kings_rank, black_kings_count),
+                              men)
+        white_kings = _expand(_unrank(white_kings_rank, white_kings_count),
+                              men | black_kings)
+        return black_men, black_kings, white_men, white_kings, to_move
+
+
+def counts_of(position):
+    black_men, black_kings, white_men, white_kings, _ = position
+    return (popcount(black_men), popcount(black_kings), popcount(white_men),
+            popcount(white_kings))
+
+
+def slices(max_pieces):
+    """ Counts of every slice with up to max_pieces pieces, both sides
+    having at least one, in the order they can be built. """
+    result = []
+    for black_men in range(max_pieces):
+        for black_kings in range(max_pieces - black_men + 1):
+            for white_men in range(
+                    max_pieces - black_men - black_kings + 1):
+                for white_kings in range(
+                        max_pieces - black_men - black_kings - white_men + 1):
+                    if black_men + black_kings and white_men + white_kings:
+                        result.append((black_men, black_kings, white_men,
+                                       white_kings))
+    result.sort(key=lambda c: (sum(c), c[0] + c[2], c))
+    return result
+
+
+def slice_path(directory, counts, extension='wld'):
+    return os.path.join(directory, '%d-%d-%d-%d.%s' % (counts + (extension,)))
+
+
+def pack_values(values):
+    """ Pack values (a byte each, 0-3) four to a byte, the first in the
+    low bits. """
+    size = (len(values) + 3) // 4
+    padded = bytes(values) + bytes(size * 4 - len(values))
+    packed = 0
+    for shift in range(4):
+        packed |= int.from_bytes(padded[shift::4], 'little') << (2 * shift)
+    return packed.to_bytes(size, 'little')
+
+
+def write_slice(directory, counts, values, distances=None):
+    header = HEADER.pack(MAGIC, VERSION, *counts, len(values))
+    path = slice_path(directory, counts)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(header)
+        f.write(pack_values(values))
+    if distances is not None:
+        with open(slice_path(directory, counts, 'dtw') + '.tmp', 'wb') as f:
+            f.write(header)
+            f.write(distances)
+        os.replace(slice_path(directory, counts, 'dtw') + '.tmp',
+                   slice_path(directory, counts, 'dtw'))
+    # the value file goes last: its presence means the slice is built
+    os.replace(path + '.tmp', path)
+
+
+def read_slice(directory, counts, distances=False):
+    """ Return (Slice, packed values, distances or None) for a built
+    slice. """
+    with open(slice_path(directory, counts), 'rb') as f:
+        data = f.read()
+    magic, version, *file_counts, size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or tuple(file_counts) != counts:
+        raise ValueError('%s is not a version %d tablebase slice for %s'
+                         % (slice_path(directory, counts), VERSION, counts))
+    dtw = None
+    if distances:
+        with open(slice_path(directory, counts, 'dtw'), 'rb') as f:
+            dtw = f.read()[HEADER.size:]
+    return Slice(counts), data[HEADER.size:], dtw
+
+
+def has_capture(bb, color):
+    """ Whether color, to move on bitboards bb, has a capture. """
+    if color == BLACK:
+        pieces = ((BM, bb[BM]), (BK, bb[BK]))
+        enemies = bb[WM] | bb[WK]
+    else:
+        pieces = ((WM, bb[WM]), (WK, bb[WK]))
+        enemies = bb[BM] | bb[BK]
+    empty = ~(bb[BM] | bb[BK] | bb[WM] | bb[WK]) & FULL
+    for piece, squares in pieces:
+        jumps = JUMP[piece]
+        while squares:
+            bit = squares & -squares
+            squares ^= bit
+            for _, _, mid_bit, dest_bit in jumps[BIT_SQUARE[bit]]:
+                if mid_bit & enemies and dest_bit & empty:
+                    return True
+    return False
+
+
+def predecessors(position):
+    """ Positions of the same slice that lead to position by a legal move
+    that is neither a capture nor a crowning. """
+    bb = [0] * (WK + 1)
+    bb[BM], bb[BK], bb[WM], bb[WK], to_move = position
+    mover = WHITE if to_move == BLACK else BLACK
+    if mover == BLACK:
+        # a man came from the square a man of the other color steps to
+        steps = ((BM, STEP[WM]), (BK, STEP[BK]))
+    else:
+        steps = ((WM, STEP[BM]), (WK, STEP[WK]))
+    empty = ~(bb[BM] | bb[BK] | bb[WM] | bb[WK]) & FULL
+    result = []
+    for piece, table in steps:
+        squares = bb[piece]
+        while squares:
+            bit = squares & -squares
+            squares ^= bit
+            for _, from_bit in table[BIT_SQUARE[bit]]:
+                if not from_bit & empty:
+                    continue
+                bb[piece] ^= bit | from_bit
+                # with a capture to make, the step wasn't legal
+                if not has_capture(bb, mover):
+                    result.append((bb[BM], bb[BK], bb[WM], bb[WK], mover))
+                bb[piece] ^= bit | from_bit
+    return result
+
+
+# per process: the slices read so far, by (directory, counts, distances)
+_loaded = {}
+
+
+def probe(directory, position, distances=False):
+    """ Return (value, distance) for position from the built slices in
+    directory; distance is 0 unless distances is set. """
+    counts = counts_of(position)
+    to_move = position[4]
+    if to_move == BLACK and not counts[0] + counts[1] or \
+            to_move == WHITE and not counts[2] + counts[3]:
+        return LOSS, 0
+    key = directory, counts, distances
+    if key not in _loaded:
+        _loaded[key] = read_slice(directory, counts, distances)
+    table, values, dtw = _loaded[key]
+    index = table.index(position)
+    value = values[index >> 2] >> ((index & 3) << 1) & 3
+    return value, dtw[index] if dtw is not None else 0
+
+
+def build_slice(directory, counts, distances=False):
+    """ Solve the slice with counts, whose captures and crownings lead to
+    slices already built in directory, and write it there. Return a
+    summary dict. """
+    start = time.perf_counter()
+    table = Slice(counts)
+    size = table.size
+    values = bytearray(size)
+    dtw = bytearray(size)
+    # successors not yet known to be wins for the opponent, and the
+    # longest distance among those that are
+    remaining = bytearray(size)
+    longest = bytearray(size)
+    # buckets[distance]: entries index << 1 | is_loss, to be decided
+    buckets = {}
+
+    def push(index, is_loss, distance):
+        bucket = buckets.get(distance)
+        if bucket is None:
+            bucket = buckets[distance] = array('Q')
+        bucket.append(index << 1 | is_loss)
+
+    board = Checkerboard()
+    for index in range(size):
+        board.set_position(table.position(index))
+        moves = board.legal_moves
+        if not moves:
+            push(index, 1, 0)
+            continue
+        count = 0
+        win = None
+        loss = 0
+        for move in moves:
+            squares = move.squares
+            if len(squares) == 2 and squares[0][1] == squares[1][2]:
+                count += 1
+                continue
+            board.make_move(move, False, False)
+            value, distance = probe(directory, board.position(), distances)
+            board.undo_move(move, False, False)
+            if value == LOSS:
+                if win is None or distance < win:
+                    win = distance
+            elif value == WIN:
+                loss = max(loss, distance)
+            else:
+                count += 1
+        if win is not None:
+            push(index, 0, win + 1)
+        elif count == 0:
+            push(index, 1, loss + 1)
+        else:
+            remaining[index] = count
+            longest[index] = min(loss, MAX_DISTANCE)
+
+    distance = 0
+    while buckets:
+        bucket = buckets.pop(distance, ())
+        distance += 1
+        for entry in bucket:
+            index = entry >> 1
+            if values[index]:
+                continue
+            value = LOSS if entry & 1 else WIN
+            values[index] = value
+            dtw[index] = min(distance - 1, MAX_DISTANCE)
+            for previous in predecessors(table.position(index)):
+                previous_index = table.index(previous)
+                if values[previous_index]:
+                    continue
+                if value == LOSS:
+                    push(previous_index, 0, distance)
+                elif remaining[previous_index]:
+                    # (those with no count are already waiting to be
+                    # decided as wins)
+                    longest[previous_index] = max(
+                        longest[previous_index],
+                        min(distance - 1, MAX_DISTANCE))
+                    remaining[previous_index] -= 1
+                    if not remaining[previous_index]:
+                        push(previous_index, 1,
+                             longest[previous_index] + 1)
+
+    draws = 0
+    for index in range(size):
+        if not values[index]:
+            values[index] = DRAW
+            draws += 1
+    write_slice(directory, counts, values, dtw if distances else None)
+    return {'slice': table.name, 'positions': size,
+            'wins': values.count(WIN), 'losses': values.count(LOSS),
+            'draws': draws,
+            # distances into earlier slices are only known with their files
+            'longest': max(dtw, default=0) if distances else None,
+            'seconds': time.perf_counter() - start}
+
+
+def generate(directory=TABLEBASE_DIR, max_pieces=4, workers=1,
+             distances=True, rebuild=False, report=None):
+    """ Build every slice with up to max_pieces pieces in directory,
+    skipping those already there unless rebuild is set. The slices of
+    each step are spread over workers processes. report, if given, is
+    called with each slice's summary. Return the summaries. """
+    os.makedirs(directory, exist_ok=True)
+    steps = {}
+    for counts in slices(max_pieces):
+        if not rebuild and os.path.exists(slice_path(directory, counts)) \
+                and (not distances or
+                     os.path.exists(slice_path(directory, counts, 'dtw'))):
+            continue
+        steps.setdefault((sum(counts), counts[0] + counts[2]),
+                         []).append(counts)
+    summaries = []
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        for step in sorted(steps):
+            todo = steps[step]
+            if pool is None:
+                results = (build_slice(directory, counts, distances)
+                           for counts in todo)
+            else:
+                results = pool.map(build_slice, [directory] * len(todo),
+                                   todo, [distances] * len(todo))
+            for summary in results:
+                summaries.append(summary)
+                if report is not None:
+                    report(summary)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m game.tablebase',
+        description='Build endgame tablebases by retrograde analysis.')
+    parser.add_argument('--pieces', type=int, default=4,
+                        help='most pieces on the board (default '
+                             '%(default)s)')
+    parser.add_argument('--dir', default=TABLEBASE_DIR,
+                        help='where the slices go (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes to build with (default '
+                             '%(default)s)')
+    parser.add_argument('--no-dtw', dest='dtw', action='store_false',
+                        help="don't write distances to the end")
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild slices already in --dir')
+    args = parser.parse_args(argv)
+
+    def report(summary):
+        line = ('%(slice)-10s %(positions)10d positions  %(wins)10d wins  '
+                '%(losses)10d losses  %(draws)10d draws  %(seconds)8.1fs'
+                % summary)
+        if summary['longest'] is not None:
+            line += '  longest %d plies' % summary['longest']
+        print(line, flush=True)
+
+    start = time.perf_counter()
+    summaries = generate(args.dir, args.pieces, args.workers, args.dtw,
+                         args.rebuild, report)
+    print('%d slices, %d positions in %.1fs'
+          % (len(summaries), sum(s['positions'] for s in summaries),
+             time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+""" Endgame tablebase probing.
+
+A Tablebase answers win/loss/draw for a Checkerboard straight from the
+slice files game.tablebase writes, without reading them in: each file is
+mmap'd the first time a position of its slice is probed, the position's
+index is worked out from the board's bitboards, and only the byte holding
+its value is looked at. The pages those bytes come from are kept in a
+small LRU cache of their own, so the few slices an endgame search keeps
+coming back to are answered from memory, while the rest of the files
+stay on disk.
+
+Searches reach the tablebase through Checkers.probe (see
+game.checkers.set_tablebase), which turns a value into an exact score. """
+import mmap
+import os
+import re
+from collections import OrderedDict
+
+from game.bitboard import popcount
+from game.checkers import BK, BM, WK, WM
+from game.tablebase import (DRAW, HEADER, LOSS, MAGIC, VERSION, WIN, Slice,
+                            slice_path)
+from util.globalconst import (BLACK, TABLEBASE_DIR, TABLEBASE_KNOWN_WIN,
+                              TABLEBASE_WIN)
+
+PAGE_SIZE = mmap.PAGESIZE
+CACHE_PAGES = 256
+VALUE_NAMES = {WIN: 'win', LOSS: 'loss', DRAW: 'draw'}
+
+_SLICE_FILE = re.compile(r'^(\d+)-(\d+)-(\d+)-(\d+)\.wld$')
+
+
+def built_slices(directory):
+    """ Counts of the slices built in directory. """
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in os.listdir(directory):
+        match = _SLICE_FILE.match(name)
+        if match:
+            result.append(tuple(int(count) for count in match.groups()))
+    return sorted(result)
+
+
+def _map(path, counts):
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, *file_counts, _ = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or tuple(file_counts) != counts:
+        data.close()
+        raise ValueError('%s is not a version %d tablebase slice for %s'
+                         % (path, VERSION, counts))
+    return data
+
+
+class Tablebase(object):
+    """ The slices built in directory, probed in place.
+
+    pieces is the most pieces any built slice has; a position with more
+    is not looked up at all. Distances are returned for the slices that
+    have a distance file, and are None for the rest. cache_pages pages of
+    the files are kept (0 reads every byte from its map). """
+
+    def __init__(self, directory=TABLEBASE_DIR, cache_pages=CACHE_PAGES):
+        self.directory = directory
+        self.cache_pages = cache_pages
+        self.built = set(built_slices(directory))
+        self.pieces = max((sum(counts) for counts in self.built), default=0)
+        # counts -> (Slice, value map, distance map or None)
+        self.slices = {}
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<Tablebase %s: %d slices, up to %d pieces>' % (
+            self.directory, len(self.built), self.pieces)
+
+    def _slice(self, counts):
+        entry = self.slices.get(counts)
+        if entry is None:
+            values = _map(slice_path(self.directory, counts), counts)
+            dtw_path = slice_path(self.directory, counts, 'dtw')
+            dtw = _map(dtw_path, counts) if os.path.exists(dtw_path) \
+                else None
+            entry = self.slices[counts] = Slice(counts), values, dtw
+        return entry
+
+    def _byte(self, data, offset):
+        """ The byte at offset into the map data, through the page
+        cache. """
+        if not self.cache_pages:
+            return data[offset]
+        page_number, place = divmod(offset, PAGE_SIZE)
+        key = id(data), page_number
+        page = self.pages.get(key)
+        if page is None:
+            self.misses += 1
+            start = page_number * PAGE_SIZE
+            page = self.pages[key] = data[start:start + PAGE_SIZE]
+            if len(self.pages) > self.cache_pages:
+                self.pages.popitem(last=False)
+        else:
+            self.hits += 1
+            self.pages.move_to_end(key)
+        return page[place]
+
+    def probe(self, board):
+        """ Return (value, distance) for the side to move on board (a
+        Checkerboard), or None if no built slice holds the position. The
+        distance is None if the slice was built without distances. """
+        bb = board.bitboards
+        black_men, black_kings, white_men, white_kings = \
+            bb[BM], bb[BK], bb[WM], bb[WK]
+        if popcount(black_men | black_kings | white_men | white_kings) > \
+                self.pieces:
+            return None
+        to_move = board.to_move
+        counts = (popcount(black_men), popcount(black_kings),
+                  popcount(white_men), popcount(white_kings))
+        if to_move == BLACK and not counts[0] + counts[1] or \
+                to_move != BLACK and not counts[2] + counts[3]:
+            return LOSS, 0
+        if counts not in self.built:
+            return None
+        table, values, dtw = self._slice(counts)
+        index = table.index((black_men, black_kings, white_men, white_kings,
+                             to_move))
+        value = self._byte(values, HEADER.size + (index >> 2)) >> \
+            ((index & 3) << 1) & 3
+        if dtw is None:
+            return value, None
+        return value, self._byte(dtw, HEADER.size + index)
+
+    def score(self, board, ply):
+        """ The exact score of board for the side to move, ply plies
+        below the root of a search, or None if it isn't in the
+        tablebase. Wins score TABLEBASE_WIN less the plies to the end of
+        the game, so the search prefers the quickest win and the longest
+        loss; draws score 0.
+        A slice built without distances can't tell one winning move from
+        another, so its wins score TABLEBASE_KNOWN_WIN plus the
+        evaluation instead (less the ply, for the quickest of equals):
+        the search still heads for the better positions, and for a
+        slice with distances if it can reach one. """
+        result = self.probe(board)
+        if result is None:
+            return None
+        value, distance = result
+        if value == DRAW:
+            return 0
+        if distance is None:
+            # from the side to move's point of view, as the win or loss
+            score = TABLEBASE_KNOWN_WIN - ply
+            if value == WIN:
+                return score + board.utility(board.to_move)
+            return -score + board.utility(board.to_move)
+        score = TABLEBASE_WIN - ply - distance
+        return score if value == WIN else -score
+
+    def close(self):
+        for _, values, dtw in self.slices.values():
+            values.close()
+            if dtw is not None:
+                dtw.close()
+        self.slices.clear()
+        self.pages.clear()
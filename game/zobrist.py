@@ -0,0 +1,35 @@
+""" Zobrist keys for hashing Checkerboard positions.
+
+The keys come from a fixed seed so that every process (and every run)
+agrees on the hash of a position. """
+import random
+
+from game.bitboard import SQUARE_BIT, VALID_SQUARES
+from util.globalconst import BLACK, FREE, KING, MAN, WHITE
+
+_rng = random.Random(0x52415645)
+
+# ZOBRIST[piece][idx] is the key for piece standing on padded board index
+# idx. Rows for FREE and OCCUPIED, and the padding squares, stay zero so an
+# affected square can be hashed as old ^ new without special cases.
+ZOBRIST = [[0] * 56 for _ in range(FREE + 1)]
+for _piece in (BLACK | MAN, BLACK | KING, WHITE | MAN, WHITE | KING):
+    for _idx in VALID_SQUARES:
+        ZOBRIST[_piece][_idx] = _rng.getrandbits(64)
+del _piece, _idx
+
+# mixed in when white is the side to move
+WHITE_TO_MOVE = _rng.getrandbits(64)
+
+
+def hash_bitboards(bitboards):
+    """ Full Zobrist hash of the pieces on bitboards (side to move
+    excluded). """
+    key = 0
+    for piece in (BLACK | MAN, BLACK | KING, WHITE | MAN, WHITE | KING):
+        zobrist = ZOBRIST[piece]
+        bb = bitboards[piece]
+        for idx in VALID_SQUARES:
+            if bb & SQUARE_BIT[idx]:
+                key ^= zobrist[idx]
+    return key
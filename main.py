@@ -1,17 +1,70 @@
+import json
+import os
 from typing import Annotated, Union
 
-from deta import Deta
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.config import Config
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
-from game.checkers import Checkers, calc_ai_move
-from parsing.PDN import PDNReader, PDNWriter, translate_to_fen
-from util.globalconst import keymap
+from game import searchpool
+from game.book import OpeningBook
+from game.checkers import (Checkers, set_book, set_eval_cache_size,
+                           set_tablebase)
+from game.tbprobe import VALUE_NAMES, Tablebase
+from parsing.PDN import PDNReader, translate_to_fen
+from util.globalconst import (BOOK_FILE, EVAL_CACHE_SIZE,
+                              SESSION_CACHE_SIZE, TABLEBASE_DIR, keymap)
+from util.sessions import SessionStore
+from util.storage import POOL_SIZE, STORAGE_PATH, StorageError, open_storage
 
 starlette_config = Config('env.txt')
+# processes to spread each /calc_move search across; 1 searches in one
+# process of the search pool
+SEARCH_WORKERS = starlette_config('SEARCH_WORKERS', cast=int, default=1)
+# how they share the work: 'smp' (shared table) or 'split' (root moves)
+SEARCH_ENGINE = starlette_config('SEARCH_ENGINE', default='smp')
+# processes in the pool /calc_move searches run in (0: one per CPU), and
+# the searches it takes running or queued before turning more away (0:
+# four per process)
+SEARCH_PROCESSES = starlette_config('SEARCH_PROCESSES', cast=int, default=0)
+SEARCH_QUEUE = starlette_config('SEARCH_QUEUE', cast=int, default=0)
+# evaluations each search process caches; 0 turns the cache off
+set_eval_cache_size(starlette_config('EVAL_CACHE_SIZE', cast=int,
+                                     default=EVAL_CACHE_SIZE))
+# endgame tablebase built by game.tablebase; searches probe it, if any
+# slices have been built there
+tablebase = Tablebase(starlette_config('TABLEBASE_DIR',
+                                       default=TABLEBASE_DIR))
+set_tablebase(tablebase if tablebase.pieces else None)
+# opening book built by game.book; /calc_move plays from it, if it's there
+book_file = starlette_config('BOOK_FILE', default=BOOK_FILE)
+set_book(OpeningBook(book_file) if os.path.exists(book_file) else None)
+# where sessions are stored: 'deta', or 'sqlite' (in STORAGE_PATH) or
+# 'memory' to run without the network
+STORAGE = starlette_config('STORAGE', default='deta')
+
+
+def _open_storage():
+    if STORAGE == 'deta':
+        return open_storage(
+            'deta', project_key=starlette_config.get('DETA_SPACE_DATA_KEY'))
+    if STORAGE == 'sqlite':
+        return open_storage(
+            'sqlite',
+            path=starlette_config('STORAGE_PATH', default=STORAGE_PATH),
+            pool_size=starlette_config('STORAGE_POOL_SIZE', cast=int,
+                                       default=POOL_SIZE))
+    return open_storage(STORAGE)
+
+
+# games in play, by the session id in each client's session cookie; the
+# most recently used are kept in memory, and writes go through to the
+# storage
+sessions = SessionStore(_open_storage,
+                        starlette_config('SESSION_CACHE_SIZE', cast=int,
+                                         default=SESSION_CACHE_SIZE))
 app = FastAPI()
 origins = '(http://localhost:6007)|(https://localhost:6007)(http://react-checkerboard.vercel.app)|(https://react-checkerboard.vercel.app)|(https://.*\.github\.dev:6007)'
 
@@ -24,12 +77,34 @@ app.add_middleware(SessionMiddleware,
                    same_site='Strict')
 
 
+@app.exception_handler(StorageError)
+async def storage_error(request: Request, exc: StorageError):
+    return JSONResponse(
+        status_code=503,
+        content={'message': 'Session storage busy; try again.'})
+
+
+def _get_session(request):
+    """ The session item of the request's game, or None. """
+    session_id = request.session.get('id')
+    if session_id is None:
+        return None
+    return sessions.get(session_id)
+
+
+def _session_not_found():
+    return JSONResponse(status_code=404,
+                        content={'message': 'Session not found.'})
+
+
 @app.post("/create_session")
-async def create_session(fen: Annotated[
-    Union[str, None],
-    Query(title="String in Forsyth-Edwards Notation (FEN)",
-          description="If string is None, then default is starting game " +
-          "position, and black to move.")] = None):
+async def create_session(
+    request: Request,
+    fen: Annotated[
+        Union[str, None],
+        Query(title="String in Forsyth-Edwards Notation (FEN)",
+              description="If string is None, then default is starting " +
+              "game position, and black to move.")] = None):
     board = Checkers()
     state = board.curr_state
     if fen is not None:
@@ -45,17 +120,20 @@ async def create_session(fen: Annotated[
         "fen":
         translate_to_fen(next_to_move, black_men, white_men, black_kings, white_kings)
     }
-    deta = Deta(starlette_config.get("DETA_SPACE_DATA_KEY"))
-    db = deta.Base("raven_db")
-    d = db.put(fen, "session")
+    # a new game ends the client's last one
+    old_id = request.session.get('id')
+    if old_id is not None:
+        sessions.delete(old_id)
+    session_id, d = sessions.create(fen)
+    request.session['id'] = session_id
     return JSONResponse(d)
 
 
 @app.post("/end_session")
-async def end_session():
-    deta = Deta(starlette_config.get('DETA_SPACE_DATA_KEY'))
-    db = deta.Base('raven_db')
-    db.delete('session')
+async def end_session(request: Request):
+    session_id = request.session.pop('id', None)
+    if session_id is not None:
+        sessions.delete(session_id)
 
 
 # example - http://localhost:8000/legal_moves?to_move=black&bm=11&bm=15&bk=19&bk=4&wm=30&wm=31&wk=29"
@@ -95,14 +173,36 @@ async def legal_moves(fen: Annotated[
     return JSONResponse({"captures": captures, "moves": moves})
 
 
+# example - http://localhost:8000/tablebase?fen=W:WK6,K9:BK15
+@app.get("/tablebase")
+async def probe_tablebase(fen: Annotated[
+    str,
+    Query(title="String in Forsyth-Edwards Notation (FEN)",
+          description="Position to look up in the endgame tablebase")]):
+    board = Checkers()
+    state = board.curr_state
+    try:
+        reader = PDNReader(None)
+        game_params = reader.game_params_from_fen(fen)
+        state.setup_game(game_params)
+    except (SyntaxError, RuntimeError) as e:
+        raise HTTPException(status_code=422, detail=e.args[0])
+    result = tablebase.probe(state)
+    if result is None:
+        return JSONResponse(
+            status_code=404,
+            content={'message': 'Position not in the endgame tablebase.'})
+    value, distance = result
+    # the value is for the side to move; distance is in plies, and None
+    # when the slice was built without distances
+    return JSONResponse({'value': VALUE_NAMES[value], 'distance': distance})
+
+
 @app.get("/cb_state")
-async def get_checkerboard_state():
-    deta = Deta(starlette_config.get('DETA_SPACE_DATA_KEY'))
-    db = deta.Base('raven_db')
-    result = db.get('session')
+async def get_checkerboard_state(request: Request):
+    result = _get_session(request)
     if not result:
-        return JSONResponse(status_code=404,
-                            content={'message': 'Session not found.'})
+        return _session_not_found()
     return JSONResponse({
         'fen': result['fen']
     })
@@ -111,6 +211,7 @@ async def get_checkerboard_state():
 # example - https://raven-1-j8079958.deta.app/make_move?start_sq=11&end_sq=15"
 @app.post("/make_move")
 async def make_move(
+    request: Request,
     start_sq: Annotated[
         int,
         Query(title="Starting square for move",
@@ -119,12 +220,9 @@ async def make_move(
         int,
         Query(title="Ending square for move",
               description="Checker location where the move ends")]):
-    deta = Deta(starlette_config.get('DETA_SPACE_DATA_KEY'))
-    db = deta.Base('raven_db')
-    result = db.get('session')
+    result = _get_session(request)
     if not result:
-        return JSONResponse(status_code=404,
-                            content={'message': 'Session not found.'})
+        return _session_not_found()
     # restore game from session
     reader = PDNReader(None)
     game_params = reader.game_params_from_fen(result['fen'])
@@ -132,7 +230,7 @@ async def make_move(
     state = board.curr_state
     state.setup_game(game_params)
     # make the move (if it's valid), then save the session.
-    legal_moves = state.captures or state.moves
+    legal_moves = state.legal_moves
     found_move = False
     for move in legal_moves:
         move_start = move.affected_squares[0][0]
@@ -156,44 +254,148 @@ async def make_move(
         translate_to_fen(next_to_move, black_men, white_men, black_kings,
                          white_kings)
     }
-    d = db.put(fen, "session")
+    d = sessions.put(request.session['id'], fen)
     return JSONResponse(d)
 
 
 # example - https://raven-1-j8079958.deta.app/calc_move?search_time=5"
 @app.post("/calc_move/")
-async def calc_move(search_time: Annotated[
-    int,
-    Query(title="Search time for AI (seconds)",
-          description="Max search time (approximate) for AI to calculate its next move")]):
-    deta = Deta(starlette_config.get('DETA_SPACE_DATA_KEY'))
-    db = deta.Base('raven_db')
-    result = db.get('session')
+async def calc_move(
+    request: Request,
+    search_time: Annotated[
+        int,
+        Query(title="Search time for AI (seconds)",
+              description="Max search time (approximate) for AI to " +
+              "calculate its next move")],
+    stats: Annotated[
+        bool,
+        Query(title="Include search statistics",
+              description="Add the nodes, cutoffs, table hits, depth and " +
+              "speed of the search to the response")] = False,
+    book: Annotated[
+        bool,
+        Query(title="Use the opening book",
+              description="Play the opening book's move, when it has " +
+              "one, instead of searching")] = True):
+    session_id = request.session.get('id')
+    result = _get_session(request)
     if not result:
-        return JSONResponse(status_code=404,
-                            content={'message': 'Session not found.'})
+        return _session_not_found()
     # restore game from session
     reader = PDNReader(None)
     game_params = reader.game_params_from_fen(result['fen'])
     board = Checkers()
     state = board.curr_state
     state.setup_game(game_params)
-    move = calc_ai_move(board, search_time)
-    if not move:
+    # the search runs in the search pool, so the event loop serves other
+    # requests meanwhile; it is stopped if the client goes away
+    try:
+        found = await searchpool.search(
+            state.position(), search_time, stats, book,
+            request.is_disconnected, SEARCH_WORKERS, SEARCH_ENGINE,
+            SEARCH_PROCESSES, SEARCH_QUEUE)
+    except searchpool.SearchPoolBusy:
+        return JSONResponse(
+            status_code=503,
+            content={'message': 'Too many searches running; try again.'})
+    if found is None:
+        # nobody is waiting for the answer
+        return Response(status_code=499)
+    index, search_stats = found
+    if index is None:
         return JSONResponse(
             status_code=404,
             content={'message': 'Could not find move within search time.'})
+    move = state.legal_moves[index]
     state.make_move(move, False, False)
     next_to_move, black_men, black_kings, white_men, white_kings = state.save_board_state(
     )
-    pdn = {
-        "pdn":
-        PDNWriter.to_string('', '', '', '', '', '', next_to_move, black_men,
-                            white_men, black_kings, white_kings, '',
-                            'white_on_top', [])
+    fen = {
+        "fen":
+        translate_to_fen(next_to_move, black_men, white_men, black_kings,
+                         white_kings)
     }
-    db.put(pdn, "session")
+    sessions.put(session_id, fen)
     move_start = move.affected_squares[0][0]
     move_end = move.affected_squares[-1][0]
     move_dict = {"start_sq": keymap[move_start], "end_sq": keymap[move_end]}
+    if stats:
+        move_dict["stats"] = search_stats.as_dict()
     return JSONResponse(move_dict)
+
+
+# example - https://raven-1-j8079958.deta.app/analysis?search_time=30"
+@app.post("/analysis", status_code=202)
+async def start_analysis(
+    request: Request,
+    search_time: Annotated[
+        int,
+        Query(title="Search time for the analysis (seconds)",
+              description="Max search time (approximate); the analysis " +
+              "can be stopped sooner")],
+    fen: Annotated[
+        Union[str, None],
+        Query(title="String in Forsyth-Edwards Notation (FEN)",
+              description="Position to analyse; if None, the session's " +
+              "position")] = None):
+    board = Checkers()
+    state = board.curr_state
+    if fen is None:
+        result = _get_session(request)
+        if not result:
+            return _session_not_found()
+        fen = result['fen']
+    try:
+        reader = PDNReader(None)
+        game_params = reader.game_params_from_fen(fen)
+        state.setup_game(game_params)
+    except (SyntaxError, RuntimeError) as e:
+        raise HTTPException(status_code=422, detail=e.args[0])
+    try:
+        analysis = searchpool.start_analysis(state.position(), search_time,
+                                             SEARCH_PROCESSES, SEARCH_QUEUE)
+    except searchpool.SearchPoolBusy:
+        return JSONResponse(
+            status_code=503,
+            content={'message': 'Too many searches running; try again.'})
+    return JSONResponse(status_code=202,
+                        content={'id': analysis.id,
+                                 'status': analysis.status})
+
+
+def _analysis_not_found():
+    return JSONResponse(status_code=404,
+                        content={'message': 'Analysis not found.'})
+
+
+@app.get("/analysis/{analysis_id}")
+async def get_analysis(analysis_id: str):
+    analysis = searchpool.get_analysis(analysis_id)
+    if analysis is None:
+        return _analysis_not_found()
+    return JSONResponse(analysis.as_dict())
+
+
+# Server-Sent Events: an 'iteration' event for each iteration of the
+# search (depth, score, pv, nodes, seconds), then a 'result' event with
+# what GET /analysis/{id} returns, once it is over
+@app.get("/analysis/{analysis_id}/events")
+async def analysis_events(analysis_id: str):
+    analysis = searchpool.get_analysis(analysis_id)
+    if analysis is None:
+        return _analysis_not_found()
+
+    async def stream():
+        async for event, data in analysis.events():
+            yield 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+    return StreamingResponse(stream(), media_type='text/event-stream')
+
+
+# stop the search once its iterations so far are good enough
+@app.delete("/analysis/{analysis_id}")
+async def stop_analysis(analysis_id: str):
+    analysis = searchpool.get_analysis(analysis_id)
+    if analysis is None:
+        return _analysis_not_found()
+    analysis.stop()
+    return JSONResponse({'id': analysis.id, 'status': analysis.status})
@@ -374,6 +374,18 @@ class PDNReader:
                     move.annotation = annotation
                     self._model.make_move(move, state_copy, False, False)
                     return move
+            # a multiple jump may be written with just its first and last
+            # squares, as long as only one jump fits them
+            ends = [move for move in legal_moves
+                    if board_squares == [move.affected_squares[0][0],
+                                         move.affected_squares[-1][0]]]
+            if len(ends) > 1:
+                raise RuntimeError(f"Ambiguous jump {squares} found")
+            if ends:
+                move = ends[0]
+                move.annotation = annotation
+                self._model.make_move(move, state_copy, False, False)
+                return move
 
     def _PDN_to_board_ready(self, next_to_move: int, black_men: list[int], black_kings: list[int],
                             white_men: list[int], white_kings: list[int], pdn_moves: list):
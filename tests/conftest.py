@@ -0,0 +1,7 @@
+import os
+
+# main reads its settings when it's imported: keep the tests' sessions in
+# memory, so they need no network or credentials, and give them a key to
+# sign their session cookies with
+os.environ['STORAGE'] = 'memory'
+os.environ.setdefault('SECRET_KEY', 'test')
@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 from base.move import Move
 from parsing.PDN import (PDNReader, PDNWriter, board_to_PDN_ready,
                          translate_to_fen)
@@ -154,6 +156,34 @@ def test_parse_PDN_string_success():
     assert game.moves == board_moves
 
 
+def test_parse_PDN_multiple_jump_by_first_and_last_squares():
+    pdn_string = '[Event "Short jump"]\n' + \
+                 '[FEN "W:W27:B23,15"]\n' + \
+                 '\n' + \
+                 '1. 27x11 1-0\n'
+    reader = PDNReader.from_string(pdn_string)
+    game = reader.game_params_from_pdn(0)
+    # the double jump 27x18x11
+    assert [sq[0] for sq in game.moves[0].affected_squares[::2]] == \
+        [square_map[27], square_map[18], square_map[11]]
+
+
+def test_parse_PDN_jump_by_first_and_last_squares_must_be_unique():
+    # the king can go round the four men either way
+    pdn_string = '[Event "Round trip"]\n' + \
+                 '[FEN "W:WK22:B9,10,17,18"]\n' + \
+                 '\n' + \
+                 '1. 22x22 1-0\n'
+    reader = PDNReader.from_string(pdn_string)
+    with pytest.raises(RuntimeError):
+        reader.game_params_from_pdn(0)
+    reader = PDNReader.from_string(pdn_string.replace('22x22',
+                                                      '22x13x6x15x22'))
+    game = reader.game_params_from_pdn(0)
+    assert [sq[0] for sq in game.moves[0].affected_squares[::2]] == \
+        [square_map[sq] for sq in (22, 13, 6, 15, 22)]
+
+
 def test_parse_PDN_file_success():
     pdn_file = os.path.join('training', 'OCA_2.0.pdn')
     with PDNReader.from_file(pdn_file) as reader:
@@ -1,3 +1,6 @@
+import json
+import time
+
 from fastapi.testclient import TestClient
 
 from main import app
@@ -112,10 +115,31 @@ def test_calc_move():
     assert response.status_code == 200
     response = client.post('/calc_move?search_time=5')
     assert response.status_code == 200
-    assert response.json() == {
-        "start_sq": 10,
-        "end_sq": 15,
-    }
+    # the move depends on how deep the search gets within its time, so only
+    # check that it is one of Black's legal opening moves
+    move = response.json()
+    assert [move['start_sq'], move['end_sq']] in [[9, 13], [9, 14], [10, 14],
+                                                  [10, 15], [11, 15], [11, 16],
+                                                  [12, 16]]
+    assert 'stats' not in move
+    # the session holds the position after the move
+    response = client.get('/cb_state')
+    assert response.status_code == 200
+    assert response.json()['fen'].startswith('W:')
+
+
+def test_calc_move_with_stats():
+    client = TestClient(app)
+    response = client.post('/end_session')
+    response = client.post('/create_session')
+    assert response.status_code == 200
+    # from the book, the start position wouldn't be searched
+    response = client.post('/calc_move?search_time=1&stats=true&book=false')
+    assert response.status_code == 200
+    stats = response.json()['stats']
+    assert stats['nodes'] > 0
+    assert stats['depth'] == len(stats['iterations'])
+    assert stats['tt_hits'] <= stats['tt_probes']
 
 
 def test_create_session():
@@ -145,3 +169,87 @@ def test_end_session():
     # be found in the database any longer.
     response = client.get('/cb_state')
     assert response.status_code == 404
+
+
+def test_sessions_are_kept_apart():
+    # each client's cookie carries the id of its own game
+    first, second = TestClient(app), TestClient(app)
+    response = first.post('/create_session')
+    assert response.status_code == 200
+    first_id = response.json()['key']
+    response = second.post('/create_session?fen=W:W26,K27:B17,K30')
+    assert response.status_code == 200
+    assert response.json()['key'] != first_id
+    response = first.post('/make_move?start_sq=11&end_sq=15')
+    assert response.status_code == 200
+    assert second.get('/cb_state').json() == {'fen': 'W:W26,K27:B17,K30'}
+    assert first.get('/cb_state').json() == {
+        "fen": "W:W21,22,23,24,25,26,27,28,29,30,31,32:"
+               "B1,2,3,4,5,6,7,8,9,10,12,15"
+    }
+    # a client without a session has no game
+    response = TestClient(app).get('/cb_state')
+    assert response.status_code == 404
+    response = second.post('/end_session')
+    assert second.get('/cb_state').status_code == 404
+    assert first.get('/cb_state').status_code == 200
+
+
+def test_analysis_streams_iterations_then_result():
+    # one client, so that every request runs on the same event loop
+    with TestClient(app) as client:
+        response = client.post(
+            '/analysis?search_time=1&fen=W:WK10,K15,K19:BK9,K27')
+        assert response.status_code == 202
+        analysis_id = response.json()['id']
+        events = []
+        with client.stream('GET',
+                           '/analysis/%s/events' % analysis_id) as stream:
+            assert stream.headers['content-type'].startswith(
+                'text/event-stream')
+            for line in stream.iter_lines():
+                if line.startswith('event: '):
+                    event = line[len('event: '):]
+                elif line.startswith('data: '):
+                    events.append((event, json.loads(line[len('data: '):])))
+        kinds = [kind for kind, _ in events]
+        assert kinds[-1] == 'result' and set(kinds[:-1]) == {'iteration'}
+        iterations = [data for _, data in events[:-1]]
+        assert [it['depth'] for it in iterations] == \
+            list(range(1, len(iterations) + 1))
+        assert all(it['nodes'] > 0 and it['pv'] for it in iterations)
+        response = client.get('/analysis/%s' % analysis_id)
+        assert response.status_code == 200
+        analysis = response.json()
+        assert analysis == events[-1][1]
+        assert analysis['status'] == 'done'
+        assert analysis['iterations'] == iterations
+        result = analysis['result']
+        assert result['depth'] == iterations[-1]['depth']
+        assert result['move'] == result['pv'][0]
+        assert [result['start_sq'], result['end_sq']] in [
+            [10, 6], [10, 7], [10, 14], [15, 11], [15, 18], [19, 16],
+            [19, 23], [19, 24]]
+
+
+def test_analysis_can_be_stopped():
+    with TestClient(app) as client:
+        response = client.post(
+            '/analysis?search_time=60&fen=W:WK10,K15,K19:BK9,K27')
+        analysis_id = response.json()['id']
+        response = client.delete('/analysis/%s' % analysis_id)
+        assert response.status_code == 200
+        for _ in range(100):
+            analysis = client.get('/analysis/%s' % analysis_id).json()
+            if analysis['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.1)
+        assert analysis['status'] == 'stopped'
+
+
+def test_analysis_not_found():
+    client = TestClient(app)
+    response = client.get('/analysis/nonesuch')
+    assert response.status_code == 404
+    response = client.delete('/analysis/nonesuch')
+    assert response.status_code == 404
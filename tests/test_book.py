@@ -0,0 +1,74 @@
+import os
+
+import game.book as book
+import game.checkers as checkers
+from game.perft import move_text
+
+GAMES = '''[Event "one"]
+[Result "1-0"]
+1. 11-15 23-19 2. 8-11 22-17 3. 9-14 25-22 1-0
+
+[Event "two"]
+[Result "0-1"]
+1. 11-15 23-19 2. 9-14 22-17 0-1
+
+[Event "three"]
+[Result "1/2-1/2"]
+1. 9-13 22-18 2. 11-15 18x11 1/2-1/2
+
+[Event "four"]
+[Result "1-0"]
+1. 11-15 24-20 2. 32-28 1-0
+'''
+
+
+def _build(tmp_path, plies=4):
+    pdn = os.path.join(str(tmp_path), 'games.pdn')
+    with open(pdn, 'w') as f:
+        f.write(GAMES)
+    rcf = os.path.join('training', 'Openings', 'Cross.rcf')
+    entries, games, skipped = book.build_book([pdn, rcf], plies)
+    path = os.path.join(str(tmp_path), 'test.book')
+    book.write_book(path, entries, plies, games)
+    return book.OpeningBook(path), games, skipped
+
+
+def test_book_counts_moves_and_results(tmp_path):
+    opening_book, games, skipped = _build(tmp_path)
+    # the last game has an illegal move
+    assert (games, skipped) == (4, 1)
+    assert opening_book.plies == 4
+    keys = list(opening_book.keys)
+    assert keys == sorted(keys) and len(keys) == len(opening_book)
+    board = checkers.Checkers().curr_state
+    # two games and the Cross open 11-15, one game 9-13
+    assert opening_book.moves(board) == [
+        book.BookMove(11, 15, 3, 1, 0, 1), book.BookMove(9, 13, 1, 0, 1, 0)]
+    assert move_text(opening_book.choose(board)) == '11-15'
+    line = []
+    for _ in range(5):
+        move = opening_book.choose(board)
+        if move is None:
+            break
+        line.append(move_text(move))
+        board.make_move(move, False, False)
+    # 23-19 twice against the Cross's 23-18; then 8-11 scored better
+    # than 9-14; and the book ends after four plies
+    assert line == ['11-15', '23-19', '8-11', '22-17']
+    opening_book.close()
+
+
+def test_calc_ai_move_plays_from_the_book(tmp_path):
+    opening_book, _, _ = _build(tmp_path)
+    game = checkers.Checkers()
+    checkers.set_book(opening_book)
+    try:
+        move, stats = checkers.calc_ai_move(game, 10, stats=True)
+        assert move_text(move) == '11-15'
+        assert stats.nodes == 0
+        move, stats = checkers.calc_ai_move(game, 0.1, stats=True,
+                                            book=False)
+        assert stats.nodes > 0
+    finally:
+        checkers.set_book(None)
+    opening_book.close()
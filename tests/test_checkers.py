@@ -1,5 +1,8 @@
 import game.checkers as checkers
-from util.globalconst import BLACK, WHITE, MAN, KING, FREE
+from ai.evalcache import EvalCache
+from base.move import Move
+from util.globalconst import (BLACK, CRAMP, EVAL_CACHE_SIZE, FREE,
+                              INTACT_DOUBLE_CORNER, KING, MAN, WHITE)
 
 #   (white)
 #            45  46  47  48
@@ -237,6 +240,7 @@ def test_utility_func():
     board = game.curr_state
     board.to_move = WHITE
     squares = board.squares
+    bitboards = board.bitboards
 
     code = sum(board.value[s] for s in squares)
     nwm = code % 16
@@ -246,17 +250,75 @@ def test_utility_func():
     nm = nbm + nwm
     nk = nbk + nwk
 
-    assert board._eval_cramp(squares) == 0
-    assert board._eval_back_rank_guard(squares) == 0
-    assert board._eval_double_corner(squares) == 0
-    assert board._eval_center(squares) == 0
-    assert board._eval_edge(squares) == 0
-    assert board._eval_tempo(squares, nm, nbk, nbm, nwk, nwm) == 0
-    assert board._eval_player_opposition(squares, nwm, nwk, nbk,
+    assert board._eval_cramp(bitboards) == 0
+    assert board._eval_back_rank_guard(bitboards) == 0
+    assert board._eval_double_corner(bitboards) == 0
+    assert (board.center, board.edge) == (0, 0)
+    assert board._eval_tempo(bitboards, nm, nbk, nbm, nwk, nwm) == 0
+    assert board._eval_player_opposition(bitboards, nwm, nwk, nbk,
                                          nbm, nm, nk) == 0
     assert board.utility(WHITE) == -2
 
 
+def test_pattern_terms():
+    board = checkers.Checkerboard()
+    board.clear()
+    squares = board.squares
+    bitboards = board.bitboards
+    squares[28] = BLACK | MAN
+    squares[34] = WHITE | MAN
+    assert board._eval_cramp(bitboards) == CRAMP
+    squares[26] = WHITE | MAN
+    squares[20] = BLACK | MAN
+    assert board._eval_cramp(bitboards) == 0
+    squares[9] = BLACK | MAN
+    squares[15] = BLACK | MAN
+    assert board._eval_double_corner(bitboards) == INTACT_DOUBLE_CORNER
+    squares[45] = WHITE | MAN
+    squares[40] = WHITE | MAN
+    assert board._eval_double_corner(bitboards) == 0
+    # four men each and four pieces in each system, so whoever is to
+    # move, white has the opposition
+    assert board._eval_player_opposition(bitboards, 4, 0, 0, 4, 8, 0) == -4
+    board.to_move = WHITE
+    assert board._eval_player_opposition(bitboards, 4, 0, 0, 4, 8, 0) == 4
+    # no opposition term unless the sides are level
+    assert board._eval_player_opposition(bitboards, 4, 0, 0, 3, 7, 0) == 0
+
+
+def test_eval_terms_follow_make_and_undo():
+    # a game of captures, crowning and king moves; the incremental terms
+    # must match a board counted from scratch at every position
+    game = checkers.Checkers()
+    board = game.curr_state
+    fresh = checkers.Checkerboard()
+    played = []
+    for ply in range(80):
+        moves = game.legal_moves(board)
+        if not moves:
+            break
+        move = moves[(ply * 7) % len(moves)]
+        board.make_move(move, False, False)
+        played.append(move)
+        fresh.set_position(board.position())
+        assert (board.material, board.tempo, board.center, board.edge) == \
+            (fresh.material, fresh.tempo, fresh.center, fresh.edge)
+    for move in reversed(played):
+        board.undo_move(move, False, False)
+    assert (board.material, board.tempo, board.center, board.edge) == \
+        (checkers.Checkerboard().material, 0, 0, 0)
+
+
+def test_utility_adds_its_terms_in_the_same_order():
+    # center (4) and edge (-4) added to the fractional material term
+    # together, rather than one after the other, come out a bit off
+    board = checkers.Checkerboard()
+    board.set_position((134234112, 541065360, 36704772, 2147483648, WHITE))
+    assert (board.center, board.edge) == (4, -4)
+    assert board.utility(BLACK) == 10.275862068965516
+    assert board.utility(WHITE) == -14.275862068965518
+
+
 def test_successor_func_for_black():
     game = checkers.Checkers()
     board = game.curr_state
@@ -305,3 +367,151 @@ def test_successor_func_for_white():
                                          [30, FREE, WHITE | MAN]]
     assert moves[6].affected_squares == [[37, WHITE | MAN, FREE],
                                          [31, FREE, WHITE | MAN]]
+
+
+def test_perft_start_position():
+    game = checkers.Checkers()
+    assert [game.perft(depth) for depth in range(1, 7)] == [7, 49, 302, 1469,
+                                                            7361, 36768]
+
+
+def test_squares_view_writes_through_to_bitboards():
+    game = checkers.Checkers()
+    board = game.curr_state
+    squares = board.squares
+    board.clear()
+    squares[6] = BLACK | MAN
+    squares[48] = WHITE | KING
+    assert board.black_men == 0x1
+    assert board.white_kings == 0x80000000
+    assert squares[6] == BLACK | MAN
+    assert squares[7] == FREE
+    assert squares[10] == 0
+    squares[6] = FREE
+    assert board.black_men == 0
+    assert board.save_board_state() == ('black', [], [], [], [29])
+
+
+def test_hash_key_restored_by_undo_and_equal_for_transpositions():
+    game = checkers.Checkers()
+    board = game.curr_state
+    start_key = board.hash_key
+    # 10-15 21-17 11-16 and 11-16 21-17 10-15 reach the same position
+    first = [m for m in game.legal_moves(board)
+             if m.affected_squares[0][0] == 19 and
+             m.affected_squares[-1][0] == 24][0]
+    board.make_move(first, False, False)
+    assert board.hash_key != start_key
+    reply = game.legal_moves(board)[-1]
+    board.make_move(reply, False, False)
+    second = [m for m in game.legal_moves(board)
+              if m.affected_squares[0][0] == 18 and
+              m.affected_squares[-1][0] == 23][0]
+    board.make_move(second, False, False)
+    transposed_key = board.hash_key
+    for move in (second, reply, first):
+        board.undo_move(move, False, False)
+    assert board.hash_key == start_key
+
+    board.make_move(second, False, False)
+    board.make_move(reply, False, False)
+    board.make_move(first, False, False)
+    assert board.hash_key == transposed_key
+
+
+def test_hash_key_follows_square_writes_and_side_to_move():
+    game = checkers.Checkers()
+    board = game.curr_state
+    board.clear()
+    assert board.hash_key == 0
+    board.squares[6] = BLACK | MAN
+    board.squares[6] = FREE
+    assert board.hash_key == 0
+    board.squares[6] = BLACK | KING
+    black_key = board.hash_key
+    board.to_move = WHITE
+    assert board.hash_key != black_key
+
+
+def test_move_built_from_affected_squares_makes_and_unmakes():
+    game = checkers.Checkers()
+    board = game.curr_state
+    start_bitboards = board.bitboards[:]
+    start_key = board.hash_key
+    # the list layout used by the PDN parser and the API
+    move = Move([[19, BLACK | MAN, FREE], [24, FREE, BLACK | MAN]])
+    assert move in game.legal_moves(board)
+    assert move.affected_squares == [[19, BLACK | MAN, FREE],
+                                     [24, FREE, BLACK | MAN]]
+    board.make_move(move, False, False)
+    assert board.squares[19] == FREE
+    assert board.squares[24] == BLACK | MAN
+    board.undo_move(move, False, False)
+    assert board.bitboards == start_bitboards
+    assert board.hash_key == start_key
+
+
+def test_legal_moves_cached_until_board_changes():
+    game = checkers.Checkers()
+    board = game.curr_state
+    moves = game.legal_moves(board)
+    assert game.legal_moves(board) is moves
+    assert not game.terminal_test(board)
+    assert [m for m, _ in game.successors(board)] == moves
+    board.make_move(moves[0], False, False)
+    replies = game.legal_moves(board)
+    assert replies is not moves
+    board.undo_move(moves[0], False, False)
+    assert game.legal_moves(board) == moves
+    # direct changes to the board are noticed as well
+    board.to_move = WHITE
+    assert game.legal_moves(board) == replies
+    board.squares[29] = BLACK | MAN
+    assert game.legal_moves(board)[0].affected_squares == [
+        [34, WHITE | MAN, FREE], [29, BLACK | MAN, FREE],
+        [24, FREE, WHITE | MAN]]
+
+
+def test_step_and_jump_tables_stay_on_the_board():
+    from game.bitboard import JUMP, STEP
+    # black man on the side of the board has a single way up
+    assert [dest for dest, _ in STEP[BLACK | MAN][17]] == [23]
+    assert [(mid, dest) for mid, dest, _, _ in JUMP[BLACK | MAN][17]] == [
+        (23, 29)]
+    # a king in the middle reaches all four diagonals
+    assert [dest for dest, _ in STEP[WHITE | KING][24]] == [18, 19, 29, 30]
+    assert [(mid, dest) for mid, dest, _, _ in JUMP[WHITE | KING][24]] == [
+        (18, 12), (19, 14), (29, 34), (30, 36)]
+    assert STEP[WHITE | MAN][11] == JUMP[WHITE | MAN][11] == ()
+
+
+def test_eval_cache():
+    cache = EvalCache(2)
+    cache.put(1, 10.0)
+    cache.put(2, 20.0)
+    assert cache.get(1) == 10.0
+    cache.put(3, 30.0)
+    # 2 was the least recently used
+    assert cache.get(2) is None
+    assert (cache.get(1), cache.get(3)) == (10.0, 30.0)
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 2)
+
+    try:
+        checkers.set_eval_cache_size(16)
+        game = checkers.Checkers()
+        board = game.curr_state
+        black, white = board.utility(BLACK), board.utility(WHITE)
+        cache = checkers.get_eval_cache()
+        assert (cache.hits, cache.misses) == (0, 2)
+        assert game.utility(BLACK) == black
+        assert board.utility(WHITE) == white
+        assert (cache.hits, cache.misses) == (2, 2)
+        # the side to move is part of the key
+        board.to_move = WHITE
+        assert board.utility(BLACK) == board._evaluate(BLACK)
+        assert cache.misses == 3
+        checkers.set_eval_cache_size(0)
+        assert checkers.get_eval_cache() is None
+        assert board.utility(BLACK) == board._evaluate(BLACK)
+    finally:
+        checkers.set_eval_cache_size(EVAL_CACHE_SIZE)
@@ -0,0 +1,47 @@
+import game.perft as perft
+
+
+def test_perft_suite_counts():
+    results = perft.run_suite(depth=5)
+    assert [r['nodes'] for r in results] == [
+        counts[4] for _, _, counts in perft.POSITIONS]
+    assert all(r['ok'] for r in results)
+
+
+def test_perft_divide_adds_up():
+    game = perft.game_from_fen(perft.START_FEN)
+    counts = perft.divide(game, 4)
+    assert sorted(text for text, _ in counts) == [
+        '10-14', '10-15', '11-15', '11-16', '12-16', '9-13', '9-14']
+    assert sum(nodes for _, nodes in counts) == 1469
+
+
+def test_perft_divide_names_jumps():
+    game = perft.game_from_fen('B:W6,7,14,15,22,23,30:B1,2')
+    texts = [text for text, _ in perft.divide(game, 1)]
+    assert sorted(texts) == ['1x10x17x26', '1x10x19x26', '2x11x18x25',
+                             '2x11x18x27', '2x9x18x25', '2x9x18x27']
+
+
+def test_perft_reports_wrong_counts():
+    result = perft.run_position('start', perft.START_FEN, (7, 50), 2)
+    assert result['nodes'] == 49
+    assert not result['ok']
+    assert perft.main(['--depth', '1', '--json']) == 0
+
+
+def test_hashed_perft_matches_plain_perft():
+    for name, fen, counts in perft.POSITIONS:
+        game = perft.game_from_fen(fen)
+        table = perft.PerftTable(2 ** 10)
+        assert perft.hashed_perft(game, 6, table) == counts[5], name
+        # the board is left as it was
+        assert game.perft(1) == counts[0]
+    assert table.hits > 0
+
+
+def test_parallel_perft():
+    game = perft.game_from_fen(perft.START_FEN)
+    assert sum(perft.split_positions(game, 2).values()) == 49
+    assert perft.parallel_perft(game, 6, workers=2) == 36768
+    assert perft.parallel_perft(game, 2, workers=2) == 49
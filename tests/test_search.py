@@ -0,0 +1,255 @@
+import time
+
+import ai.games as games
+import ai.lazysmp as lazysmp
+import ai.parallel as parallel
+import game.checkers as checkers
+from ai.negamax import negamax_search
+from ai.ordering import MoveOrdering
+from ai.stats import SearchStats
+from ai.transposition import (SharedTranspositionTable, TranspositionTable,
+                              score_bits)
+from util.globalconst import (BLACK, MAN, WHITE, hashfALPHA, hashfBETA,
+                              hashfEXACT, square_map)
+
+
+def test_transposition_table_bounds():
+    table = TranspositionTable(size=16)
+    table.store(0x1234, 3, hashfEXACT, 10, 'move')
+    assert table.probe(0x1234, 3, -100, 100) == (10, 'move')
+    # too shallow to settle the window, but the best move is still returned
+    assert table.probe(0x1234, 4, -100, 100) == (None, 'move')
+    table.store(0x99, 2, hashfALPHA, -5, None)
+    assert table.probe(0x99, 2, 0, 10) == (-5, None)
+    assert table.probe(0x99, 2, -10, 10) == (None, None)
+    table.store(0x77, 2, hashfBETA, 50, None)
+    assert table.probe(0x77, 1, 0, 40) == (50, None)
+    assert table.probe(0x77, 1, 0, 60) == (None, None)
+    assert table.probe(0x55, 0, 0, 60) == (None, None)
+
+
+def test_transposition_table_replacement():
+    table = TranspositionTable(size=16)
+    table.store(0x10, 5, hashfEXACT, 1, None)
+    # same bucket, shallower: goes to the always-replace slot
+    table.store(0x20, 2, hashfEXACT, 2, None)
+    table.store(0x30, 1, hashfEXACT, 3, None)
+    assert table.entry(0x10) is not None
+    assert table.entry(0x20) is None
+    assert table.entry(0x30) is not None
+    # entries from an earlier search give way in the depth-preferred slot
+    table.new_search()
+    table.store(0x40, 1, hashfEXACT, 4, None)
+    assert table.entry(0x10) is None
+    assert table.entry(0x40) is not None
+
+
+def test_alphabeta_search_with_table_matches_plain_search():
+    game = checkers.Checkers()
+    board = game.curr_state
+    plain = games.alphabeta_search(board, game, 4)
+    tabled = games.alphabeta_search(board, game, 4,
+                                    table=TranspositionTable())
+    assert plain == tabled
+
+
+def test_iterative_deepening_search_respects_search_time():
+    game = checkers.Checkers()
+    board = game.curr_state
+    start = time.monotonic()
+    move = games.iterative_deepening_search(board, game, 0.5)
+    assert time.monotonic() - start < 1.0
+    assert move in game.legal_moves(board)
+    # the board is left as it was found, even after a search is cut short
+    assert board.save_board_state() == \
+        checkers.Checkerboard().save_board_state()
+    assert board.hash_key == checkers.Checkerboard().hash_key
+
+
+def test_iterative_deepening_search_finds_first_iteration_move_with_no_time():
+    game = checkers.Checkers()
+    board = game.curr_state
+    move = games.iterative_deepening_search(board, game, 0)
+    assert move == games.alphabeta_search(board, game, 1)
+
+
+def _board(black_men, white_men, to_move):
+    game = checkers.Checkers()
+    board = game.curr_state
+    board.clear()
+    for sq in black_men:
+        board.squares[square_map[sq]] = BLACK | MAN
+    for sq in white_men:
+        board.squares[square_map[sq]] = WHITE | MAN
+    board.to_move = to_move
+    return game, board
+
+
+def test_quiescence_search_sees_exchanges_past_the_horizon():
+    game, board = _board([8, 9, 10, 17], [19, 20, 25, 26, 28, 29, 32], BLACK)
+    state = board.save_board_state()
+    quiescence = games.Quiescence()
+    move = games.alphabeta_search(board, game, 0, quiescence=quiescence)
+    assert quiescence.nodes > 0 and quiescence.max_ply > 0
+    assert move == games.alphabeta_search(board, game, 4,
+                                          quiescence=games.Quiescence())
+    assert move != games.alphabeta_search(board, game, 0)
+    assert board.save_board_state() == state
+    # with no extra plies allowed it is the plain search again
+    capped = games.Quiescence(max_depth=0)
+    assert (games.alphabeta_search(board, game, 0, quiescence=capped) ==
+            games.alphabeta_search(board, game, 0))
+    assert capped.nodes > 0 and capped.max_ply == 0
+
+
+def test_move_ordering_puts_table_move_then_killers_then_history_first():
+    ordering = MoveOrdering()
+    moves = ['a', 'b', 'c', 'd', 'e']
+    assert ordering.order(moves, 3) == moves
+    ordering.cutoff('d', 3, 2)
+    ordering.cutoff('c', 3, 1)
+    ordering.cutoff('e', 5, 4)
+    assert ordering.killers[3] == ['c', 'd']
+    # killers only count at their own ply; history counts everywhere
+    assert ordering.order(moves, 3) == ['c', 'd', 'e', 'a', 'b']
+    assert ordering.order(moves, 1, 'b') == ['b', 'e', 'd', 'c', 'a']
+    assert ordering.order(['a', 'b'], 3, 'b') == ['b', 'a']
+    ordering.new_search()
+    assert ordering.history == {'d': 2, 'c': 0, 'e': 8}
+
+
+def test_alphabeta_search_with_move_ordering_matches_plain_search():
+    game = checkers.Checkers()
+    board = game.curr_state
+    ordering = MoveOrdering(game.move_key)
+    for depth in range(1, 5):
+        assert (games.alphabeta_search(board, game, depth,
+                                       table=TranspositionTable(),
+                                       ordering=ordering) ==
+                games.alphabeta_search(board, game, depth))
+    assert ordering.history
+    assert board.save_board_state() == \
+        checkers.Checkerboard().save_board_state()
+
+
+def test_negamax_search_visits_the_same_nodes_as_alphabeta_search():
+    game, board = _board([8, 9, 10, 17], [19, 20, 25, 26, 28, 29, 32], BLACK)
+    for depth in range(4):
+        counted = []
+
+        def cutoff_test(st, ply):
+            counted.append(ply)
+            return ply > depth or game.terminal_test(st)
+
+        move = games.alphabeta_search(board, game, depth,
+                                      cutoff_test=cutoff_test)
+        score, best, pv, nodes = negamax_search(board, game, depth)
+        assert best == move
+        assert nodes == len(counted)
+        assert pv[0] == best
+        # the principal variation is a line of legal moves down to the
+        # position whose evaluation is the score
+        for ply_move in pv:
+            assert ply_move in game.legal_moves(board)
+            board.make_move(ply_move, False, False)
+        assert len(pv) == depth + 2
+        assert board.utility(BLACK) == score
+        for ply_move in reversed(pv):
+            board.undo_move(ply_move, False, False)
+
+
+def test_negamax_search_restores_the_board_when_out_of_time():
+    game = checkers.Checkers()
+    board = game.curr_state
+    try:
+        negamax_search(board, game, 6, deadline=time.monotonic() + 0.05)
+    except games.SearchTimeout:
+        pass
+    assert board.save_board_state() == \
+        checkers.Checkerboard().save_board_state()
+    assert board.hash_key == checkers.Checkerboard().hash_key
+
+
+def test_parallel_search_agrees_with_negamax_search():
+    game, board = _board([8, 9, 10, 17], [19, 20, 25, 26, 28, 29, 32], BLACK)
+    pool = parallel.get_pool(game, 2)
+    try:
+        for depth in (1, 3):
+            score, move, _, _ = negamax_search(
+                board, game, depth, quiescence=games.Quiescence())
+            result = parallel.parallel_search(board, pool, 2, ('test', depth),
+                                              depth)
+            best_score, index, nodes = result
+            assert best_score == score
+            assert game.legal_moves(board)[index] == move
+            assert nodes > 0
+        move = checkers.calc_ai_move(game, 0.2, workers=2, engine='split')
+        assert move in game.legal_moves(board)
+    finally:
+        parallel.shutdown_pool()
+
+
+def test_shared_transposition_table_entries_are_seen_by_attached_tables():
+    game = checkers.Checkers()
+    board = game.curr_state
+    table = SharedTranspositionTable(size=16)
+    other = SharedTranspositionTable(size=16, name=table.name)
+    try:
+        for t in (table, other):
+            t.bind(board, game.move_key)
+        move = game.legal_moves(board)[2]
+        table.store(0x1234, -3, hashfEXACT, 10.25, move)
+        assert other.probe(0x1234, -3, -100, 100) == (10.25, move)
+        assert other.probe(0x1234, 1, -100, 100) == (None, move)
+        other.store(0x99, 2, hashfALPHA, -5, None)
+        assert table.probe(0x99, 2, 0, 10) == (-5, None)
+        # an entry whose words don't agree (as when two processes write
+        # it at once) is not trusted
+        table.words[(0x99 & 15) * 6 + 1] ^= 1 << 8
+        assert table.entry(0x99) is None
+        # nor is one whose score word was written by another process
+        table.store(0x1234, -3, hashfEXACT, 10.25, move)
+        offset = (0x1234 & 15) * 6
+        assert other.entry(0x1234) is not None
+        table.words[offset + 2] = score_bits(-7.5)
+        assert other.entry(0x1234) is None
+        assert other.probe(0x1234, -3, -100, 100) == (None, None)
+    finally:
+        other.close()
+        table.close()
+
+
+def test_lazy_smp_search_returns_a_legal_move():
+    game = checkers.Checkers()
+    board = game.curr_state
+    try:
+        move = checkers.calc_ai_move(game, 0.3, workers=2, engine='smp')
+        assert move in game.legal_moves(board)
+    finally:
+        lazysmp.shutdown_engine()
+
+
+def test_search_stats_count_what_the_search_did():
+    game, board = _board([8, 9, 10, 17], [19, 20, 25, 26, 28, 29, 32], BLACK)
+    stats = SearchStats()
+    quiescence = games.Quiescence()
+    _, _, _, nodes = negamax_search(board, game, 3, TranspositionTable(),
+                                    quiescence=quiescence, stats=stats)
+    assert stats.nodes == nodes
+    assert stats.qnodes == quiescence.nodes > 0
+    assert 0 < stats.first_move_cutoffs <= stats.cutoffs
+    assert 0 < stats.tt_hits <= stats.tt_probes
+    # alphabeta_search counts the same nodes
+    ab_stats = SearchStats()
+    games.alphabeta_search(board, game, 3, quiescence=games.Quiescence(),
+                           stats=ab_stats)
+    plain = SearchStats()
+    negamax_search(board, game, 3, quiescence=games.Quiescence(),
+                   stats=plain)
+    assert ab_stats.as_dict() == plain.as_dict()
+    move, stats = checkers.calc_ai_move(game, 0.3, stats=True)
+    assert move in game.legal_moves(board)
+    assert stats.depth == len(stats.iterations) >= 1
+    # an iteration cut short counts nodes but isn't listed
+    assert stats.nodes >= sum(it['nodes'] for it in stats.iterations)
+    assert stats.nps > 0
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import pytest
+
+import game.checkers as checkers
+import game.searchpool as searchpool
+import game.tablebase as tablebase
+from game.checkers import Checkers
+from game.perft import game_from_fen
+from game.tbprobe import Tablebase
+
+
+def _start():
+    state = Checkers().curr_state
+    return state.position(), state.legal_moves
+
+
+def test_search_runs_off_the_event_loop():
+    position, moves = _start()
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        ticker = asyncio.ensure_future(tick())
+        found = await searchpool.search(position, 1, stats=True, book=False,
+                                        processes=1, queue=2)
+        ticker.cancel()
+        return found, ticks
+
+    (index, stats), ticks = asyncio.run(run())
+    assert 0 <= index < len(moves)
+    assert stats.nodes > 0
+    # the loop went on running while the search did
+    assert ticks > 20
+    searchpool.shutdown_pool()
+
+
+def test_search_stops_when_the_client_goes():
+    position, _ = _start()
+    gone_at = None
+
+    async def disconnected():
+        return time.monotonic() > gone_at
+
+    async def run():
+        nonlocal gone_at
+        gone_at = time.monotonic() + 0.5
+        start = time.monotonic()
+        found = await searchpool.search(position, 60, book=False,
+                                        disconnected=disconnected,
+                                        processes=1, queue=2, poll=0.05)
+        assert found is None
+        # the worker is free for the next search well before the first
+        # one's time is up
+        found = await searchpool.search(position, 0.2, book=False,
+                                        processes=1, queue=2)
+        return found, time.monotonic() - start
+
+    found, seconds = asyncio.run(run())
+    assert found[0] is not None
+    assert seconds < 20
+    searchpool.shutdown_pool()
+
+
+def test_search_pool_turns_searches_away_when_full():
+    position, _ = _start()
+
+    async def run():
+        first = asyncio.ensure_future(searchpool.search(
+            position, 0.5, book=False, processes=1, queue=1))
+        await asyncio.sleep(0)
+        with pytest.raises(searchpool.SearchPoolBusy):
+            await searchpool.search(position, 0.5, book=False, processes=1,
+                                    queue=1)
+        assert (await first)[0] is not None
+        # once the first is done its slot takes another
+        return await searchpool.search(position, 0.1, book=False,
+                                       processes=1, queue=1)
+
+    assert asyncio.run(run())[0] is not None
+    searchpool.shutdown_pool()
+
+
+@pytest.mark.parametrize('engine', ['smp', 'split'])
+def test_engine_searches_are_bounded_and_stopped(engine):
+    position, moves = _start()
+    gone_at = None
+
+    async def disconnected():
+        return time.monotonic() > gone_at
+
+    async def run():
+        nonlocal gone_at
+        gone_at = time.monotonic() + 0.5
+        start = time.monotonic()
+        first = asyncio.ensure_future(searchpool.search(
+            position, 60, book=False, disconnected=disconnected, workers=2,
+            engine=engine, processes=1, queue=1, poll=0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(searchpool.SearchPoolBusy):
+            await searchpool.search(position, 0.2, book=False, workers=2,
+                                    engine=engine, processes=1, queue=1)
+        assert await first is None
+        # the engine's processes were stopped, so its slot is soon free
+        # for the next search, well before the first one's time is up
+        while True:
+            try:
+                found = await searchpool.search(position, 0.2, book=False,
+                                                workers=2, engine=engine,
+                                                processes=1, queue=1)
+                return found, time.monotonic() - start
+            except searchpool.SearchPoolBusy:
+                await asyncio.sleep(0.05)
+
+    (index, _), seconds = asyncio.run(run())
+    assert 0 <= index < len(moves)
+    assert seconds < 20
+    searchpool.shutdown_pool()
+
+
+def test_pool_workers_probe_the_tablebase(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    tablebase.generate(directory, 2)
+    position = game_from_fen('W:WK6:B1').curr_state.position()
+    # spawned workers inherit nothing, so see the tablebase only if
+    # they are set up with it
+    monkeypatch.setattr(searchpool, 'START_METHOD', 'spawn')
+    checkers.set_tablebase(Tablebase(directory))
+    try:
+        index, stats = asyncio.run(searchpool.search(
+            position, 0.2, stats=True, book=False, processes=1, queue=1))
+    finally:
+        checkers.set_tablebase(None)
+        searchpool.shutdown_pool()
+    assert index is not None
+    assert stats.tb_hits > 0
@@ -0,0 +1,65 @@
+import pytest
+
+from util.sessions import SessionStore
+from util.storage import MemoryStorage
+
+
+class CountingBase(MemoryStorage):
+    """ Counts the calls made of the store. """
+
+    def __init__(self):
+        MemoryStorage.__init__(self)
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append(('get', key))
+        return MemoryStorage.get(self, key)
+
+    def put(self, key, item):
+        self.calls.append(('put', key))
+        return MemoryStorage.put(self, key, item)
+
+    def delete(self, key):
+        self.calls.append(('delete', key))
+        MemoryStorage.delete(self, key)
+
+
+def test_sessions_are_written_through_and_read_from_the_cache():
+    base = CountingBase()
+    store = SessionStore(lambda: base, size=2)
+    first, item = store.create({'fen': 'B:W21:B1'})
+    assert item == {'fen': 'B:W21:B1', 'key': first}
+    second, _ = store.create({'fen': 'W:W26:B17'})
+    assert first != second
+    assert set(base.items) == {first, second}
+    base.calls.clear()
+    assert store.get(first)['fen'] == 'B:W21:B1'
+    store.put(second, {'fen': 'B:W26:B13'})
+    assert store.get(second)['fen'] == 'B:W26:B13'
+    # only the write went to the base
+    assert base.calls == [('put', second)]
+    assert base.items[second]['fen'] == 'B:W26:B13'
+    assert (store.hits, store.misses) == (2, 0)
+
+
+def test_least_recently_used_session_leaves_the_cache():
+    base = CountingBase()
+    store = SessionStore(lambda: base, size=2)
+    ids = [store.create({'fen': fen})[0] for fen in ('a', 'b')]
+    store.get(ids[0])
+    third, _ = store.create({'fen': 'c'})
+    assert len(store) == 2
+    base.calls.clear()
+    # the second was used least recently, so is read from the base again
+    assert store.get(ids[1])['fen'] == 'b'
+    assert base.calls == [('get', ids[1])]
+    assert store.misses == 1
+    store.delete(third)
+    assert store.get(third) is None
+    assert third not in base.items
+    assert store.get('nonesuch') is None
+
+
+def test_cache_size_must_be_positive():
+    with pytest.raises(ValueError):
+        SessionStore(dict, size=0)
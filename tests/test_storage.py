@@ -0,0 +1,101 @@
+import os
+import threading
+
+import pytest
+
+from util.storage import (MemoryStorage, SQLiteStorage, Storage,
+                          StorageError, open_storage)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'sqlite':
+        store = open_storage('sqlite',
+                             path=os.path.join(str(tmp_path), 'test.db'),
+                             pool_size=2)
+    else:
+        store = open_storage('memory')
+    yield store
+    store.close()
+
+
+def test_put_get_and_delete(storage):
+    assert storage.get('a') is None
+    assert storage.put('a', {'fen': 'B:W21:B1'}) == {'fen': 'B:W21:B1',
+                                                     'key': 'a'}
+    item = storage.get('a')
+    assert item == {'fen': 'B:W21:B1', 'key': 'a'}
+    # the item returned is a copy
+    item['fen'] = 'W:W21:B1'
+    assert storage.get('a')['fen'] == 'B:W21:B1'
+    storage.put('a', {'fen': 'W:W26:B17'})
+    assert storage.get('a')['fen'] == 'W:W26:B17'
+    storage.delete('a')
+    assert storage.get('a') is None
+    # deleting what isn't there is no error
+    storage.delete('a')
+
+
+def test_batches(storage):
+    items = {'k%d' % i: {'n': i} for i in range(1200)}
+    stored = storage.put_many(items)
+    assert stored['k7'] == {'n': 7, 'key': 'k7'}
+    found = storage.get_many(['k%d' % i for i in range(0, 1300, 3)])
+    assert sorted(found) == sorted('k%d' % i for i in range(0, 1200, 3))
+    assert found['k999'] == {'n': 999, 'key': 'k999'}
+    storage.delete_many(['k%d' % i for i in range(1000)])
+    assert sorted(storage.get_many(items)) == \
+        sorted('k%d' % i for i in range(1000, 1200))
+
+
+def test_sqlite_is_shared_across_threads_and_connections(tmp_path):
+    path = os.path.join(str(tmp_path), 'test.db')
+    store = SQLiteStorage(path, pool_size=2)
+    errors = []
+
+    def work(n):
+        try:
+            for i in range(50):
+                key = '%d-%d' % (n, i)
+                store.put(key, {'i': i})
+                assert store.get(key)['i'] == i
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(store.connections) <= 2
+    with store._connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    store.close()
+    # the items outlive the store
+    store = SQLiteStorage(path)
+    assert len(store.get_many('%d-%d' % (n, i) for n in range(6)
+                              for i in range(50))) == 300
+    store.close()
+
+
+def test_sqlite_says_so_when_no_connection_comes_free(tmp_path):
+    store = SQLiteStorage(os.path.join(str(tmp_path), 'test.db'),
+                          pool_size=1, timeout=0.1)
+    with store._connection():
+        with pytest.raises(StorageError):
+            store.get('a')
+    # the connection is back for the next caller
+    assert store.get('a') is None
+    store.close()
+
+
+def test_storage_methods_are_abstract():
+    with pytest.raises(NotImplementedError):
+        Storage().get('a')
+
+
+def test_open_storage_knows_the_backends():
+    assert isinstance(open_storage('memory'), MemoryStorage)
+    assert isinstance(open_storage('memory'), Storage)
+    with pytest.raises(ValueError):
+        open_storage('nonesuch')
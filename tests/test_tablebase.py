@@ -0,0 +1,183 @@
+import random
+
+import ai.games as games
+import game.checkers as checkers
+import game.tablebase as tablebase
+from ai.negamax import negamax_search
+from ai.stats import SearchStats
+from game.checkers import Checkerboard
+from game.perft import game_from_fen
+from game.tbprobe import Tablebase
+from util.globalconst import TABLEBASE_KNOWN_WIN, TABLEBASE_WIN
+
+
+def _successors(position):
+    board = Checkerboard()
+    board.set_position(position)
+    result = []
+    for move in board.legal_moves:
+        board.make_move(move, False, False)
+        result.append((move, board.position()))
+        board.undo_move(move, False, False)
+    return result
+
+
+def test_index_is_perfect():
+    for counts in [(1, 0, 0, 1), (0, 1, 1, 0), (2, 0, 1, 0), (1, 0, 1, 1)]:
+        table = tablebase.Slice(counts)
+        positions = set()
+        for index in range(table.size):
+            position = table.position(index)
+            assert table.index(position) == index
+            assert tablebase.counts_of(position) == counts
+            black_men, black_kings, white_men, white_kings, _ = position
+            # no square used twice, no man on its crowning row
+            assert popcount_all(position) == sum(counts)
+            assert not black_men & tablebase.WHITE_BACK_RANK
+            assert not white_men & tablebase.BLACK_BACK_RANK
+            positions.add(position)
+        assert len(positions) == table.size
+
+
+def popcount_all(position):
+    black_men, black_kings, white_men, white_kings, _ = position
+    return bin(black_men | black_kings | white_men | white_kings).count('1')
+
+
+def test_predecessors_undo_the_moves_within_a_slice():
+    rng = random.Random(0)
+    table = tablebase.Slice((1, 1, 1, 0))
+    for index in rng.sample(range(table.size), 300):
+        position = table.position(index)
+        for move, successor in _successors(position):
+            squares = move.squares
+            stays = len(squares) == 2 and squares[0][1] == squares[1][2]
+            assert (position in tablebase.predecessors(successor)) == stays
+        for previous in tablebase.predecessors(position):
+            assert position in [s for _, s in _successors(previous)]
+
+
+def test_pack_values():
+    values = bytes([1, 2, 3, 1, 3, 2])
+    packed = tablebase.pack_values(values)
+    assert packed == bytes([1 | 2 << 2 | 3 << 4 | 1 << 6, 3 | 2 << 2])
+
+
+def test_build_and_probe(tmp_path):
+    directory = str(tmp_path)
+    summaries = tablebase.generate(directory, 2, distances=True)
+    assert len(summaries) == len(tablebase.slices(2)) == 4
+    assert tablebase.generate(directory, 2) == []
+    # the kings-only slices with three pieces need only those
+    two_v_one = tablebase.build_slice(directory, (0, 2, 0, 1), True)
+    one_v_two = tablebase.build_slice(directory, (0, 1, 0, 2), True)
+    # the colors mirror one another
+    assert [two_v_one[k] for k in ('wins', 'losses', 'draws')] == \
+        [one_v_two[k] for k in ('wins', 'losses', 'draws')]
+    for fen, expected in [
+            # training/ElementaryKingEndings
+            ('W:WK6,K9:BK15', (tablebase.WIN, 27)),
+            ('W:WK18:BK29,K30', (tablebase.DRAW, 0)),
+            # the king in the single corner can only step into a jump
+            ('B:WK22,K27:BK29', (tablebase.LOSS, 2))]:
+        position = game_from_fen(fen).curr_state.position()
+        assert tablebase.probe(directory, position, True) == expected, fen
+    # a slice read without its distances first still has them later
+    position = game_from_fen('B:WK22,K27:BK29').curr_state.position()
+    tablebase._loaded.clear()
+    assert tablebase.probe(directory, position) == (tablebase.LOSS, 0)
+    assert tablebase.probe(directory, position, True) == (tablebase.LOSS, 2)
+
+
+def test_tablebase_probes_the_files_in_place(tmp_path):
+    directory = str(tmp_path)
+    tablebase.generate(directory, 2, distances=True)
+    probes = Tablebase(directory, cache_pages=2)
+    assert probes.pieces == 2
+    board = Checkerboard()
+    for counts in tablebase.slices(2):
+        table = tablebase.Slice(counts)
+        for index in range(table.size):
+            position = table.position(index)
+            board.set_position(position)
+            assert probes.probe(board) == \
+                tablebase.probe(directory, position, True)
+    assert probes.hits and probes.misses
+    assert len(probes.pages) == 2
+    # more pieces than any slice has
+    assert probes.probe(game_from_fen('W:WK6,K9:BK15').curr_state) is None
+    probes.close()
+
+
+def test_search_scores_tablebase_positions_exactly(tmp_path):
+    directory = str(tmp_path)
+    tablebase.generate(directory, 2, distances=True)
+    probes = Tablebase(directory)
+    rng = random.Random(1)
+    game = checkers.Checkers()
+    board = game.curr_state
+    checkers.set_tablebase(probes)
+    try:
+        for counts in tablebase.slices(2):
+            table = tablebase.Slice(counts)
+            for index in rng.sample(range(table.size), 20):
+                board.set_position(table.position(index))
+                if not board.legal_moves:
+                    continue
+                # every move leads to a position the tablebase knows, so
+                # one ply finds the root's own exact score
+                expected = probes.score(board, 0)
+                stats = SearchStats()
+                score, move, _, _ = negamax_search(board, game, 1,
+                                                   stats=stats)
+                assert score == expected
+                assert stats.tb_hits == len(board.legal_moves)
+                assert games.alphabeta_search(board, game, 1) == move
+    finally:
+        checkers.set_tablebase(None)
+    # wins and losses score further from TABLEBASE_WIN the further off
+    # they are; draws score 0
+    for fen in ['W:WK6:B1', 'B:WK6:B1', 'B:WK22:B1']:
+        board.set_position(game_from_fen(fen).curr_state.position())
+        value, distance = probes.probe(board)
+        assert probes.score(board, 3) == \
+            {tablebase.WIN: 1, tablebase.LOSS: -1, tablebase.DRAW: 0}[
+                value] * (TABLEBASE_WIN - 3 - distance), fen
+    probes.close()
+
+
+def test_tablebase_without_distances_scores_wins_below_known_distances(
+        tmp_path):
+    with_distances = str(tmp_path / 'dtw')
+    without = str(tmp_path / 'wld')
+    tablebase.generate(with_distances, 2)
+    tablebase.generate(without, 2, distances=False)
+    exact, plain = Tablebase(with_distances), Tablebase(without)
+    board = Checkerboard()
+    scores = set()
+    positions = [game_from_fen(fen).curr_state.position()
+                 for fen in ['W:WK6:B1', 'B:WK6:B1', 'B:WK22:B1',
+                             'W:WK1:BK6']]
+    # a king about to be cornered
+    positions.append(tablebase.Slice((0, 1, 0, 1)).position(0))
+    values = set()
+    for position in positions:
+        board.set_position(position)
+        value, distance = plain.probe(board)
+        values.add(value)
+        assert distance is None
+        assert exact.probe(board)[0] == value
+        score = plain.score(board, 3)
+        if value == tablebase.DRAW:
+            assert score == 0
+            continue
+        # still a win or a loss, but nearer 0 than any with a distance,
+        # and told apart by the evaluation
+        assert 0 < abs(score) < abs(exact.score(board, 3))
+        assert abs(score) > TABLEBASE_KNOWN_WIN / 2
+        assert (score > 0) == (value == tablebase.WIN)
+        scores.add(score)
+    assert values == {tablebase.WIN, tablebase.LOSS, tablebase.DRAW}
+    assert len(scores) > 2
+    exact.close()
+    plain.close()
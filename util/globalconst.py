@@ -63,10 +63,24 @@ TITLE = 'Raven ' + VERSION
 PROGRAM_TITLE = 'Raven Checkers'
 CUR_DIR = sys.path[0]
 TRAINING_DIR = 'training'
+TABLEBASE_DIR = 'tablebase'
+# opening book built by game.book, and the plies of each game it takes
+BOOK_FILE = 'opening.book'
+BOOK_PLIES = 24
+# score of a tablebase win at the root; above any evaluation
+TABLEBASE_WIN = 10000
+# score of a tablebase win whose distance isn't known, to which the
+# evaluation is added; below any win whose distance is
+TABLEBASE_KNOWN_WIN = 5000
 
 # search values for transposition table
 hashfALPHA, hashfBETA, hashfEXACT = range(3)
 
+# default number of evaluations each process keeps in its cache
+EVAL_CACHE_SIZE = 2 ** 16
+# default number of game sessions the web service keeps in memory
+SESSION_CACHE_SIZE = 10000
+
 # constants for evaluation function
 TURN = 2      # color to move gets + turn
 BRV = 3       # multiplier for back rank
@@ -0,0 +1,90 @@
+"""Game sessions for the web service, kept by session id.
+
+Each game the service plays is a session: an id that /create_session
+issues and the client carries in its session cookie, and an item (the
+position, as a FEN) held under that id in the backing store, a
+util.storage store.
+
+The store keeps the items it has most recently read or written in
+memory, so a request for a game in play needs no round trip; the least
+recently used one makes way once the cache is full. Writes go through
+to the backing store at once, so a session outlives the process and the
+cache. A cached item is not read again, so a session is to be served by
+one process at a time."""
+
+import uuid
+from collections import OrderedDict
+
+from util.globalconst import SESSION_CACHE_SIZE
+
+
+class SessionStore(object):
+    """Session items by id, cached in front of a util.storage store.
+    connect is called on first use to return the store. Counts the hits
+    and misses of the cache."""
+
+    def __init__(self, connect, size=SESSION_CACHE_SIZE):
+        if size < 1:
+            raise ValueError("Cache size must be at least 1")
+        self.connect = connect
+        self.size = size
+        self._db = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = self.connect()
+        return self._db
+
+    def _cache(self, session_id, item):
+        entries = self.entries
+        entries[session_id] = item
+        entries.move_to_end(session_id)
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def create(self, item):
+        """Store item as a new session; return (session id, stored
+        item)."""
+        session_id = uuid.uuid4().hex
+        return session_id, self.put(session_id, item)
+
+    def get(self, session_id):
+        """Return the item of session_id, or None if there is no such
+        session. The item is shared with the cache: don't change it."""
+        item = self.entries.get(session_id)
+        if item is not None:
+            self.entries.move_to_end(session_id)
+            self.hits += 1
+            return item
+        self.misses += 1
+        item = self.db.get(session_id)
+        if item is not None:
+            self._cache(session_id, item)
+        return item
+
+    def put(self, session_id, item):
+        """Store item as the item of session_id, replacing any there was;
+        return it as stored."""
+        stored = self.db.put(session_id, item)
+        self._cache(session_id, stored)
+        return stored
+
+    def delete(self, session_id):
+        self.entries.pop(session_id, None)
+        self.db.delete(session_id)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return ('<SessionStore %d/%d cached hits=%d misses=%d>'
+                % (len(self.entries), self.size, self.hits, self.misses))
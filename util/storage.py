@@ -0,0 +1,269 @@
+"""Key-value storage for the web service.
+
+A store holds JSON items (dicts) by string key. Whatever the backend,
+put() returns the item as stored, with its key added under 'key', and
+get() returns it that way, or None for a key with no item. The batch
+operations take or return several items in as few round trips as the
+backend allows.
+
+Backends, chosen by name with open_storage():
+
+    'deta'      a Deta Base, over the network (deta must be installed)
+    'sqlite'    a table in a local SQLite file, in WAL mode, so that
+                readers don't wait on a writer; connections are pooled
+                and may be used from any thread
+    'memory'    a dict in this process, gone when it ends
+
+The local ones let the service run, and be load tested, offline."""
+
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ai.utils import abstract
+
+# SQLite file used when no path is given, and the connections it pools
+STORAGE_PATH = 'raven.db'
+POOL_SIZE = 4
+# items Deta takes in one put_many, and the SQLite parameters a
+# statement takes in older builds
+DETA_BATCH = 25
+SQLITE_BATCH = 500
+
+
+class StorageError(Exception):
+    """Raised when the store can't be reached in time."""
+
+
+def _stored(key, item):
+    return dict(item, key=key)
+
+
+class Storage(object):
+    """The operations every backend has. The batch operations default to
+    one call per item; backends override them where they can do
+    better."""
+
+    def get(self, key):
+        abstract()
+
+    def put(self, key, item):
+        abstract()
+
+    def delete(self, key):
+        abstract()
+
+    def get_many(self, keys):
+        """Return a dict of the stored items of keys, leaving out keys
+        with no item."""
+        items = {}
+        for key in keys:
+            item = self.get(key)
+            if item is not None:
+                items[key] = item
+        return items
+
+    def put_many(self, items):
+        """Store each item of items, a dict of items by key; return a
+        dict of them as stored."""
+        return {key: self.put(key, item) for key, item in items.items()}
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(Storage):
+    """Items in a dict. Each is copied on the way in and out, as it
+    would be serialized by the other backends."""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        item = self.items.get(key)
+        return dict(item) if item is not None else None
+
+    def put(self, key, item):
+        stored = _stored(key, item)
+        with self.lock:
+            self.items[key] = stored
+        return dict(stored)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return '<MemoryStorage %d items>' % len(self.items)
+
+
+class SQLiteStorage(Storage):
+    """Items as JSON in a table of a SQLite file. Up to pool_size
+    connections are opened as they're needed and kept for reuse; a
+    thread wanting one when all are taken waits up to timeout seconds
+    for one to come back, then raises StorageError. path is a file:
+    each connection to ':memory:' would have a database of its own, so
+    use MemoryStorage for that."""
+
+    def __init__(self, path=STORAGE_PATH, table='raven_db',
+                 pool_size=POOL_SIZE, timeout=5.0):
+        if pool_size < 1:
+            raise ValueError("Pool size must be at least 1")
+        if not table.isidentifier():
+            raise ValueError("Invalid table name %r" % table)
+        self.path = path
+        self.table = table
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        self.connections = []
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS %s '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+                         % table)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               check_same_thread=False,
+                               isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # with WAL, syncing at checkpoints only still can't corrupt the
+        # database; a crash may lose the last commits
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                conn = None
+                if len(self.connections) < self.pool_size:
+                    conn = self._connect()
+                    self.connections.append(conn)
+            if conn is None:
+                try:
+                    conn = self.pool.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise StorageError(
+                        'All %d connections to %s busy for %gs'
+                        % (self.pool_size, self.path, self.timeout))
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def get(self, key):
+        with self._connection() as conn:
+            row = conn.execute('SELECT value FROM %s WHERE key = ?'
+                               % self.table, (key,)).fetchone()
+        return _stored(key, json.loads(row[0])) if row else None
+
+    def put(self, key, item):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO %s (key, value) '
+                         'VALUES (?, ?)' % self.table,
+                         (key, json.dumps(item)))
+        return _stored(key, item)
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM %s WHERE key = ?' % self.table,
+                         (key,))
+
+    def get_many(self, keys):
+        keys = list(keys)
+        items = {}
+        with self._connection() as conn:
+            for i in range(0, len(keys), SQLITE_BATCH):
+                batch = keys[i:i + SQLITE_BATCH]
+                rows = conn.execute(
+                    'SELECT key, value FROM %s WHERE key IN (%s)'
+                    % (self.table, ', '.join('?' * len(batch))), batch)
+                for key, value in rows:
+                    items[key] = _stored(key, json.loads(value))
+        return items
+
+    def put_many(self, items):
+        with self._connection() as conn:
+            # one transaction, so one sync, for the lot
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany('INSERT OR REPLACE INTO %s (key, value) '
+                                 'VALUES (?, ?)' % self.table,
+                                 [(key, json.dumps(item))
+                                  for key, item in items.items()])
+        return {key: _stored(key, item) for key, item in items.items()}
+
+    def delete_many(self, keys):
+        with self._connection() as conn:
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany('DELETE FROM %s WHERE key = ?'
+                                 % self.table, [(key,) for key in keys])
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+            self.pool = queue.LifoQueue()
+
+    def __repr__(self):
+        return '<SQLiteStorage %s:%s %d/%d connections>' % (
+            self.path, self.table, len(self.connections), self.pool_size)
+
+
+class DetaStorage(Storage):
+    """Items in a Deta Base. project_key defaults to the one Deta finds
+    in the environment."""
+
+    def __init__(self, project_key=None, name='raven_db'):
+        from deta import Deta
+        self.name = name
+        self.base = Deta(project_key).Base(name)
+
+    def get(self, key):
+        return self.base.get(key)
+
+    def put(self, key, item):
+        return self.base.put(item, key)
+
+    def delete(self, key):
+        self.base.delete(key)
+
+    def put_many(self, items):
+        stored = [_stored(key, item) for key, item in items.items()]
+        for i in range(0, len(stored), DETA_BATCH):
+            self.base.put_many(stored[i:i + DETA_BATCH])
+        return {item['key']: item for item in stored}
+
+    def __repr__(self):
+        return '<DetaStorage %s>' % self.name
+
+
+BACKENDS = {'deta': DetaStorage, 'sqlite': SQLiteStorage,
+            'memory': MemoryStorage}
+
+
+def open_storage(backend, **options):
+    """Return a store of the backend named (see BACKENDS), made with
+    options."""
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown storage backend %r; use one of %s"
+                         % (backend, ', '.join(sorted(BACKENDS))))
+    return cls(**options)